@@ -1,47 +1,107 @@
-from flask import Flask, render_template
+from flask import Flask, render_template, request
 from flask_cors import CORS
 from flasgger import Swagger
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+import os, time
 
-from blueprints.auth.auth import auth_bp
+from blueprints.auth.auth import auth_bp, create_default_user
 from blueprints.patients.patients import patients_bp
 from blueprints.appointments.appointments import appointments_bp
 from blueprints.prescriptions.prescriptions import prescriptions_bp
 from blueprints.careplans.careplans import careplans_bp
 from blueprints.analytics.analytics import analytics_bp
-from utils import response
-
-# app setup
-app = Flask(__name__)
-CORS(app)
-Swagger(app)
-limiter = Limiter(app=app, key_func=get_remote_address)
-
-# register blueprints
-app.register_blueprint(auth_bp)
-app.register_blueprint(patients_bp)
-app.register_blueprint(appointments_bp)
-app.register_blueprint(prescriptions_bp)
-app.register_blueprint(careplans_bp)
-app.register_blueprint(analytics_bp)
-
-# get index
-@app.route("/")
-def index():
-    return render_template("index1.html")
-
-# get health check
-@app.route("/health", methods=["GET"])
-def health_check():
-    return response(True, message="API running and healthy", data={"service": "Multimedia GP Portal"})
-
-# error handler
-@app.errorhandler(Exception)
-def handle_exception(e):
-    print(f"[ERROR] {type(e).__name__}: {e}") 
-    return response(False, message=str(e), status=500)
+from utils import response, MongoJSONProvider
+from cache import analytics_cache
+import globals
+import compression
+import indexes
+import metrics
+import ratelimits
+
+# writes to patient data invalidate cached analytics
+WRITE_BLUEPRINTS = {bp.name for bp in (patients_bp, appointments_bp, prescriptions_bp, careplans_bp)}
+
+def invalidate_analytics(resp):
+    if request.blueprint in WRITE_BLUEPRINTS:
+        return analytics_cache.invalidate_after_write(resp)
+    return resp
+
+# one-off database setup, run once per deployment rather than by every worker:
+#   flask --app app init
+def init_db():
+    created = indexes.apply()
+    print(f"Created {len(created)} indexes" + (": " + ", ".join(created) if created else "."))
+    create_default_user()
+
+# app factory: no database access happens here, so workers forked by gunicorn
+# (`gunicorn "app:create_app()"`) start fast and each open their own connections
+def create_app():
+    app = Flask(__name__)
+    app.json = MongoJSONProvider(app)
+    CORS(app)
+    Swagger(app)
+    ratelimits.init_app(app, (auth_bp, patients_bp, appointments_bp, prescriptions_bp, careplans_bp, analytics_bp))
+    metrics.init_app(app)
+    compression.init_app(app)
+    app.after_request(invalidate_analytics)
+
+    # register blueprints
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(patients_bp)
+    app.register_blueprint(appointments_bp)
+    app.register_blueprint(prescriptions_bp)
+    app.register_blueprint(careplans_bp)
+    app.register_blueprint(analytics_bp)
+
+    @app.cli.command("init")
+    def init_command():
+        """Create the declared indexes and the default admin user."""
+        init_db()
+
+    # get index
+    @app.route("/")
+    def index():
+        return render_template("index1.html")
+
+    # get health check
+    @app.route("/health", methods=["GET"])
+    def health_check():
+        return response(True, message="API running and healthy", data={"service": "Multimedia GP Portal"})
+
+    # get readiness: this worker's connection pool can reach the database
+    @app.route("/ready", methods=["GET"])
+    def readiness_check():
+        started = time.perf_counter()
+        try:
+            globals.client.admin.command("ping")
+        except Exception as e:
+            return response(False, message=f"Database unavailable: {e}", status=503)
+        return response(True, message="Ready", data={
+            "pid": os.getpid(),
+            "ping_ms": round((time.perf_counter() - started) * 1000, 2),
+            "pool": {"max_size": globals.mongo_max_pool_size, "min_size": globals.mongo_min_pool_size}
+        })
+
+    # get metrics
+    @app.route("/metrics", methods=["GET"])
+    def metrics_endpoint():
+        return metrics.render()
+
+    # rate limit handler
+    @app.errorhandler(429)
+    def handle_rate_limit(e):
+        return response(False, message=f"Too many requests: {e.description}", status=429)
+
+    # error handler
+    @app.errorhandler(Exception)
+    def handle_exception(e):
+        print(f"[ERROR] {type(e).__name__}: {e}")
+        return response(False, message=str(e), status=500)
+
+    return app
+
+app = create_app()
 
 # main entry point
 if __name__ == "__main__":
+    init_db()
     app.run(debug=True)
@@ -0,0 +1,103 @@
+import asyncio, io, sys
+from concurrent.futures import ThreadPoolExecutor
+import globals
+from app import app as flask_app
+
+# ASGI entry point: `uvicorn asgi:app` (uvicorn is not in requirements.txt).
+# Connections and waiting requests live on the event loop, so thousands can be
+# in flight without a thread each; the unchanged Flask app (same routes,
+# decorators and response envelope) runs on bounded thread pools per route
+# class, so slow analytics aggregations queue behind each other instead of
+# starving the patient and sub-resource CRUD calls.
+ANALYTICS_PREFIXES = ("/api/v1.0/search", "/api/v1.0/stats", "/api/v1.0/geo")
+
+pools = {
+    "analytics": ThreadPoolExecutor(globals.asgi_analytics_workers, thread_name_prefix="asgi-analytics"),
+    "default": ThreadPoolExecutor(globals.asgi_workers, thread_name_prefix="asgi"),
+}
+
+def pool_for(path):
+    return pools["analytics" if path.startswith(ANALYTICS_PREFIXES) else "default"]
+
+# helper: WSGI environ for an ASGI http scope and its complete body
+def build_environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    # the body is already complete, whatever framing the client used
+    environ["CONTENT_LENGTH"] = str(len(body))
+    environ.pop("HTTP_TRANSFER_ENCODING", None)
+    return environ
+
+# helper: run the Flask app on a pool thread, returns (status, headers, body)
+def call_wsgi(environ):
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+    result = flask_app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return started["status"], started["headers"], body
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            for pool in pools.values():
+                pool.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+
+    environ = build_environ(scope, b"".join(chunks))
+    loop = asyncio.get_running_loop()
+    status, headers, body = await loop.run_in_executor(pool_for(scope["path"]), call_wsgi, environ)
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,12 @@
+import globals
+
+patients = globals.db["patients"]
+
+# set the list-view counters on patients written before they were maintained
+for array in ("appointments", "prescriptions", "careplans"):
+    counter = f"{array[:-1]}_count"
+    result = patients.update_many(
+        {counter: {"$exists": False}},
+        [{"$set": {counter: {"$size": {"$ifNull": [f"${array}", []]}}}}]
+    )
+    print(f"Backfilled '{counter}' on {result.modified_count} patients.")
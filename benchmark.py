@@ -0,0 +1,354 @@
+import argparse, base64, itertools, json, os, random, statistics, sys, threading, time
+import urllib.error, urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# endpoint benchmark: boots app.py on a local port against a benchmark database
+# (a local mongod, or mongomock with --mongomock), seeds a synthetic dataset
+# from scale_dataset.py and drives every route at each concurrency level,
+# reporting latency percentiles and throughput as JSON. --compare flags routes slower than a previous run.
+# mongomock does not implement every operator the app uses (expression and
+# positional projections, $near, $substrCP), so a few routes only report
+# errors there; use a real mongod for numbers worth comparing.
+#
+#   python benchmark.py --patients 2000 --concurrency 1,8,32 --out bench.json
+#   python benchmark.py --compare bench.json --out bench2.json
+
+# drop and reseed the benchmark database with synthetic patients learned from
+# the Synthea export, then build the rollups, map grid and search terms
+def seed(patient_count, seed_value, csv_dir):
+    import globals, geo_grid, rollups, search, scale_dataset
+    globals.db["analytics_cache"].drop()
+    profile = scale_dataset.Profile.learn(csv_dir)
+    scale_dataset.to_mongo(globals.db, profile.patients(seed_value, patient_count), drop=True)
+    search.rebuild()
+    geo_grid.rebuild()
+    try:
+        rollups.rebuild()
+    except NotImplementedError as e:
+        # mongomock lacks some of the rollup operators; /stats then runs the live aggregations
+        print(f"Rollups not built ({e}), /stats uses the live path")
+
+# start the app on a free local port in a background thread
+def serve(app):
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+# one request, returns (status, parsed body or None, seconds)
+def call(base, method, path, token=None, body=None, headers=None):
+    headers = dict(headers or {})
+    if token:
+        headers["x-access-token"] = token
+    data = None
+    if body is not None:
+        data = json.dumps(body).encode()
+        headers["Content-Type"] = "application/json"
+    req = urllib.request.Request(base + path, data=data, method=method, headers=headers)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req) as resp:
+            raw, status = resp.read(), resp.status
+    except urllib.error.HTTPError as e:
+        raw, status = e.read(), e.code
+    seconds = time.perf_counter() - started
+    try:
+        return status, json.loads(raw), seconds
+    except ValueError:
+        return status, None, seconds
+
+# ids the scenarios pick from, plus queues of records created by the *.create scenarios
+class Context:
+    def __init__(self, base, token, patient_ids, subs):
+        self.base = base
+        self.token = token
+        self.patient_ids = patient_ids
+        self.subs = subs
+        self.created = {name: deque() for name in ("patients", "appointments", "prescriptions", "careplans")}
+        # unused refresh tokens, each replaced by the one its refresh returns
+        self.refresh_tokens = deque()
+        # map tile holding the dataset, set once the app is imported
+        self.tile = (0, 0, 0)
+        self.rng = random.Random(0)
+        self.lock = threading.Lock()
+        self.counter = itertools.count(1)
+
+    def patient(self):
+        with self.lock:
+            return self.rng.choice(self.patient_ids)
+
+    def sub(self, kind):
+        with self.lock:
+            return self.rng.choice(self.subs[kind])
+
+    def take(self, name):
+        try:
+            return self.created[name].popleft()
+        except IndexError:
+            return None
+
+    # a number no other call gets, so update bodies always change something
+    def next(self):
+        with self.lock:
+            return next(self.counter)
+
+# helper: a date string that differs on every call
+def changing_date(ctx):
+    return (datetime(2025, 1, 1) + timedelta(days=ctx.next())).date().isoformat()
+
+# helper: a scenario creating a record and remembering its id for the matching delete
+def creates(name, path, body, id_field="id"):
+    def run(ctx):
+        pid = ctx.patient()
+        status, payload, seconds = call(ctx.base, "POST", path(pid), ctx.token, body)
+        if status == 201:
+            ctx.created[name].append((pid, payload["data"][id_field]))
+        return status, seconds
+    return run
+
+# helper: a scenario deleting a record made by the matching create
+def deletes(name, path):
+    def run(ctx):
+        item = ctx.take(name)
+        if item is None:
+            return None, 0.0
+        status, _, seconds = call(ctx.base, "DELETE", path(*item), ctx.token)
+        return status, seconds
+    return run
+
+# helper: a scenario sending one request built from the context; body may be a function of it
+def simple(method, path, body=None, auth=True, headers=None):
+    def run(ctx):
+        status, _, seconds = call(ctx.base, method, path(ctx), ctx.token if auth else None,
+                                  body(ctx) if callable(body) else body, headers(ctx) if headers else None)
+        return status, seconds
+    return run
+
+# helper: a scenario rotating one of the context's refresh tokens
+def refreshes():
+    def run(ctx):
+        try:
+            token = ctx.refresh_tokens.popleft()
+        except IndexError:
+            return None, 0.0
+        status, payload, seconds = call(ctx.base, "POST", f"{A}/auth/refresh", body={"refresh_token": token})
+        if status == 200:
+            ctx.refresh_tokens.append(payload["data"]["refresh_token"])
+        return status, seconds
+    return run
+
+# helper: a scenario logging out a session of its own (the login is not timed)
+def logs_out():
+    def run(ctx):
+        status, payload, _ = call(ctx.base, "GET", f"{A}/auth/login", headers=BASIC)
+        if status != 200:
+            return status, 0.0
+        pair = payload["data"]
+        status, _, seconds = call(ctx.base, "GET", f"{A}/auth/logout", pair["token"],
+                                  headers={"x-refresh-token": pair["refresh_token"]})
+        return status, seconds
+    return run
+
+# helper: body of a batch request adding count sub-documents of kind to random patients
+def bulk_body(kind, item, count=10):
+    return lambda ctx: {kind: [{"patient_id": ctx.patient(), **item} for _ in range(count)]}
+
+BASIC = {"Authorization": "Basic " + base64.b64encode(b"admin:admin123").decode()}
+P = "/api/v1.0/patients"
+A = "/api/v1.0"
+
+# (route name, scenario), run in this order so every delete follows its create
+SCENARIOS = [
+    ("app.health", simple("GET", lambda c: "/health", auth=False)),
+    ("app.ready", simple("GET", lambda c: "/ready", auth=False)),
+    ("app.metrics", simple("GET", lambda c: "/metrics", auth=False)),
+    ("auth.login", simple("GET", lambda c: f"{A}/auth/login", auth=False, headers=lambda c: BASIC)),
+    ("auth.verify", simple("GET", lambda c: f"{A}/auth/verify")),
+    ("auth.refresh", refreshes()),
+    ("auth.logout", logs_out()),
+    ("patients.list", simple("GET", lambda c: f"{P}/?page=3&limit=10")),
+    ("patients.list_filtered", simple("GET", lambda c: f"{P}/?condition=Asthma&limit=10")),
+    ("patients.get", simple("GET", lambda c: f"{P}/{c.patient()}")),
+    ("patients.create", creates("patients", lambda pid: f"{P}/",
+                                {"name": "Bench Patient", "age": 40, "gender": "F", "condition": "Asthma"})),
+    ("patients.bulk", simple("POST", lambda c: f"{P}/bulk", lambda c: {"patients": [
+        {"name": "Bench Patient", "age": 40, "gender": "F", "condition": "Asthma"} for _ in range(10)]})),
+    ("patients.update", simple("PUT", lambda c: f"{P}/{c.patient()}",
+                               lambda c: {"image_url": f"https://example.org/bench/{c.next()}.png"})),
+    ("patients.delete", deletes("patients", lambda pid, rid: f"{P}/{rid}")),
+    ("appointments.list", simple("GET", lambda c: f"{P}/{c.patient()}/appointments")),
+    ("appointments.get", simple("GET", lambda c: f"{P}/%s/%s" % c.sub("appointments"))),
+    ("appointments.create", creates("appointments", lambda pid: f"{P}/{pid}",
+                                    {"doctor": "Dr. Bench", "date": "2025-01-01", "notes": "Bench", "status": "scheduled"},
+                                    id_field="appointment_id")),
+    ("appointments.bulk", simple("POST", lambda c: f"{P}/bulk/appointments", bulk_body(
+        "appointments", {"doctor": "Dr. Bench", "date": "2025-01-01", "notes": "Bench", "status": "scheduled"}))),
+    ("appointments.update", simple("PUT", lambda c: f"{P}/%s/%s" % c.sub("appointments"),
+                                   lambda c: {"notes": f"Bench update {c.next()}"})),
+    ("appointments.delete", deletes("appointments", lambda pid, rid: f"{P}/{pid}/{rid}")),
+    ("prescriptions.list", simple("GET", lambda c: f"{P}/{c.patient()}/prescriptions")),
+    ("prescriptions.get", simple("GET", lambda c: f"{P}/%s/prescriptions/%s" % c.sub("prescriptions"))),
+    ("prescriptions.create", creates("prescriptions", lambda pid: f"{P}/{pid}/prescriptions",
+                                     {"name": "Bench Tablet", "start": "2025-01-01"})),
+    ("prescriptions.bulk", simple("POST", lambda c: f"{P}/bulk/prescriptions", bulk_body(
+        "prescriptions", {"name": "Bench Tablet", "start": "2025-01-01"}))),
+    ("prescriptions.update", simple("PUT", lambda c: f"{P}/%s/prescriptions/%s" % c.sub("prescriptions"),
+                                    lambda c: {"stop": changing_date(c)})),
+    ("prescriptions.delete", deletes("prescriptions", lambda pid, rid: f"{P}/{pid}/prescriptions/{rid}")),
+    ("careplans.list", simple("GET", lambda c: f"{P}/{c.patient()}/careplans")),
+    ("careplans.get", simple("GET", lambda c: f"{P}/%s/careplans/%s" % c.sub("careplans"))),
+    ("careplans.create", creates("careplans", lambda pid: f"{P}/{pid}/careplans",
+                                 {"description": "Bench Plan", "start": "2025-01-01"})),
+    ("careplans.bulk", simple("POST", lambda c: f"{P}/bulk/careplans", bulk_body(
+        "careplans", {"description": "Bench Plan", "start": "2025-01-01"}))),
+    ("careplans.update", simple("PUT", lambda c: f"{P}/%s/careplans/%s" % c.sub("careplans"),
+                                lambda c: {"stop": changing_date(c)})),
+    ("careplans.delete", deletes("careplans", lambda pid, rid: f"{P}/{pid}/careplans/{rid}")),
+    ("analytics.search", simple("GET", lambda c: f"{A}/search?q=murph&limit=10")),
+    ("analytics.stats_appointments", simple("GET", lambda c: f"{A}/stats/appointments?year=2020")),
+    ("analytics.stats_prescriptions", simple("GET", lambda c: f"{A}/stats/prescriptions?status=active")),
+    ("analytics.stats_careplans", simple("GET", lambda c: f"{A}/stats/careplans?gender=F")),
+    ("analytics.stats_overview", simple("GET", lambda c: f"{A}/stats/overview")),
+    ("analytics.geo_nearby", simple("GET", lambda c: f"{A}/geo/nearby?lon=-5.93&lat=54.6&max_distance=5000")),
+    ("analytics.geo_tile", simple("GET", lambda c: "%s/geo/tiles/%d/%d/%d" % (A, *c.tile))),
+    ("analytics.geo_tile_split", simple("GET", lambda c: "%s/geo/tiles/%d/%d/%d?split=condition" % (A, *c.tile))),
+    # admin endpoints
+    ("admin.cache_stats", simple("GET", lambda c: f"{A}/stats/cache")),
+    ("admin.slow_queries", simple("GET", lambda c: f"{A}/stats/slow-queries")),
+    ("admin.slow_queries_reset", simple("DELETE", lambda c: f"{A}/stats/slow-queries")),
+    ("admin.rollups_check", simple("GET", lambda c: f"{A}/stats/rollups/check")),
+    ("admin.rollups_rebuild", simple("POST", lambda c: f"{A}/stats/rollups/rebuild")),
+    ("admin.geo_rebuild", simple("POST", lambda c: f"{A}/geo/tiles/rebuild")),
+]
+
+# helper: latency summary of one route at one concurrency level
+def summarise(route, concurrency, samples, errors, wall):
+    ms = sorted(s * 1000 for s in samples)
+    cuts = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else ms * 99
+    return {
+        "route": route,
+        "concurrency": concurrency,
+        "requests": len(ms),
+        "errors": errors,
+        "p50_ms": round(cuts[49], 2) if ms else None,
+        "p95_ms": round(cuts[94], 2) if ms else None,
+        "p99_ms": round(cuts[98], 2) if ms else None,
+        "max_ms": round(ms[-1], 2) if ms else None,
+        "throughput_rps": round(len(ms) / wall, 1) if wall else None
+    }
+
+# run one scenario `count` times with `concurrency` threads
+def measure(ctx, route, scenario, count, concurrency):
+    samples, errors = [], 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for status, seconds in pool.map(lambda _: scenario(ctx), range(count)):
+            if status is None:
+                continue
+            if status >= 400:
+                errors += 1
+            samples.append(seconds)
+    return summarise(route, concurrency, samples, errors, time.perf_counter() - started)
+
+# routes whose p95 grew by more than threshold against a previous run
+def regressions(results, baseline, threshold):
+    before = {(r["route"], r["concurrency"]): r for r in baseline["results"]}
+    flagged = []
+    for r in results:
+        old = before.get((r["route"], r["concurrency"]))
+        if old and old["p95_ms"] and r["p95_ms"] and r["p95_ms"] > old["p95_ms"] * (1 + threshold):
+            flagged.append({"route": r["route"], "concurrency": r["concurrency"],
+                            "p95_ms_before": old["p95_ms"], "p95_ms_after": r["p95_ms"],
+                            "change": round(r["p95_ms"] / old["p95_ms"] - 1, 3)})
+    return flagged
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every API route")
+    parser.add_argument("--mongomock", action="store_true", help="run against an in-memory mongomock instead of MONGO_URI")
+    parser.add_argument("--db", default="benchmarkDB", help="database to (re)seed, never the application database")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--csv-dir", default=os.path.join("data", "synthea_csv"), help="Synthea export the dataset is modelled on")
+    parser.add_argument("--no-seed", action="store_true", help="reuse the data already in --db")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route and concurrency level")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--routes", help="comma separated route name prefixes to run")
+    parser.add_argument("--out", help="write the results as JSON")
+    parser.add_argument("--compare", help="previous results JSON to flag regressions against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p95 growth flagged as a regression")
+    args = parser.parse_args()
+
+    # the app reads its configuration at import time
+    os.environ["MONGO_DB"] = args.db
+    os.environ["RATELIMIT_ENABLED"] = "false"
+    if args.mongomock:
+        import mongomock, pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+    from app import app, init_db
+    import globals, geo_grid
+
+    if not args.no_seed:
+        started = time.perf_counter()
+        seed(args.patients, args.seed, args.csv_dir)
+        print(f"Seeded {args.patients} patients in {time.perf_counter() - started:.1f}s")
+    init_db()
+
+    server, base = serve(app)
+    token = call(base, "GET", f"{A}/auth/login", headers=BASIC)[1]["data"]["token"]
+    patient_ids = [str(d["_id"]) for d in globals.db["patients"].find({}, {"_id": 1}).limit(200)]
+    subs = {kind: [] for kind in ("appointments", "prescriptions", "careplans")}
+    for pid in patient_ids[:50]:
+        doc = call(base, "GET", f"{P}/{pid}", token)[1]["data"]
+        for kind in subs:
+            subs[kind] += [(pid, s["_id"]) for s in doc.get(kind, [])[:3]]
+    ctx = Context(base, token, patient_ids, subs)
+    ctx.tile = (10, *geo_grid.tile_of(-5.93, 54.6, 10))
+
+    levels = [int(c) for c in args.concurrency.split(",")]
+    # one refresh token per concurrent auth.refresh call
+    for _ in range(max(levels)):
+        ctx.refresh_tokens.append(call(base, "GET", f"{A}/auth/login", headers=BASIC)[1]["data"]["refresh_token"])
+    prefixes = args.routes.split(",") if args.routes else None
+    results = []
+    for route, scenario in SCENARIOS:
+        if prefixes and not any(route.startswith(p) for p in prefixes):
+            continue
+        for concurrency in levels:
+            result = measure(ctx, route, scenario, args.requests, concurrency)
+            results.append(result)
+            print(f"{route:<32} c={concurrency:<3} p50 {result['p50_ms']:>8} ms  p95 {result['p95_ms']:>8} ms  "
+                  f"p99 {result['p99_ms']:>8} ms  {result['throughput_rps']:>8} req/s  errors {result['errors']}")
+    server.shutdown()
+
+    report = {
+        "meta": {
+            "started_at": datetime.utcnow().isoformat(),
+            "backend": "mongomock" if args.mongomock else os.environ.get("MONGO_URI", "mongodb://localhost:27017/"),
+            "storage_mode": globals.storage_mode,
+            "patients": None if args.no_seed else args.patients,
+            "requests": args.requests,
+            "concurrency": levels
+        },
+        "results": results
+    }
+    flagged = []
+    if args.compare:
+        with open(args.compare) as f:
+            flagged = regressions(results, json.load(f), args.threshold)
+        report["regressions"] = flagged
+        for r in flagged:
+            print(f"REGRESSION {r['route']} c={r['concurrency']}: p95 {r['p95_ms_before']} -> {r['p95_ms_after']} ms")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if flagged else 0)
+
+if __name__ == "__main__":
+    main()
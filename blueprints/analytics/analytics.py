@@ -1,7 +1,15 @@
 from flask import Blueprint, jsonify, request
-from decorators import jwt_required
-from bson import ObjectId
+from decorators import jwt_required, admin_required
 import globals
+import subresources
+import rollups
+import search
+import slow_queries
+import geo
+import geo_grid
+from cache import analytics_cache
+import ratelimits
+from utils import encode_cursor, decode_cursor, cursor_keys, arg_flag, parse_fields
 
 analytics_bp = Blueprint("analytics_bp", __name__, url_prefix="/api/v1.0")
 patients = globals.db["patients"]
@@ -17,6 +25,7 @@ def parse_pagination():
 
 # get search
 @analytics_bp.route("/search", methods=["GET"])
+@ratelimits.search
 @jwt_required
 def search_patients():
     q = request.args.get("q", "")
@@ -25,65 +34,119 @@ def search_patients():
 
     if not q:
         return jsonify({"error": "Missing search query"}), 400
+    try:
+        fields = parse_fields()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    projection = {f: 1 for f in fields} if fields else {"search_terms": 0}
+
+    filters = {}
+    if gender:
+        filters["gender"] = {"$regex": gender, "$options": "i"}
 
-    filters = {
-        "$or": [
+    # cursor mode: ?after=<next_cursor> seeks past the last row instead of skipping
+    after = request.args.get("after")
+    after_id = decode_cursor(after) if after else None
+    if after and not after_id:
+        return jsonify({"error": "Invalid cursor"}), 400
+    include_total = arg_flag("include_total", default=not after)
+    total = None
+
+    if search.ready():
+        # ranked trigram search, ordered by score then _id
+        after_score = (cursor_keys(after) or {}).get("score") if after else None
+        if after and after_score is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+        stages = search.pipeline(q, filters, (after_score, after_id) if after else None)
+        stages.append({"$sort": {"score": -1, "_id": 1}})
+        if not after:
+            stages.append({"$skip": skip})
+        stages += [
+            {"$limit": limit + 1},
+            {"$project": {**projection, "score": 1} if fields else projection},
+        ]
+        docs = list(patients.aggregate(stages))
+        if include_total:
+            total = next(patients.aggregate(search.pipeline(q, filters) + [{"$count": "n"}]), {"n": 0})["n"]
+    else:
+        # search terms not built yet: unanchored regex scan
+        filters["$or"] = [
             {"name": {"$regex": q, "$options": "i"}},
             {"condition": {"$regex": q, "$options": "i"}},
         ]
-    }
-    if gender:
-        filters["gender"] = {"$regex": gender, "$options": "i"}
+        if after:
+            cursor = patients.find({**filters, "_id": {"$gt": after_id}}, projection)
+        else:
+            cursor = patients.find(filters, projection).skip(skip)
+        docs = list(cursor.sort("_id", 1).limit(limit + 1))
+        if include_total:
+            total = patients.count_documents(filters)
 
-    cursor = patients.find(filters).skip(skip).limit(limit)
-    data = []
-    for p in cursor:
-        p["_id"] = str(p["_id"])
-        for field in ["appointments", "prescriptions", "careplans"]:
-            if field in p:
-                for sub in p[field]:
-                    if isinstance(sub.get("_id"), ObjectId):
-                        sub["_id"] = str(sub["_id"])
-        data.append(p)
-
-    total = patients.count_documents(filters)
-    return jsonify({
+    last = docs[limit - 1] if len(docs) > limit else None
+    next_cursor = encode_cursor(last["_id"], **({"score": last["score"]} if "score" in last else {})) if last else None
+
+    data = subresources.attach(docs[:limit], fields)
+
+    result = {
         "query": q,
         "filters": {"gender": gender or "all"},
         "count": len(data),
-        "total": total,
-        "skip": skip,
         "limit": limit,
+        "next_cursor": next_cursor,
         "results": data
-    })
-
-# get appointment stats
-@analytics_bp.route("/stats/appointments", methods=["GET"])
-@jwt_required
-def appointment_stats():
-    year = request.args.get("year")
-    gender = request.args.get("gender")
-    skip, limit = parse_pagination()
+    }
+    if not after:
+        result["skip"] = skip
+    if include_total:
+        result["total"] = total
+    return jsonify(result)
 
-    match_stage = {}
+# helper: stats filters as matches on the rollup dimensions
+def rollup_filters(year=None, gender=None, status=None):
+    match = {}
     if year:
-        match_stage["appointments.date"] = {"$regex": year}
+        match["year"] = {"$regex": year}
     if gender:
-        match_stage["gender"] = {"$regex": gender, "$options": "i"}
+        match["gender"] = {"$regex": gender, "$options": "i"}
+    if status:
+        match["status"] = status
+    return match
 
-    pipeline = [{"$unwind": "$appointments"}]
+# helper: live aggregation over the source data, used until the rollups are built
+def live_stats(kind, label, match_stage, need_gender, skip, limit):
+    source, pipeline = subresources.unwound(kind, need_gender)
     if match_stage:
         pipeline.append({"$match": match_stage})
 
     pipeline += [
-        {"$group": {"_id": "$appointments.doctor", "count": {"$sum": 1}}},
+        {"$group": {"_id": f"${kind}.{label}", "count": {"$sum": 1}}},
         {"$sort": {"count": -1}},
         {"$skip": skip},
         {"$limit": limit},
-        {"$project": {"doctor": "$_id", "count": 1, "_id": 0}},
+        {"$project": {rollups.LABELS[kind]: "$_id", "count": 1, "_id": 0}},
     ]
+    return list(source.aggregate(pipeline))
+
+# get appointment stats
+@analytics_bp.route("/stats/appointments", methods=["GET"])
+@ratelimits.analytics
+@jwt_required
+@analytics_cache.cached(("year", "gender", "skip", "limit"))
+def appointment_stats():
+    year = request.args.get("year")
+    gender = request.args.get("gender")
+    skip, limit = parse_pagination()
+
+    if rollups.ready():
+        stats = rollups.top("appointments", rollup_filters(year=year, gender=gender), skip, limit)
+    else:
+        match_stage = {}
+        if year:
+            match_stage["appointments.date"] = {"$regex": year}
+        if gender:
+            match_stage["gender"] = {"$regex": gender, "$options": "i"}
+        stats = live_stats("appointments", "doctor", match_stage, bool(gender), skip, limit)
 
-    stats = list(patients.aggregate(pipeline))
     return jsonify({
         "filters": {"year": year or "all", "gender": gender or "all"},
         "skip": skip,
@@ -93,30 +156,24 @@ def appointment_stats():
 
 # get prescription stats
 @analytics_bp.route("/stats/prescriptions", methods=["GET"])
+@ratelimits.analytics
 @jwt_required
+@analytics_cache.cached(("status", "gender", "skip", "limit"))
 def prescription_stats():
     status = request.args.get("status")
     gender = request.args.get("gender")
     skip, limit = parse_pagination()
 
-    pipeline = [{"$unwind": "$prescriptions"}]
-    match_stage = {}
-    if status:
-        match_stage["prescriptions.status"] = status
-    if gender:
-        match_stage["gender"] = {"$regex": gender, "$options": "i"}
-    if match_stage:
-        pipeline.append({"$match": match_stage})
+    if rollups.ready():
+        stats = rollups.top("prescriptions", rollup_filters(status=status, gender=gender), skip, limit)
+    else:
+        match_stage = {}
+        if status:
+            match_stage["prescriptions.status"] = status
+        if gender:
+            match_stage["gender"] = {"$regex": gender, "$options": "i"}
+        stats = live_stats("prescriptions", "name", match_stage, bool(gender), skip, limit)
 
-    pipeline += [
-        {"$group": {"_id": "$prescriptions.name", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-        {"$skip": skip},
-        {"$limit": limit},
-        {"$project": {"medication": "$_id", "count": 1, "_id": 0}},
-    ]
-
-    stats = list(patients.aggregate(pipeline))
     return jsonify({
         "filters": {"status": status or "all", "gender": gender or "all"},
         "skip": skip,
@@ -126,30 +183,24 @@ def prescription_stats():
 
 # get careplan stats
 @analytics_bp.route("/stats/careplans", methods=["GET"])
+@ratelimits.analytics
 @jwt_required
+@analytics_cache.cached(("year", "gender", "skip", "limit"))
 def careplan_stats():
     year = request.args.get("year")
     gender = request.args.get("gender")
     skip, limit = parse_pagination()
 
-    pipeline = [{"$unwind": "$careplans"}]
-    match_stage = {}
-    if year:
-        match_stage["careplans.start"] = {"$regex": year}
-    if gender:
-        match_stage["gender"] = {"$regex": gender, "$options": "i"}
-    if match_stage:
-        pipeline.append({"$match": match_stage})
-
-    pipeline += [
-        {"$group": {"_id": "$careplans.description", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-        {"$skip": skip},
-        {"$limit": limit},
-        {"$project": {"careplan": "$_id", "count": 1, "_id": 0}},
-    ]
+    if rollups.ready():
+        stats = rollups.top("careplans", rollup_filters(year=year, gender=gender), skip, limit)
+    else:
+        match_stage = {}
+        if year:
+            match_stage["careplans.start"] = {"$regex": year}
+        if gender:
+            match_stage["gender"] = {"$regex": gender, "$options": "i"}
+        stats = live_stats("careplans", "description", match_stage, bool(gender), skip, limit)
 
-    stats = list(patients.aggregate(pipeline))
     return jsonify({
         "filters": {"year": year or "all", "gender": gender or "all"},
         "skip": skip,
@@ -159,83 +210,245 @@ def careplan_stats():
 
 # get overview stats
 @analytics_bp.route("/stats/overview", methods=["GET"])
+@ratelimits.overview
 @jwt_required
+@analytics_cache.cached(("gender", "limit"))
 def overview_stats():
     gender = request.args.get("gender")
     limit = int(request.args.get("limit", 5))
 
+    if rollups.ready():
+        match = rollup_filters(gender=gender)
+        return jsonify({
+            "filters": {"gender": gender or "all"},
+            "limit": limit,
+            "results": {
+                "top_doctors": rollups.top("appointments", match, limit=limit),
+                "top_medications": rollups.top("prescriptions", match, limit=limit),
+                "active_careplans": rollups.top("careplans", {**match, "active": True}, limit=limit),
+            }
+        })
+
     match_stage = {"gender": {"$regex": gender, "$options": "i"}} if gender else {}
-    pipeline = []
-    if match_stage:
-        pipeline.append({"$match": match_stage})
+    facets = {
+        "top_doctors": ("appointments", [
+            {"$group": {"_id": "$appointments.doctor", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": limit},
+            {"$project": {"doctor": "$_id", "count": 1, "_id": 0}},
+        ]),
+        "top_medications": ("prescriptions", [
+            {"$group": {"_id": "$prescriptions.name", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": limit},
+            {"$project": {"medication": "$_id", "count": 1, "_id": 0}},
+        ]),
+        "active_careplans": ("careplans", [
+            {
+                "$match": {
+                    "$or": [
+                        {"careplans.stop": "Unknown"},
+                        {"careplans.stop": {"$exists": False}},
+                    ]
+                }
+            },
+            {"$group": {"_id": "$careplans.description", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": limit},
+            {"$project": {"careplan": "$_id", "count": 1, "_id": 0}},
+        ]),
+    }
 
-    pipeline.append({
-        "$facet": {
-            "top_doctors": [
-                {"$unwind": "$appointments"},
-                {"$group": {"_id": "$appointments.doctor", "count": {"$sum": 1}}},
-                {"$sort": {"count": -1}},
-                {"$limit": limit},
-                {"$project": {"doctor": "$_id", "count": 1, "_id": 0}},
-            ],
-            "top_medications": [
-                {"$unwind": "$prescriptions"},
-                {"$group": {"_id": "$prescriptions.name", "count": {"$sum": 1}}},
-                {"$sort": {"count": -1}},
-                {"$limit": limit},
-                {"$project": {"medication": "$_id", "count": 1, "_id": 0}},
-            ],
-            "active_careplans": [
-                {"$unwind": "$careplans"},
-                {
-                    "$match": {
-                        "$or": [
-                            {"careplans.stop": "Unknown"},
-                            {"careplans.stop": {"$exists": False}},
-                        ]
-                    }
-                },
-                {"$group": {"_id": "$careplans.description", "count": {"$sum": 1}}},
-                {"$sort": {"count": -1}},
-                {"$limit": limit},
-                {"$project": {"careplan": "$_id", "count": 1, "_id": 0}},
-            ],
-        }
-    })
+    if subresources.split_mode():
+        results = {}
+        for name, (kind, stages) in facets.items():
+            source, pipeline = subresources.unwound(kind, bool(gender))
+            if name == "active_careplans":
+                # stop is always set in the careplans collection (migrate_subresources.py fills in
+                # "Unknown"), so this first stage can use the partial index on active careplans
+                pipeline.insert(0, {"$match": {"stop": "Unknown"}})
+            if match_stage:
+                pipeline.append({"$match": match_stage})
+            results[name] = list(source.aggregate(pipeline + stages))
+        stats = [results]
+    else:
+        pipeline = []
+        if match_stage:
+            pipeline.append({"$match": match_stage})
+        pipeline.append({"$facet": {
+            name: [{"$unwind": f"${kind}"}] + stages for name, (kind, stages) in facets.items()
+        }})
+        stats = list(patients.aggregate(pipeline))
 
-    stats = list(patients.aggregate(pipeline))
     return jsonify({
         "filters": {"gender": gender or "all"},
         "limit": limit,
         "results": stats[0] if stats else {}
     })
 
+# share of the search radius one geohash cell may span: the query point is moved
+# to the centre of its cell, so distances are exact to within half a cell and
+# panning inside a cell is served from the cache
+NEARBY_CELL_FRACTION = 0.05
+
+# helper: (lon, lat, max_distance in meters) from the query string, raises ValueError
+def nearby_args():
+    try:
+        lon = float(request.args.get("lon"))
+        lat = float(request.args.get("lat"))
+        max_distance = int(request.args.get("max_distance", 5000))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid or missing coordinates")
+    if not (-180 <= lon <= 180 and -90 <= lat <= 90) or max_distance <= 0:
+        raise ValueError("Invalid or missing coordinates")
+    return lon, lat, max_distance
+
+# helper: geohash cell of the nearby query point, "" if the point is invalid
+def nearby_cell():
+    try:
+        lon, lat, max_distance = nearby_args()
+    except ValueError:
+        return ""
+    return geo.geohash(lat, lon, geo.precision_for(max_distance * NEARBY_CELL_FRACTION, lat))
+
 # get geo nearby
 @analytics_bp.route("/geo/nearby", methods=["GET"])
+@ratelimits.search
 @jwt_required
+@analytics_cache.cached(("max_distance", "town", "condition", "limit", "after"), extra=nearby_cell)
 def nearby_patients():
     try:
-        lon = float(request.args.get("lon"))
-        lat = float(request.args.get("lat"))
-        max_distance = int(request.args.get("max_distance", 5000))  # meters
-    except (TypeError, ValueError):
-        return jsonify({"error": "Invalid or missing coordinates"}), 400
+        lon, lat, max_distance = nearby_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        limit = max(1, min(50, int(request.args.get("limit", 10))))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
 
-    query = {
-        "location": {
-            "$near": {
-                "$geometry": {"type": "Point", "coordinates": [lon, lat]},
-                "$maxDistance": max_distance
-            }
-        }
+    cell = nearby_cell()
+    cell_lat, cell_lon = geo.cell_centre(cell)
+    filters = {f: request.args[f] for f in ("town", "condition") if request.args.get(f)}
+    near = {
+        "near": {"type": "Point", "coordinates": [cell_lon, cell_lat]},
+        "distanceField": "distance",
+        "maxDistance": max_distance,
+        "key": "location",
+        "spherical": True,
+        "query": filters
     }
+    pipeline = [{"$geoNear": near}]
 
-    results = list(patients.find(query, {"name": 1, "town": 1, "location": 1}).limit(10))
+    # keyset paging on (distance, _id) with ?after=<next_cursor> as on /patients and
+    # /search: the next page starts at the last distance returned
+    after = request.args.get("after")
+    if after:
+        keys = cursor_keys(after)
+        last_id = decode_cursor(after)
+        if last_id is None or not isinstance(keys.get("distance"), (int, float)):
+            return jsonify({"error": "Invalid cursor"}), 400
+        near["minDistance"] = keys["distance"]
+        pipeline.append({"$match": {"$or": [
+            {"distance": {"$gt": keys["distance"]}},
+            {"distance": keys["distance"], "_id": {"$gt": last_id}}
+        ]}})
+    pipeline += [
+        {"$sort": {"distance": 1, "_id": 1}},
+        {"$limit": limit + 1},
+        {"$project": {"name": 1, "town": 1, "condition": 1, "location": 1, "distance": 1}}
+    ]
+    docs = list(patients.aggregate(pipeline))
+
+    last = docs[limit - 1] if len(docs) > limit else None
+    results = docs[:limit]
+    next_cursor = encode_cursor(last["_id"], distance=last["distance"]) if last else None
     for r in results:
-        r["_id"] = str(r["_id"])
+        r["distance"] = round(r["distance"], 1)
 
+    # the body is shared by every point of the cell, so it echoes the cell centre the distances are measured from
     return jsonify({
-        "query": {"lon": lon, "lat": lat, "max_distance": max_distance},
+        "query": {"lon": cell_lon, "lat": cell_lat, "max_distance": max_distance, "cell": cell, **filters},
         "count": len(results),
+        "limit": limit,
+        "next_cursor": next_cursor,
         "nearby_patients": results
     })
+
+# get map tile: patient counts per grid cell, optionally split by condition or age_group
+@analytics_bp.route("/geo/tiles/<int:z>/<int:x>/<int:y>", methods=["GET"])
+@ratelimits.tiles
+@jwt_required
+@analytics_cache.cached(("split",), extra=lambda: request.path)
+def geo_tile(z, x, y):
+    if z > geo_grid.MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        return jsonify({"error": "Invalid tile"}), 400
+    split = request.args.get("split")
+    if split and split not in geo_grid.SPLITS:
+        return jsonify({"error": f"split must be one of {', '.join(geo_grid.SPLITS)}"}), 400
+
+    result = geo_grid.tile(z, x, y, split)
+    return jsonify({
+        "tile": {"z": z, "x": x, "y": y, "bounds": geo_grid.bounds(z, x, y)},
+        "split": split,
+        "total": sum(c["count"] for c in result["cells"]),
+        **result
+    })
+
+# post rebuild map grid counters
+@analytics_bp.route("/geo/tiles/rebuild", methods=["POST"])
+@ratelimits.analytics
+@jwt_required
+@admin_required
+def rebuild_geo_grid():
+    counters = geo_grid.rebuild()
+    analytics_cache.invalidate()
+    return jsonify({"message": "Geo grid rebuilt", "counters": counters})
+
+# post rebuild rollups
+@analytics_bp.route("/stats/rollups/rebuild", methods=["POST"])
+@ratelimits.analytics
+@jwt_required
+@admin_required
+def rebuild_rollups():
+    rollups.rebuild()
+    analytics_cache.invalidate()
+    return jsonify({"message": "Rollups rebuilt"})
+
+# get rollup consistency check
+@analytics_bp.route("/stats/rollups/check", methods=["GET"])
+@ratelimits.analytics
+@jwt_required
+@admin_required
+def check_rollups():
+    report = rollups.check()
+    return jsonify({
+        "consistent": not any(report.values()),
+        "mismatches": report
+    })
+
+# get analytics cache stats
+@analytics_bp.route("/stats/cache", methods=["GET"])
+@jwt_required
+@admin_required
+def cache_stats():
+    return jsonify(analytics_cache.stats())
+
+# get slow query shapes by total time
+@analytics_bp.route("/stats/slow-queries", methods=["GET"])
+@jwt_required
+@admin_required
+def slow_query_stats():
+    _, limit = parse_pagination()
+    return jsonify({
+        "threshold_ms": slow_queries.slow_query_ms,
+        "count": len(slow_queries.shapes),
+        "results": slow_queries.top(limit)
+    })
+
+# delete slow query log
+@analytics_bp.route("/stats/slow-queries", methods=["DELETE"])
+@jwt_required
+@admin_required
+def reset_slow_queries():
+    slow_queries.reset()
+    return jsonify({"message": "Slow query log cleared"})
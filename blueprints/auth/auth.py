@@ -1,39 +1,127 @@
-from flask import Blueprint, request
-import jwt, bcrypt, datetime
+from flask import Blueprint, request, g
+from bson import ObjectId
+import jwt, datetime, hashlib, secrets
 import globals
-from decorators import jwt_required
+import passwords
+from decorators import jwt_required, revoked
 from utils import response  
+import ratelimits
 
 auth_bp = Blueprint('auth_bp', __name__, url_prefix='/api/v1.0/auth')
 users = globals.db['users']
-blacklist = globals.db['blacklist']
+# refresh tokens are opaque random strings stored by their sha256; each is
+# single-use and replaced on refresh, and presenting a used one again revokes
+# every token descended from the same login (its family)
+refresh_tokens = globals.db['refresh_tokens']
+
+# helper: signed access token, naming the refresh family it was issued with so
+# logout can end the session; jti keeps tokens issued in the same second distinct
+def access_token(username, admin, family):
+    return jwt.encode({
+        'user': username,
+        'admin': admin,
+        'family': str(family),
+        'jti': secrets.token_urlsafe(8),
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=globals.access_token_minutes)
+    }, globals.secret_key, algorithm="HS256")
+
+def token_hash(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+# helper: store a new refresh token in a family
+def issue_refresh_token(username, family):
+    token = secrets.token_urlsafe(32)
+    refresh_tokens.insert_one({
+        '_id': token_hash(token),
+        'family': family,
+        'username': username,
+        'used_at': None,
+        'expires_at': datetime.datetime.utcnow() + datetime.timedelta(days=globals.refresh_token_days)
+    })
+    return token
+
+# helper: access and refresh token pair for a response
+def token_pair(username, admin, family=None):
+    family = family or ObjectId()
+    return {
+        'token': access_token(username, admin, family),
+        'expires_in': globals.access_token_minutes * 60,
+        'refresh_token': issue_refresh_token(username, family)
+    }
+
+# helper: refresh token from the x-refresh-token header or the JSON body
+def incoming_refresh_token():
+    body = request.get_json(silent=True) or {}
+    token = request.headers.get('x-refresh-token') or body.get('refresh_token')
+    return token if isinstance(token, str) else None
+
+# helper: mark every unused token of a family as used
+def revoke_family(family):
+    refresh_tokens.update_many({'family': family, 'used_at': None}, {'$set': {'used_at': datetime.datetime.utcnow()}})
 
 # get login
 @auth_bp.route('/login', methods=['GET'])
+@ratelimits.login
 def login():
     auth = request.authorization
     if not auth:
         return response(False, message='Authentication required', status=401)
 
-    user = users.find_one({'username': auth.username})
-    if not user or not bcrypt.checkpw(auth.password.encode('utf-8'), user['password']):
+    user = users.find_one({'username': auth.username}, {'password': 1, 'admin': 1})
+    try:
+        valid = user is not None and passwords.check_password(auth.password, user['password'])
+    except passwords.Busy as e:
+        return response(False, message=str(e), status=503)
+    if not valid:
         return response(False, message='Invalid credentials', status=401)
 
-    token = jwt.encode({
-        'user': auth.username,
-        'admin': user.get('admin', False),
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=45)
-    }, globals.secret_key, algorithm="HS256")
+    return response(True, data=token_pair(auth.username, user.get('admin', False)), message='Login successful')
+
+# post refresh: swap a refresh token for a new access and refresh token
+@auth_bp.route('/refresh', methods=['POST'])
+def refresh():
+    token = incoming_refresh_token()
+    if not token:
+        return response(False, message='Refresh token missing', status=401)
 
-    return response(True, data={'token': token}, message='Login successful')
+    now = datetime.datetime.utcnow()
+    doc = refresh_tokens.find_one_and_update(
+        {'_id': token_hash(token), 'used_at': None, 'expires_at': {'$gt': now}},
+        {'$set': {'used_at': now}},
+        projection={'family': 1, 'username': 1}
+    )
+    if not doc:
+        used = refresh_tokens.find_one({'_id': token_hash(token), 'used_at': {'$ne': None}}, {'family': 1})
+        if used:
+            revoke_family(used['family'])
+        return response(False, message='Refresh token invalid', status=401)
 
-# get logout
+    # the role comes from the current user record, a deleted user loses the whole family
+    user = users.find_one({'username': doc['username']}, {'admin': 1})
+    if not user:
+        revoke_family(doc['family'])
+        return response(False, message='Refresh token invalid', status=401)
+
+    return response(True, data=token_pair(doc['username'], user.get('admin', False), doc['family']),
+                    message='Token refreshed')
+
+# get logout: revokes the access token and the refresh family it belongs to
 @auth_bp.route('/logout', methods=['GET'])
 @jwt_required
 def logout():
-    token = request.headers.get('x-access-token')
+    revoked.revoke(g.token, g.token_data.get('exp'))
+    user = g.token_data.get('user')
+    families = set()
+    if ObjectId.is_valid(g.token_data.get('family')):
+        families.add(ObjectId(g.token_data['family']))
+    # a refresh token sent along may come from another session of the same user
+    token = incoming_refresh_token()
     if token:
-        blacklist.insert_one({"token": token})
+        doc = refresh_tokens.find_one({'_id': token_hash(token), 'username': user}, {'family': 1})
+        if doc:
+            families.add(doc['family'])
+    for family in families:
+        revoke_family(family)
     return response(True, message='Logged out successfully')
 
 # get verify
@@ -45,8 +133,6 @@ def verify_token():
 # helper: create default admin user
 def create_default_user():
     if users.find_one({'username': 'admin'}) is None:
-        hashed_pw = bcrypt.hashpw(b'admin123', bcrypt.gensalt())
+        hashed_pw = passwords.hash_password('admin123')
         users.insert_one({'username': 'admin', 'password': hashed_pw, 'admin': True})
         print("Default admin user created: admin/admin123")
-
-create_default_user()
@@ -2,12 +2,37 @@ from flask import Blueprint, request
 from bson import ObjectId
 import re
 import globals
+import geo_grid
+import subresources
+import search
 from decorators import jwt_required, admin_required
-from utils import response 
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+from utils import response, encode_cursor, decode_cursor, arg_flag, parse_fields, bulk_items, bulk_response, conditional, not_modified, age_group
 
 patients_bp = Blueprint('patients_bp', __name__, url_prefix='/api/v1.0/patients')
 patients = globals.db["patients"]
 
+DIGITS = re.compile(r"\d+")
+
+# helper: counter maintained by the sub-resource blueprints, with a server-side $size for older documents
+def count_field(array):
+    return {"$ifNull": [f"${array[:-1]}_count", {"$size": {"$ifNull": [f"${array}", []]}}]}
+
+# list view projection: summary fields only, never the embedded sub-resources
+LIST_PROJECTION = {
+    "name": 1,
+    "age": 1,
+    "gender": 1,
+    "condition": 1,
+    "appointment_count": count_field("appointments"),
+    "prescription_count": count_field("prescriptions"),
+    "careplan_count": count_field("careplans")
+}
+LIST_OPTIONAL_FIELDS = ("image_url", "town", "age_group", "last_updated")
+# fields a single patient can be narrowed to, internal ones such as search_terms stay hidden
+DETAIL_FIELDS = (*LIST_PROJECTION, *LIST_OPTIONAL_FIELDS, "location", "appointments", "prescriptions", "careplans")
+
 # helper: validate objectid
 def is_valid_objectid(id):
     return bool(re.fullmatch(r"[0-9a-fA-F]{24}", id))
@@ -28,8 +53,17 @@ def validate_patient_data(data):
         return "Age must be a number"
     if not all(k in data for k in ("name", "age", "gender", "condition")):
         return "Missing required fields"
+    if data.get("location") is not None and parse_location(data["location"]) is None:
+        return "Location must be a GeoJSON Point"
     return None
 
+# helper: GeoJSON point from input, None if invalid
+def parse_location(value):
+    if not isinstance(value, dict) or value.get("type") != "Point":
+        return None
+    point = geo_grid.point_of({"location": value})
+    return {"type": "Point", "coordinates": list(point)} if point else None
+
 # get patients
 @patients_bp.route("/", methods=["GET"])
 @jwt_required
@@ -39,31 +73,71 @@ def get_patients():
         limit = max(1, min(50, int(request.args.get("limit", 10))))
     except ValueError:
         return response(False, message="Invalid pagination parameters", status=400)
+    try:
+        fields = parse_fields(set(LIST_PROJECTION) | set(LIST_OPTIONAL_FIELDS)) or list(LIST_PROJECTION)
+    except ValueError as e:
+        return response(False, message=str(e), status=400)
+    projection = {f: LIST_PROJECTION.get(f, 1) for f in fields}
 
     query = {}
     if request.args.get("condition"):
         query["condition"] = {"$regex": request.args["condition"], "$options": "i"}
 
-    docs = list(patients.find(query).skip((page - 1) * limit).limit(limit))
-    total = patients.count_documents(query)
-
-    results = [{
-        "id": str(p["_id"]),
-        "name": re.sub(r"\d+", "", str(p.get("name", ""))).strip().title(),
-        "age": p.get("age"),
-        "gender": p.get("gender"),
-        "condition": p.get("condition"),
-        "appointment_count": len(p.get("appointments", [])),
-        "prescription_count": len(p.get("prescriptions", [])),
-        "careplan_count": len(p.get("careplans", []))
-    } for p in docs]
-
-    return response(True, data={
-        "page": page,
+    # cursor mode: ?after=<next_cursor> seeks past the last _id instead of skipping
+    after = request.args.get("after")
+    if after:
+        after_id = decode_cursor(after)
+        if not after_id:
+            return response(False, message="Invalid cursor", status=400)
+        cursor = patients.find({**query, "_id": {"$gt": after_id}}, projection)
+    else:
+        cursor = patients.find(query, projection).skip((page - 1) * limit)
+    docs = list(cursor.sort("_id", 1).limit(limit + 1))
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+
+    results = []
+    for p in docs:
+        row = {"id": str(p["_id"])}
+        for f in fields:
+            row[f] = p.get(f)
+        if "name" in row:
+            row["name"] = DIGITS.sub("", str(row["name"] or "")).strip().title()
+        results.append(row)
+
+    data = {
         "count": len(results),
-        "total": total,
-        "patients": results
-    })
+        "patients": results,
+        "next_cursor": encode_cursor(docs[-1]["_id"]) if has_more else None
+    }
+    if not after:
+        data["page"] = page
+    # totals default on for page mode (the frontend pages by them), off for cursor mode
+    if arg_flag("include_total", default=not after):
+        data["total"] = patients.count_documents(query) if query else patients.estimated_document_count()
+
+    return response(True, data=data)
+
+# helper: new patient document from validated input
+def new_patient_doc(body):
+    new_patient = {
+        "name": body["name"],
+        "age": int(body["age"]),
+        "age_group": age_group(int(body["age"])),
+        "gender": body["gender"],
+        "condition": body["condition"],
+        "image_url": body.get("image_url"),
+        "appointment_count": 0,
+        "prescription_count": 0,
+        "careplan_count": 0,
+        **subresources.stamp()
+    }
+    if not subresources.split_mode():
+        new_patient.update({"appointments": [], "prescriptions": [], "careplans": []})
+    if body.get("location") is not None:
+        new_patient.update({"location": parse_location(body["location"]), "town": body.get("town")})
+    new_patient["search_terms"] = search.terms_for(new_patient)
+    return new_patient
 
 # post add patient
 @patients_bp.route("/", methods=["POST"])
@@ -74,40 +148,73 @@ def add_patient():
     if error:
         return response(False, message=error, status=400)
 
-    new_patient = {
-        "name": body["name"],
-        "age": int(body["age"]),
-        "gender": body["gender"],
-        "condition": body["condition"],
-        "image_url": body.get("image_url"),
-        "appointments": [],
-        "prescriptions": [],
-        "careplans": []
-    }
-    result = patients.insert_one(new_patient)
+    doc = new_patient_doc(body)
+    result = patients.insert_one(doc)
+    geo_grid.record([doc], 1)
     return response(True,
                     message="Patient added successfully",
                     data={"id": str(result.inserted_id)},
                     status=201)
 
+# post add patients in bulk, one unordered write for the whole batch
+@patients_bp.route("/bulk", methods=["POST"])
+@jwt_required
+def bulk_add_patients():
+    try:
+        items = bulk_items("patients")
+    except ValueError as e:
+        return response(False, message=str(e), status=400)
+
+    results, docs = [], []
+    for i, body in enumerate(items):
+        error = validate_patient_data(body) if isinstance(body, dict) else "Expected an object"
+        if error:
+            results.append({"index": i, "success": False, "message": error})
+            continue
+        doc = {"_id": ObjectId(), **new_patient_doc(body)}
+        results.append({"index": i, "success": True, "id": str(doc["_id"])})
+        docs.append((i, doc))
+
+    if docs:
+        failed = set()
+        try:
+            patients.bulk_write([InsertOne(doc) for _, doc in docs], ordered=False)
+        except BulkWriteError as e:
+            for err in e.details["writeErrors"]:
+                i = docs[err["index"]][0]
+                failed.add(i)
+                results[i] = {"index": i, "success": False, "message": err["errmsg"]}
+        geo_grid.record([doc for i, doc in docs if i not in failed], 1)
+    return bulk_response(results)
+
 # get patient by id
 @patients_bp.route("/<string:id>", methods=["GET"])
 @jwt_required
 def get_patient(id):
     if not is_valid_objectid(id):
         return response(False, message="Invalid patient ID", status=400)
+    try:
+        fields = parse_fields(DETAIL_FIELDS)
+    except ValueError as e:
+        return response(False, message=str(e), status=400)
     
-    p = patients.find_one({"_id": ObjectId(id)})
+    # a revalidation is answered from the last_updated stamp alone when nothing changed
+    if request.if_none_match or request.if_modified_since:
+        head = patients.find_one({"_id": ObjectId(id)}, {"last_updated": 1})
+        if not head:
+            return response(False, message="Patient not found", status=404)
+        unchanged = not_modified(head.get("last_updated"))
+        if unchanged:
+            return unchanged
+
+    p = patients.find_one({"_id": ObjectId(id)}, {f: 1 for f in [*fields, "last_updated"]} if fields else {"search_terms": 0})
     if not p:
         return response(False, message="Patient not found", status=404)
+    last_updated = p.get("last_updated") if not fields or "last_updated" in fields else p.pop("last_updated", None)
+    subresources.attach([p], fields)
     
-    p["_id"] = str(p["_id"])
-    for field in ["appointments", "prescriptions", "careplans"]:
-        for sub in p.get(field, []):
-            if isinstance(sub.get("_id"), ObjectId):
-                sub["_id"] = str(sub["_id"])
-    
-    return response(True, data=p, message="Patient retrieved successfully")
+    resp, status = response(True, data=p, message="Patient retrieved successfully")
+    return conditional(resp, last_updated)
 
 # put update patient
 @patients_bp.route("/<string:id>", methods=["PUT"])
@@ -120,7 +227,7 @@ def update_patient(id):
     if not body:
         return response(False, message="No fields provided for update", status=400)
 
-    allowed_fields = {"name", "age", "gender", "condition", "image_url"}
+    allowed_fields = {"name", "age", "gender", "condition", "image_url", "town", "location"}
     update_fields = {}
 
     for key, value in body.items():
@@ -131,21 +238,23 @@ def update_patient(id):
                     if age < 0 or age > 120:
                         return response(False, message="Age must be between 0 and 120", status=400)
                     update_fields["age"] = age
+                    update_fields["age_group"] = age_group(age)
                 except (ValueError, TypeError):
                     return response(False, message="Age must be a number", status=400)
+            elif key == "location":
+                update_fields["location"] = parse_location(value)
+                if update_fields["location"] is None:
+                    return response(False, message="Location must be a GeoJSON Point", status=400)
             else:
                 update_fields[key] = value
 
     if not update_fields:
         return response(False, message="No valid fields to update", status=400)
 
-    result = patients.update_one(
-        {"_id": ObjectId(id)},
-        {"$set": update_fields}
-    )
-
-    if result.matched_count == 0:
+    if not subresources.update_patient(ObjectId(id), update_fields):
         return response(False, message="Patient not found", status=404)
+    if "name" in update_fields or "condition" in update_fields:
+        search.reindex(ObjectId(id))
     
     return response(True, message="Patient updated successfully", data={"updated_fields": list(update_fields.keys())})
 
@@ -157,8 +266,7 @@ def delete_patient(id):
     if not is_valid_objectid(id):
         return response(False, message="Invalid ID", status=400)
     
-    result = patients.delete_one({"_id": ObjectId(id)})
-    if result.deleted_count == 0:
+    if not subresources.delete_patient(ObjectId(id)):
         return response(False, message="Patient not found", status=404)
     
     return response(True, message="Patient deleted successfully")
@@ -0,0 +1,135 @@
+from flask import request, Response
+from functools import wraps
+from collections import OrderedDict
+import datetime, threading, time
+import globals
+
+# in-process backend: LRU bounded by entry count, entries expire after ttl seconds.
+# Invalidation only reaches the process it runs in, so it suits a single worker
+# (threads included); multi-worker deployments need the mongo backend
+class MemoryBackend:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def size(self):
+        return len(self.entries)
+
+# shared backend: one document per entry so every worker sees the same entries
+# and invalidations; expired documents are removed by a TTL index on expires_at
+class MongoBackend:
+    def __init__(self, max_entries, ttl):
+        self.ttl = ttl
+        self.collection = globals.db["analytics_cache"]
+
+    def get(self, key):
+        doc = self.collection.find_one({"_id": key, "expires_at": {"$gt": datetime.datetime.utcnow()}})
+        return doc["value"] if doc else None
+
+    def set(self, key, value):
+        expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.ttl)
+        self.collection.replace_one({"_id": key}, {"value": value, "expires_at": expires_at}, upsert=True)
+
+    def clear(self):
+        self.collection.delete_many({})
+
+    def size(self):
+        return self.collection.estimated_document_count()
+
+BACKENDS = {"memory": MemoryBackend, "mongo": MongoBackend}
+
+# caches whole GET responses keyed on the endpoint and a normalised set of query args
+class QueryCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # requests run on several threads, += on a shared counter is not atomic
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    # extra: optional function returning one more key part, e.g. a normalised location
+    def key(self, args, extra=None):
+        parts = [request.endpoint]
+        for name in args:
+            value = (request.args.get(name) or "").strip()
+            if name == "gender":
+                value = value.lower()
+            elif value.lstrip("-").isdigit():
+                value = str(int(value))
+            parts.append(f"{name}={value}")
+        if extra:
+            parts.append(extra())
+        return "|".join(parts)
+
+    def cached(self, args, extra=None):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*a, **kw):
+                key = self.key(args, extra)
+                hit = self.backend.get(key)
+                if hit is not None:
+                    self.count("hits")
+                    return Response(hit, status=200, mimetype="application/json")
+                self.count("misses")
+                result = func(*a, **kw)
+                if isinstance(result, Response) and result.status_code == 200:
+                    self.backend.set(key, result.get_data())
+                return result
+            return wrapper
+        return decorator
+
+    def invalidate(self):
+        self.count("invalidations")
+        self.backend.clear()
+
+    # after_request hook for blueprints whose writes change analytics results
+    def invalidate_after_write(self, resp):
+        if request.method in ("POST", "PUT", "PATCH", "DELETE") and resp.status_code < 400:
+            self.invalidate()
+        return resp
+
+    def stats(self):
+        with self.lock:
+            hits, misses, invalidations = self.hits, self.misses, self.invalidations
+        lookups = hits + misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": self.backend.size(),
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / lookups, 3) if lookups else None,
+            "invalidations": invalidations
+        }
+
+analytics_cache = QueryCache(
+    BACKENDS[globals.analytics_cache_backend](globals.analytics_cache_size, globals.analytics_cache_ttl)
+)
@@ -0,0 +1,49 @@
+from flask import request
+import gzip
+import globals
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# negotiated compression of JSON responses: brotli when the brotli package is
+# installed (it is not in requirements.txt) and the client prefers or accepts
+# it, gzip otherwise. Small bodies are sent as they are.
+
+# helper: content coding to use for this request, None for identity
+def choose_encoding():
+    accepted = request.accept_encodings
+    gzip_q = accepted["gzip"]
+    br_q = accepted["br"] if brotli else 0
+    if br_q and br_q >= gzip_q:
+        return "br"
+    return "gzip" if gzip_q else None
+
+def compress(data, encoding):
+    if encoding == "br":
+        # brotli qualities run 0-11, scale the shared 1-9 level onto them
+        return brotli.compress(data, quality=min(11, globals.compress_level + 1))
+    return gzip.compress(data, compresslevel=globals.compress_level, mtime=0)
+
+def compress_response(resp):
+    if not resp.is_json or resp.direct_passthrough or "Content-Encoding" in resp.headers:
+        return resp
+    resp.vary.add("Accept-Encoding")
+    if resp.status_code < 200 or resp.status_code in (204, 206, 304):
+        return resp
+    data = resp.get_data()
+    encoding = choose_encoding() if len(data) >= globals.compress_min_bytes else None
+    if not encoding:
+        return resp
+    resp.set_data(compress(data, encoding))
+    resp.headers["Content-Encoding"] = encoding
+    # the encoded bytes differ, so a strong validator becomes a weak one
+    etag, weak = resp.get_etag()
+    if etag and not weak:
+        resp.set_etag(etag, weak=True)
+    return resp
+
+# hook the middleware into an app
+def init_app(app):
+    app.after_request(compress_response)
@@ -1,25 +1,91 @@
-from flask import request, make_response
+from flask import request, g
 from functools import wraps
+import datetime, threading, time
 import jwt
+from bson import ObjectId
 import globals
-from utils import response 
+from utils import response
 
 blacklist = globals.db['blacklist']
 
-def jwt_required(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        token = request.headers.get('x-access-token')
-        if not token:
-            return response(False, message='Token missing', status=401)
-        if blacklist.find_one({"token": token}):
-            return response(False, message='Token blacklisted', status=401)
+# revocation set: local copy of the blacklist collection, re-synced on an interval
+class RevocationSet:
+    # entries written by other workers can land with slightly older ObjectIds,
+    # so each sync re-reads this many seconds before the previous one
+    OVERLAP = 60
+
+    def __init__(self, collection, interval):
+        self.collection = collection
+        self.interval = interval
+        self.tokens = {}
+        self.since = None
+        self.last_sync = 0.0
+        self.lock = threading.Lock()
+
+    def sync(self, force=False):
+        if not force and time.monotonic() - self.last_sync < self.interval:
+            return
+        with self.lock:
+            if not force and time.monotonic() - self.last_sync < self.interval:
+                return
+            started = datetime.datetime.utcnow()
+            query = {}
+            if self.since:
+                query["_id"] = {"$gte": ObjectId.from_datetime(self.since - datetime.timedelta(seconds=self.OVERLAP))}
+            try:
+                for doc in self.collection.find(query, {"token": 1, "expires_at": 1, "_id": 0}):
+                    self.tokens[doc["token"]] = doc.get("expires_at")
+            except Exception as e:
+                print(f"[ERROR] blacklist sync failed: {e}")
+                return
+            self.prune(started)
+            self.since = started
+            self.last_sync = time.monotonic()
+
+    def prune(self, now):
+        expired = [t for t, exp in self.tokens.items() if exp and exp < now]
+        for t in expired:
+            del self.tokens[t]
+
+    def revoke(self, token, exp):
+        expires_at = datetime.datetime.utcfromtimestamp(exp) if exp else None
+        self.collection.insert_one({"token": token, "expires_at": expires_at})
+        # sync() prunes under the lock, so the local copy is only changed while holding it
+        with self.lock:
+            self.tokens[token] = expires_at
+
+    def __contains__(self, token):
+        self.sync()
+        return token in self.tokens
+
+revoked = RevocationSet(blacklist, globals.revocation_sync_seconds)
+
+# helper: decode the request token once and keep the claims on g
+def check_token():
+    if "token_error" in g:
+        return g.token_error
+    g.token_error = None
+    token = request.headers.get('x-access-token')
+    if not token:
+        g.token_error = response(False, message='Token missing', status=401)
+    elif token in revoked:
+        g.token_error = response(False, message='Token blacklisted', status=401)
+    else:
         try:
-            jwt.decode(token, globals.secret_key, algorithms="HS256")
+            g.token = token
+            g.token_data = jwt.decode(token, globals.secret_key, algorithms="HS256")
         except jwt.ExpiredSignatureError:
-            return response(False, message='Token expired', status=401)
+            g.token_error = response(False, message='Token expired', status=401)
         except Exception:
-            return response(False, message='Token invalid', status=401)
+            g.token_error = response(False, message='Token invalid', status=401)
+    return g.token_error
+
+def jwt_required(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        error = check_token()
+        if error:
+            return error
         return func(*args, **kwargs)
     return wrapper
 
@@ -27,20 +93,11 @@ def jwt_required(func):
 def admin_required(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        token = request.headers.get('x-access-token')
-        if not token:
-            return response(False, message='Token missing', status=401)
-
-        try:
-            data = jwt.decode(token, globals.secret_key, algorithms="HS256")
-        except jwt.ExpiredSignatureError:
-            return response(False, message='Token expired', status=401)
-        except jwt.InvalidTokenError:
-            return response(False, message='Token invalid', status=401)
-        except Exception:
-            return response(False, message='Token invalid or missing', status=401)
+        error = check_token()
+        if error:
+            return error
 
-        if not data.get("admin"):
+        if not g.token_data.get("admin"):
             return response(False, message='Admin access required', status=403)
 
         return func(*args, **kwargs)
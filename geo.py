@@ -0,0 +1,57 @@
+import math
+
+# geohash cells for the geo endpoints: a query point is snapped to the centre of
+# its cell so nearby lookups from the same neighbourhood share a cache entry
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+METERS_PER_DEGREE = 111320
+MAX_PRECISION = 12
+
+def geohash(lat, lon, precision):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+# (lat, lon) of a cell's centre
+def cell_centre(cell):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in cell:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if value >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+# helper: width and height in meters of a cell of the given precision at a latitude
+def cell_size(precision, lat):
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    width = 360 / 2 ** lon_bits * METERS_PER_DEGREE * math.cos(math.radians(lat))
+    height = 180 / 2 ** lat_bits * METERS_PER_DEGREE
+    return width, height
+
+# coarsest precision whose cells are at most max_meters across at a latitude
+def precision_for(max_meters, lat):
+    for precision in range(1, MAX_PRECISION + 1):
+        if max(cell_size(precision, lat)) <= max_meters:
+            return precision
+    return MAX_PRECISION
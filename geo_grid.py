@@ -0,0 +1,132 @@
+import argparse, math
+from collections import Counter
+from bson import ObjectId
+from pymongo import UpdateOne
+import globals
+import indexes
+
+# patient counts per map grid cell behind GET /geo/tiles/<z>/<x>/<y>, one
+# document per cell and dimension combination with _id = {z, x, y, condition,
+# age_group} and a running count. Cells use web-mercator tile numbering: a tile
+# at zoom z is split into 2^CELL_BITS x 2^CELL_BITS cells, i.e. tiles at zoom
+# z + CELL_BITS, stored for every zoom in GEO_TILE_ZOOMS. The counters are kept
+# current by the patient write paths and can be rebuilt with
+# `python geo_grid.py rebuild`.
+CELL_BITS = 4
+FIELDS = ("location", "condition", "age_group")
+SPLITS = ("condition", "age_group")
+MAX_ZOOM = 22
+grid = globals.db["geo_grid"]
+
+def levels():
+    return sorted(z + CELL_BITS for z in globals.geo_tile_zooms)
+
+# helper: (lon, lat) of a GeoJSON point, None if the document has no usable location
+def point_of(doc):
+    location = doc.get("location")
+    try:
+        lon, lat = location["coordinates"][:2]
+        lon, lat = float(lon), float(lat)
+    except (TypeError, KeyError, ValueError):
+        return None
+    return (lon, lat) if -180 <= lon <= 180 and -85 <= lat <= 85 else None
+
+# helper: tile numbers of a point at a zoom level
+def tile_of(lon, lat, level):
+    n = 2 ** level
+    x = int((lon + 180) / 360 * n)
+    rad = math.radians(lat)
+    y = int((1 - math.log(math.tan(rad) + 1 / math.cos(rad)) / math.pi) / 2 * n)
+    return min(x, n - 1), min(y, n - 1)
+
+# helper: [west, south, east, north] of a tile
+def bounds(level, x, y):
+    n = 2 ** level
+    lat = lambda t: math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * t / n))))
+    return [x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)]
+
+# helper: counter keys of one patient, empty without a location
+def keys(doc):
+    point = point_of(doc)
+    if not point:
+        return []
+    dims = {"condition": doc.get("condition"), "age_group": doc.get("age_group") or "Unknown"}
+    return [{"z": level, "x": x, "y": y, **dims} for level in levels() for x, y in [tile_of(*point, level)]]
+
+# record patients being added (delta=1) or removed (delta=-1)
+def record(docs, delta):
+    ops = [UpdateOne({"_id": k}, {"$inc": {"count": delta}}, upsert=True) for doc in docs for k in keys(doc)]
+    if ops:
+        grid.bulk_write(ops, ordered=False)
+
+# record a patient update, only touching counters when its cells or dimensions changed
+def replace(old, new):
+    if keys(old) != keys(new):
+        record([old], -1)
+        record([new], 1)
+
+# recompute every counter from the patients
+def rebuild():
+    counts = Counter()
+    for doc in globals.db["patients"].find({"location": {"$exists": True}}, {f: 1 for f in FIELDS}):
+        for k in keys(doc):
+            counts[tuple(k.items())] += 1
+    if not counts:
+        grid.drop()
+        return 0
+    # built beside the live grid with its indexes and renamed over it, so tiles
+    # never read a half-built grid and concurrent rebuilds do not collide
+    scratch = globals.db[f"geo_grid_rebuild_{ObjectId()}"]
+    scratch.create_indexes(indexes.declared()["geo_grid"])
+    batch = []
+    for k, count in counts.items():
+        batch.append({"_id": dict(k), "count": count})
+        if len(batch) >= 1000:
+            scratch.insert_many(batch)
+            batch = []
+    if batch:
+        scratch.insert_many(batch)
+    scratch.rename(grid.name, dropTarget=True)
+    return len(counts)
+
+# cell counts of one tile, optionally split by condition or age_group
+def tile(z, x, y, split=None):
+    stored = levels()
+    wanted = z + CELL_BITS
+    # the first stored level with at least the wanted detail, past the finest one its cells are coarser
+    level = next((l for l in stored if l >= wanted), stored[-1])
+    cell_level = min(level, wanted)
+    if level >= z:
+        span = 2 ** (level - z)
+        x_range, y_range = (x * span, (x + 1) * span), (y * span, (y + 1) * span)
+    else:
+        shift = z - level
+        x_range, y_range = (x >> shift, (x >> shift) + 1), (y >> shift, (y >> shift) + 1)
+    factor = 2 ** (level - cell_level)
+    cell = lambda field: f"$_id.{field}" if factor == 1 else {"$floor": {"$divide": [f"$_id.{field}", factor]}}
+    group = {"x": cell("x"), "y": cell("y")}
+    if split:
+        group["split"] = f"$_id.{split}"
+    pipeline = [
+        {"$match": {"_id.z": level, "_id.x": {"$gte": x_range[0], "$lt": x_range[1]},
+                    "_id.y": {"$gte": y_range[0], "$lt": y_range[1]}}},
+        {"$group": {"_id": group, "count": {"$sum": "$count"}}},
+        {"$match": {"count": {"$gt": 0}}},
+    ]
+    cells = {}
+    for row in grid.aggregate(pipeline):
+        cx, cy = int(row["_id"]["x"]), int(row["_id"]["y"])
+        entry = cells.setdefault((cx, cy), {"x": cx, "y": cy, "bounds": bounds(cell_level, cx, cy), "count": 0})
+        entry["count"] += row["count"]
+        if split:
+            entry.setdefault("by", {})[str(row["_id"].get("split"))] = row["count"]
+    return {"cell_zoom": cell_level, "cells": sorted(cells.values(), key=lambda c: (c["y"], c["x"]))}
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the map grid counters")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+    print(f"Geo grid rebuilt: {rebuild()} counters.")
+
+if __name__ == "__main__":
+    main()
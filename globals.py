@@ -1,8 +1,83 @@
 from pymongo import MongoClient
 import os
+import metrics
+import slow_queries
 
 secret_key = os.environ.get('SECRET_KEY', 'mysecret')
 
-client = MongoClient(os.environ.get('MONGO_URI', 'mongodb://localhost:27017/'))
+# connection pool of each process: connections opened at most and kept open, how long a
+# request waits for a free one (0 = no limit) and how long to wait for a reachable server
+mongo_max_pool_size = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+mongo_min_pool_size = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+mongo_wait_queue_timeout_ms = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 0))
+mongo_server_selection_timeout_ms = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+
+# connect=False: nothing is opened here, the client connects (and starts its monitor
+# threads) on the first command, so every worker forked by gunicorn gets its own pool.
+# The listeners attribute every command to the request that issued it (metrics.py)
+# and explain the slow ones (slow_queries.py)
+mongo_uri = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
+client = MongoClient(mongo_uri,
+                     connect=False,
+                     maxPoolSize=mongo_max_pool_size,
+                     minPoolSize=mongo_min_pool_size,
+                     waitQueueTimeoutMS=mongo_wait_queue_timeout_ms or None,
+                     serverSelectionTimeoutMS=mongo_server_selection_timeout_ms,
+                     event_listeners=[metrics.command_listener, slow_queries.listener])
 db_name = os.environ.get('MONGO_DB', 'syntheaDB')
 db = client[db_name]
+
+# access tokens (JWT) last minutes; refresh tokens last days and are replaced on every use
+access_token_minutes = int(os.environ.get('ACCESS_TOKEN_MINUTES', 45))
+refresh_token_days = int(os.environ.get('REFRESH_TOKEN_DAYS', 30))
+
+# threads hashing and checking passwords, and calls allowed to wait for one before logins get a 503
+password_hash_workers = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+password_hash_queue = int(os.environ.get('PASSWORD_HASH_QUEUE', 64))
+
+# seconds between syncs of the local token revocation set with the blacklist collection
+revocation_sync_seconds = int(os.environ.get('REVOCATION_SYNC_SECONDS', 30))
+
+# where appointments/prescriptions/careplans live: "embedded" in the patient document
+# or "collections" for separate collections keyed by patient_id (see migrate_subresources.py)
+storage_mode = os.environ.get('STORAGE_MODE', 'embedded')
+
+# most items accepted by one batch request (POST .../bulk)
+bulk_max_items = int(os.environ.get('BULK_MAX_ITEMS', 1000))
+
+# responses: JSON bodies of at least compress_min_bytes are sent gzip or brotli encoded when the client accepts it
+compress_min_bytes = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+compress_level = int(os.environ.get('COMPRESS_LEVEL', 6))
+
+# ASGI mode (asgi.py): threads running requests, with a separate pool for the analytics routes
+asgi_workers = int(os.environ.get('ASGI_WORKERS', 32))
+asgi_analytics_workers = int(os.environ.get('ASGI_ANALYTICS_WORKERS', 4))
+
+# analytics query cache: "memory" (per process) or "mongo" (shared between workers). A write
+# only clears the memory cache of the worker that served it, so deployments running more than
+# one worker process must use "mongo" or other workers serve stale results until the ttl
+analytics_cache_backend = os.environ.get('ANALYTICS_CACHE_BACKEND', 'memory')
+analytics_cache_size = int(os.environ.get('ANALYTICS_CACHE_SIZE', 256))
+analytics_cache_ttl = int(os.environ.get('ANALYTICS_CACHE_TTL', 60))
+
+# map tiles (GET /geo/tiles/<z>/<x>/<y>): zoom levels with precomputed cell counts, see geo_grid.py
+geo_tile_zooms = [int(z) for z in os.environ.get('GEO_TILE_ZOOMS', '8,11,14').split(',')]
+
+# patient search: share of query trigrams a patient must contain to match (lower = more typo tolerant),
+# and whether medication and careplan names are searchable too
+search_min_similarity = float(os.environ.get('SEARCH_MIN_SIMILARITY', 0.5))
+search_include_subresources = os.environ.get('SEARCH_INCLUDE_SUBRESOURCES', 'false').lower() in ('1', 'true', 'yes')
+
+# request rate limits per client (ratelimits.py): counters kept in "memory" (per process), "mongo"
+# (the application database, shared between workers) or a storage URI such as redis://localhost:6379
+ratelimit_enabled = os.environ.get('RATELIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ratelimit_storage = os.environ.get('RATELIMIT_STORAGE', 'memory')
+# limits of each cost class, e.g. "300/minute" or "10/minute;50/hour"; a /stats/overview
+# request counts as ratelimit_overview_cost analytics requests
+ratelimit_crud = os.environ.get('RATELIMIT_CRUD', '300/minute')
+ratelimit_search = os.environ.get('RATELIMIT_SEARCH', '60/minute')
+ratelimit_analytics = os.environ.get('RATELIMIT_ANALYTICS', '30/minute')
+# map tiles are precomputed and cached, and one map view fetches dozens of them
+ratelimit_tiles = os.environ.get('RATELIMIT_TILES', '1200/minute')
+ratelimit_login = os.environ.get('RATELIMIT_LOGIN', '10/minute;50/hour')
+ratelimit_overview_cost = int(os.environ.get('RATELIMIT_OVERVIEW_COST', 5))
@@ -0,0 +1,105 @@
+import argparse, sys
+from pymongo import IndexModel, ASCENDING, GEOSPHERE
+import globals
+
+# every index the app relies on, by collection. Names are pymongo's defaults so
+# indexes created before this registry are recognised; apply() is idempotent
+# and runs once per deployment via `flask --app app init` or `python indexes.py apply`.
+SUB_COLLECTIONS = ("appointments", "prescriptions", "careplans")
+
+# split: include the sub-resource collections, defaults to STORAGE_MODE=collections
+def declared(split=None):
+    if split is None:
+        split = globals.storage_mode == "collections"
+    registry = {
+        "users": [
+            IndexModel([("username", ASCENDING)], unique=True),
+        ],
+        "blacklist": [
+            IndexModel([("token", ASCENDING)]),
+            # revoked tokens are dropped once they would have expired anyway
+            IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+        ],
+        "patients": [
+            IndexModel([("location", GEOSPHERE)]),
+            IndexModel([("search_terms", ASCENDING)]),
+            IndexModel([("condition", ASCENDING)]),
+            IndexModel([("gender", ASCENDING)]),
+        ],
+        "refresh_tokens": [
+            IndexModel([("family", ASCENDING)]),
+            IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+        ],
+        "geo_grid": [
+            IndexModel([("_id.z", ASCENDING), ("_id.x", ASCENDING), ("_id.y", ASCENDING)]),
+        ],
+        "analytics_cache": [
+            IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+        ],
+    }
+    if split:
+        for kind in SUB_COLLECTIONS:
+            registry[kind] = [IndexModel([("patient_id", ASCENDING), ("_id", ASCENDING)])]
+        registry["appointments"].append(IndexModel([("doctor", ASCENDING), ("date", ASCENDING)]))
+        registry["prescriptions"].append(IndexModel([("name", ASCENDING), ("status", ASCENDING)]))
+        registry["careplans"] += [
+            IndexModel([("description", ASCENDING), ("start", ASCENDING)]),
+            # only active careplans: the live overview matches stop "Unknown" before anything else
+            IndexModel([("stop", ASCENDING), ("description", ASCENDING)], partialFilterExpression={"stop": "Unknown"}),
+        ]
+    return registry
+
+# options that change what an index does; server-added ones (v, 2dsphereIndexVersion...) are ignored
+OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+# helper: true if a live index does not match its declaration
+def differs(doc, live):
+    if [tuple(k) for k in live["key"]] != list(doc["key"].items()):
+        return True
+    return any(doc.get(o) != live.get(o) for o in OPTIONS)
+
+# create every missing index, limited to the given collections if any
+def apply(collections=None, db=None, split=None):
+    db = db if db is not None else globals.db
+    created = []
+    for name, models in declared(split).items():
+        if collections and name not in collections:
+            continue
+        existing = db[name].index_information()
+        missing = [m for m in models if m.document["name"] not in existing]
+        if missing:
+            created += [f"{name}.{n}" for n in db[name].create_indexes(missing)]
+    return created
+
+# compare the registry with the live database; extra covers every collection
+def check(db=None, split=None):
+    db = db if db is not None else globals.db
+    report = {"missing": [], "extra": [], "changed": []}
+    registry = declared(split)
+    for name in sorted(set(registry) | set(db.list_collection_names())):
+        models = {m.document["name"]: m.document for m in registry.get(name, [])}
+        live = db[name].index_information()
+        for index_name, doc in models.items():
+            if index_name not in live:
+                report["missing"].append(f"{name}.{index_name}")
+            elif differs(doc, live[index_name]):
+                report["changed"].append(f"{name}.{index_name}")
+        report["extra"] += [f"{name}.{n}" for n in live if n != "_id_" and n not in models]
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply or check the declared MongoDB indexes")
+    parser.add_argument("command", choices=["apply", "check"])
+    args = parser.parse_args()
+    if args.command == "apply":
+        created = apply()
+        print(f"Created {len(created)} indexes" + (": " + ", ".join(created) if created else ""))
+    report = check()
+    for kind in ("missing", "extra", "changed"):
+        print(f"{kind}: {len(report[kind])}")
+        for item in report[kind]:
+            print(f"  {item}")
+    sys.exit(1 if report["missing"] or report["changed"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
-from pymongo import MongoClient
+import indexes
 
-client = MongoClient("mongodb://127.0.0.1:27017")
-db = client["syntheaDB"]
-patients = db["patients"]
-
-patients.create_index([("location", "2dsphere")])
-print("Created 2dsphere index on 'location' field.")
+# kept for existing setups; the index list lives in indexes.py (python indexes.py apply|check)
+created = indexes.apply()
+print(f"Created {len(created)} indexes" + (": " + ", ".join(created) if created else "."))
+report = indexes.check()
+if report["missing"] or report["changed"] or report["extra"]:
+    print(f"Index report: {report}")
@@ -0,0 +1,145 @@
+from flask import Response, g, has_request_context, request
+from pymongo import monitoring
+from collections import defaultdict
+import bson, os, threading, time
+
+# request and Mongo command metrics in Prometheus text format, served at /metrics.
+# Every request records its latency per blueprint/endpoint; the command listener
+# (registered on the MongoClient in globals.py) attributes each DB command's
+# duration and reply size to the request that issued it, so extra round trips
+# show up per endpoint. Values are per process.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COMMAND_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 13, 21, 50)
+
+# re-encoding every reply to measure it costs CPU, METRICS_REPLY_BYTES=false turns it off
+measure_reply_bytes = os.environ.get('METRICS_REPLY_BYTES', 'true').lower() in ('1', 'true', 'yes')
+
+# helper: label set rendered as {a="x",b="y"}
+def render_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+# helper: sample value, integral floats without the exponent notation of :g
+def render_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{render_labels(self.labels, labels)} {render_value(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            buckets, count, total = self.values.get(labels) or ([0] * len(self.buckets), 0, 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    buckets[i] += 1
+            self.values[labels] = (buckets, count + 1, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self.lock:
+            for labels, (buckets, count, total) in sorted(self.values.items()):
+                for bound, n in zip(self.buckets, buckets):
+                    lines.append(f"{self.name}_bucket{render_labels(names, labels + (f'{bound:g}',))} {n}")
+                lines.append(f"{self.name}_bucket{render_labels(names, labels + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{render_labels(self.labels, labels)} {render_value(total)}")
+                lines.append(f"{self.name}_count{render_labels(self.labels, labels)} {count}")
+        return lines
+
+request_seconds = Histogram("http_request_duration_seconds", "Request latency.", ("blueprint", "endpoint", "method"))
+requests_total = Counter("http_requests_total", "Requests served.", ("blueprint", "endpoint", "method", "status"))
+command_seconds = Histogram("mongo_command_duration_seconds", "Mongo command latency.", ("command",), COMMAND_BUCKETS)
+command_failures = Counter("mongo_command_failures_total", "Failed Mongo commands.", ("command",))
+request_commands = Histogram("mongo_commands_per_request", "Mongo commands issued per request.", ("endpoint",), COUNT_BUCKETS)
+endpoint_commands = Counter("mongo_endpoint_commands_total", "Mongo commands issued, by endpoint.", ("endpoint", "command"))
+endpoint_command_seconds = Counter("mongo_endpoint_command_seconds_total", "Time spent in Mongo commands, by endpoint.", ("endpoint", "command"))
+endpoint_reply_bytes = Counter("mongo_endpoint_reply_bytes_total", "Bytes of Mongo replies, by endpoint.", ("endpoint", "command"))
+REGISTRY = (request_seconds, requests_total, command_seconds, command_failures,
+            request_commands, endpoint_commands, endpoint_command_seconds, endpoint_reply_bytes)
+
+# helper: endpoint label, unmatched urls share one label to bound the series
+def endpoint_label():
+    return request.endpoint or "unmatched"
+
+# pymongo calls these on the thread that ran the command, which for the
+# synchronous driver is the request's own thread
+class CommandMetrics(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        command_seconds.observe((event.command_name,), seconds)
+        if has_request_context():
+            size = len(bson.encode(event.reply)) if measure_reply_bytes else 0
+            g.db_commands = g.get("db_commands", 0) + 1
+            g.db_seconds = g.get("db_seconds", 0.0) + seconds
+            labels = (endpoint_label(), event.command_name)
+            endpoint_commands.inc(labels)
+            endpoint_command_seconds.inc(labels, seconds)
+            if size:
+                endpoint_reply_bytes.inc(labels, size)
+
+    def failed(self, event):
+        command_seconds.observe((event.command_name,), event.duration_micros / 1e6)
+        command_failures.inc((event.command_name,))
+        if has_request_context():
+            g.db_commands = g.get("db_commands", 0) + 1
+            endpoint_commands.inc((endpoint_label(), event.command_name))
+
+command_listener = CommandMetrics()
+
+def start_timer():
+    g.request_started = time.perf_counter()
+
+# records the request and adds a Server-Timing header with its DB time
+def record_request(resp):
+    if "request_started" not in g:
+        return resp
+    seconds = time.perf_counter() - g.request_started
+    endpoint = endpoint_label()
+    blueprint = request.blueprint or "app"
+    request_seconds.observe((blueprint, endpoint, request.method), seconds)
+    requests_total.inc((blueprint, endpoint, request.method, str(resp.status_code)))
+    request_commands.observe((endpoint,), g.get("db_commands", 0))
+    resp.headers["Server-Timing"] = (f'app;dur={seconds * 1000:.1f}, '
+                                     f'db;dur={g.get("db_seconds", 0.0) * 1000:.1f};desc="{g.get("db_commands", 0)} commands"')
+    return resp
+
+# hook the middleware into an app
+def init_app(app):
+    app.before_request(start_timer)
+    app.after_request(record_request)
+
+# every metric in the Prometheus text exposition format
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
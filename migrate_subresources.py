@@ -0,0 +1,86 @@
+import argparse, copy
+from bson import ObjectId
+from pymongo import ReplaceOne
+import globals
+import subresources
+
+# moves embedded appointments/prescriptions/careplans into their own collections;
+# progress is checkpointed by patient _id so an interrupted run picks up where it stopped.
+# The API can keep serving in embedded mode meanwhile: a patient whose arrays changed
+# after they were read is read again and moved again, nothing written in between is lost
+patients = globals.db["patients"]
+migrations = globals.db["migrations"]
+STATE_ID = "subresources"
+
+# helper: match a patient whose arrays are still exactly as read
+def unchanged(doc):
+    query = {"_id": doc["_id"]}
+    for kind in subresources.KINDS:
+        query[kind] = doc[kind] if kind in doc else {"$exists": False}
+    return query
+
+# copy the sub-documents out and drop the arrays, retrying while the API changes them
+def migrate_patient(doc):
+    retry = False
+    while doc is not None:
+        read = unchanged(copy.deepcopy(doc))
+        for kind in subresources.KINDS:
+            ops = []
+            for sub in doc.get(kind, []):
+                sub.setdefault("_id", ObjectId())
+                if kind == "careplans":
+                    # a careplan without a stop is active, as one with stop "Unknown" is
+                    sub.setdefault("stop", "Unknown")
+                ops.append(ReplaceOne({"_id": sub["_id"]}, {**sub, "patient_id": doc["_id"]}, upsert=True))
+            if ops:
+                globals.db[kind].bulk_write(ops, ordered=False)
+            if retry:
+                # copies of sub-documents deleted since the previous attempt
+                globals.db[kind].delete_many({"patient_id": doc["_id"], "_id": {"$nin": [s["_id"] for s in doc.get(kind, [])]}})
+        moved = patients.update_one(read, {
+            "$unset": {kind: "" for kind in subresources.KINDS},
+            "$set": {subresources.counter(kind): len(doc.get(kind, [])) for kind in subresources.KINDS}
+        })
+        if moved.matched_count:
+            return
+        doc, retry = patients.find_one({"_id": doc["_id"]}), True
+    if retry:
+        # the patient was deleted meanwhile, so are the copies
+        for kind in subresources.KINDS:
+            globals.db[kind].delete_many({"patient_id": read["_id"]})
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Move embedded sub-resources into separate collections",
+        epilog="The API may keep running with STORAGE_MODE=embedded during the move; "
+               "switch it to collections once the migration completes.")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    args = parser.parse_args()
+
+    subresources.ensure_indexes()
+    state = None if args.restart else migrations.find_one({"_id": STATE_ID})
+    last_id = state.get("last_id") if state else None
+    if last_id:
+        print(f"Resuming after patient {last_id}")
+
+    moved = 0
+    while True:
+        query = {"$or": [{kind: {"$exists": True}} for kind in subresources.KINDS]}
+        if last_id:
+            query["_id"] = {"$gt": last_id}
+        batch = list(patients.find(query).sort("_id", 1).limit(args.batch_size))
+        if not batch:
+            break
+        for doc in batch:
+            migrate_patient(doc)
+        last_id = batch[-1]["_id"]
+        migrations.update_one({"_id": STATE_ID}, {"$set": {"last_id": last_id}}, upsert=True)
+        moved += len(batch)
+        print(f"Migrated {moved} patients (last {last_id})")
+
+    migrations.update_one({"_id": STATE_ID}, {"$set": {"done": True}}, upsert=True)
+    print("Migration complete, set STORAGE_MODE=collections to serve from the new layout.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import bcrypt
+import globals
+
+# bcrypt hashing and checks run on a small bounded pool instead of the request
+# thread: bcrypt releases the GIL, so at most PASSWORD_HASH_WORKERS cores go to
+# password work during a login storm and the other requests keep theirs. When
+# more than PASSWORD_HASH_QUEUE calls are waiting, new ones fail fast with Busy.
+
+class Busy(Exception):
+    pass
+
+pool = {"executor": None}
+lock = threading.Lock()
+slots = threading.BoundedSemaphore(globals.password_hash_workers + globals.password_hash_queue)
+
+# started on first use, so a forked worker process gets its own threads
+def executor():
+    with lock:
+        if pool["executor"] is None:
+            pool["executor"] = ThreadPoolExecutor(globals.password_hash_workers, thread_name_prefix="bcrypt")
+        return pool["executor"]
+
+# helper: run fn on the pool and wait for it, raises Busy when the queue is full
+def run(fn, *args):
+    if not slots.acquire(blocking=False):
+        raise Busy("Too many password checks in progress")
+    try:
+        return executor().submit(fn, *args).result()
+    finally:
+        slots.release()
+
+def hash_password(password):
+    return run(lambda pw: bcrypt.hashpw(pw, bcrypt.gensalt()), password.encode("utf-8"))
+
+def check_password(password, hashed):
+    return run(bcrypt.checkpw, password.encode("utf-8"), hashed)
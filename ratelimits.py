@@ -0,0 +1,52 @@
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+import globals
+
+# request rate limits per client address, by cost class: every route of a
+# blueprint passed to init_app counts against the cheap "crud" budget unless its
+# view is marked with one of the heavier classes below. Each class is one shared
+# budget, so a client looping over analytics endpoints runs out of analytics
+# requests without losing its CRUD ones. Counters live in RATELIMIT_STORAGE; with
+# "memory" every worker counts on its own, "mongo" or a redis:// URI share them.
+# If the shared storage cannot be reached the workers fall back to counting in memory.
+
+# helper: limits storage URI and its options
+def storage():
+    if globals.ratelimit_storage == "memory":
+        return "memory://", {}
+    if globals.ratelimit_storage == "mongo":
+        return globals.mongo_uri, {
+            "database_name": globals.db_name,
+            "counter_collection_name": "rate_limits",
+            "window_collection_name": "rate_limit_windows",
+            "serverSelectionTimeoutMS": globals.mongo_server_selection_timeout_ms,
+        }
+    return globals.ratelimit_storage, {}
+
+storage_uri, storage_options = storage()
+limiter = Limiter(key_func=get_remote_address,
+                  storage_uri=storage_uri,
+                  storage_options=storage_options,
+                  headers_enabled=True,
+                  swallow_errors=True,
+                  in_memory_fallback_enabled=True,
+                  enabled=globals.ratelimit_enabled)
+
+def cost_class(name, limit, cost=1):
+    return limiter.shared_limit(limit, scope=name, cost=cost)
+
+crud = cost_class("crud", globals.ratelimit_crud)
+# full text and geo lookups
+search = cost_class("search", globals.ratelimit_search)
+# map tiles, read from the precomputed grid counters
+tiles = cost_class("tiles", globals.ratelimit_tiles)
+# aggregations over the whole patient collection and grid or rollup rebuilds
+analytics = cost_class("analytics", globals.ratelimit_analytics)
+overview = cost_class("analytics", globals.ratelimit_analytics, cost=globals.ratelimit_overview_cost)
+# a bcrypt check per request
+login = cost_class("login", globals.ratelimit_login)
+
+def init_app(app, blueprints):
+    limiter.init_app(app)
+    for bp in blueprints:
+        crud(bp)
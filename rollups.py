@@ -0,0 +1,153 @@
+import argparse, datetime, time
+from bson import ObjectId
+from pymongo import UpdateOne
+import globals
+import subresources
+
+# pre-aggregated counters behind the /stats endpoints, one document per
+# dimension combination with _id = the dimensions and a running count:
+#   rollup_appointments   {doctor, year, gender}
+#   rollup_prescriptions  {medication, status, gender}
+#   rollup_careplans      {careplan, year, active, gender}
+# they are kept current by the sub-resource and patient write paths and can be
+# rebuilt from the source data with `python rollups.py rebuild`
+LABELS = {"appointments": "doctor", "prescriptions": "medication", "careplans": "careplan"}
+meta = globals.db["rollup_meta"]
+_ready = {"value": False, "checked": 0.0}
+
+def collection(kind):
+    return globals.db[f"rollup_{kind}"]
+
+def year_of(value):
+    return str(value or "")[:4]
+
+def is_active(careplan):
+    return "stop" not in careplan or careplan["stop"] == "Unknown"
+
+# helper: rollup key for one sub-document, field order must match group_key()
+def key(kind, sub, gender):
+    if kind == "appointments":
+        return {"doctor": sub.get("doctor"), "year": year_of(sub.get("date")), "gender": gender}
+    if kind == "prescriptions":
+        return {"medication": sub.get("name"), "status": sub.get("status"), "gender": gender}
+    return {"careplan": sub.get("description"), "year": year_of(sub.get("start")),
+            "active": is_active(sub), "gender": gender}
+
+# helper: the same key as an aggregation expression over unwound rows; missing
+# fields become null as in key(), otherwise $group would leave them out of _id
+def group_key(kind):
+    field = lambda path: {"$ifNull": [path, None]}
+    year = lambda name: {"$substrCP": [{"$ifNull": [f"${kind}.{name}", ""]}, 0, 4]}
+    if kind == "appointments":
+        return {"doctor": field("$appointments.doctor"), "year": year("date"), "gender": field("$gender")}
+    if kind == "prescriptions":
+        return {"medication": field("$prescriptions.name"), "status": field("$prescriptions.status"),
+                "gender": field("$gender")}
+    return {
+        "careplan": field("$careplans.description"),
+        "year": year("start"),
+        "active": {"$or": [
+            {"$eq": ["$careplans.stop", "Unknown"]},
+            {"$eq": [{"$type": "$careplans.stop"}, "missing"]},
+        ]},
+        "gender": field("$gender")
+    }
+
+# record sub-documents being added (delta=1) or removed (delta=-1)
+def record(kind, subs, gender, delta):
+    ops = [UpdateOne({"_id": key(kind, s, gender)}, {"$inc": {"count": delta}}, upsert=True) for s in subs]
+    if ops:
+        collection(kind).bulk_write(ops, ordered=False)
+
+# record a sub-document update, only touching counters when its key changed
+def replace(kind, old, new, gender):
+    if key(kind, old, gender) != key(kind, new, gender):
+        record(kind, [old], gender, -1)
+        record(kind, [new], gender, 1)
+
+# move every sub-document of a patient to a new gender
+def regender(subs_by_kind, old_gender, new_gender):
+    if old_gender == new_gender:
+        return
+    for kind, subs in subs_by_kind.items():
+        record(kind, subs, old_gender, -1)
+        record(kind, subs, new_gender, 1)
+
+# counters computed from the source data
+def compute(kind):
+    source, pipeline = subresources.unwound(kind, need_gender=True)
+    pipeline.append({"$group": {"_id": group_key(kind), "count": {"$sum": 1}}})
+    return source.aggregate(pipeline)
+
+# recompute every rollup from the source data; each is built in a scratch
+# collection and renamed over the live one, so /stats never reads a half-built rollup
+def rebuild():
+    for kind in subresources.KINDS:
+        scratch = globals.db[f"rollup_{kind}_rebuild_{ObjectId()}"]
+        batch, built = [], 0
+        for doc in compute(kind):
+            batch.append(doc)
+            if len(batch) >= 1000:
+                scratch.insert_many(batch)
+                built += len(batch)
+                batch = []
+        if batch:
+            scratch.insert_many(batch)
+            built += len(batch)
+        if built:
+            scratch.rename(collection(kind).name, dropTarget=True)
+        else:
+            collection(kind).drop()
+    meta.update_one({"_id": "rollups"}, {"$set": {"built_at": datetime.datetime.utcnow()}}, upsert=True)
+    _ready.update(value=True, checked=time.monotonic())
+
+# compare the rollups with the source data, returns the mismatched keys per kind
+def check():
+    report = {}
+    for kind in subresources.KINDS:
+        expected = {tuple(d["_id"].items()): d["count"] for d in compute(kind)}
+        actual = {tuple(d["_id"].items()): d["count"] for d in collection(kind).find({"count": {"$ne": 0}})}
+        report[kind] = [
+            {"key": dict(k), "expected": expected.get(k, 0), "actual": actual.get(k, 0)}
+            for k in set(expected) | set(actual) if expected.get(k, 0) != actual.get(k, 0)
+        ]
+    return report
+
+# true once a rebuild has run, re-checked at most once a minute
+def ready():
+    if time.monotonic() - _ready["checked"] > 60:
+        _ready.update(value=meta.find_one({"_id": "rollups"}) is not None, checked=time.monotonic())
+    return _ready["value"]
+
+# top entries of a rollup, grouped by its label (doctor/medication/careplan); this
+# groups every counter document matching the filter, so its cost follows the
+# number of distinct dimension combinations rather than the result size
+def top(kind, match=None, skip=0, limit=10):
+    label = LABELS[kind]
+    pipeline = [{"$match": {f"_id.{k}": v for k, v in (match or {}).items()}}] if match else []
+    pipeline += [
+        {"$group": {"_id": f"$_id.{label}", "count": {"$sum": "$count"}}},
+        {"$match": {"count": {"$gt": 0}}},
+        {"$sort": {"count": -1}},
+        {"$skip": skip},
+        {"$limit": limit},
+        {"$project": {label: "$_id", "count": 1, "_id": 0}},
+    ]
+    return list(collection(kind).aggregate(pipeline))
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the analytics rollups")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    args = parser.parse_args()
+    if args.command == "rebuild":
+        rebuild()
+        print("Rollups rebuilt.")
+    else:
+        report = check()
+        for kind, mismatches in report.items():
+            print(f"{kind}: {len(mismatches)} mismatched counters")
+            for m in mismatches[:20]:
+                print(f"  {m}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import argparse, csv, json, os, random, sys, time
+from collections import defaultdict
+from datetime import datetime, timezone
+from bson import ObjectId
+import globals
+import indexes
+import subresources
+import seed_synthea_data as seeder
+from search import terms_for
+from utils import age_group
+
+# synthetic patients at any scale with the shape and distributions of a Synthea
+# export: every patient copies the age, gender, condition and sub-record counts
+# of a random real patient, takes a first and last name from the real name
+# pools and draws its appointments, prescriptions and careplans from the real
+# rows. Patient i of a seed is always the same document, so runs are
+# reproducible and can be split across processes with --start.
+#
+#   python scale_dataset.py --patients 1000000 --drop
+#   python scale_dataset.py --patients 10000 --ndjson patients.ndjson
+
+# ObjectIds: 4-byte timestamp (fixed base plus the seed), 5-byte patient index,
+# 1-byte kind (0 = patient) and 2-byte sub-record index
+ID_BASE = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+KIND_CODES = {kind: n + 1 for n, kind in enumerate(subresources.KINDS)}
+MAX_SUBS = 0xFFFF
+
+def id_prefix(seed, i):
+    return (ID_BASE + seed).to_bytes(4, "big") + i.to_bytes(5, "big")
+
+def make_id(prefix, kind=0, j=0):
+    return ObjectId(prefix + bytes((kind, j >> 8, j & 0xFF)))
+
+# distributions learned from one Synthea csv export
+class Profile:
+    def __init__(self, templates, first_names, last_names, pools):
+        self.templates = templates
+        self.first_names = first_names
+        self.last_names = last_names
+        self.pools = pools
+
+    @classmethod
+    def learn(cls, csv_dir):
+        providers = seeder.load_providers(csv_dir)
+        counts = defaultdict(lambda: dict.fromkeys(subresources.KINDS, 0))
+        conditions = {}
+        pools = {kind: [] for kind in subresources.KINDS}
+        for name, (filename, convert) in seeder.SOURCES.items():
+            path = os.path.join(csv_dir, filename)
+            if name == "patients" or not os.path.exists(path):
+                continue
+            with open(path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    item = convert(row, providers)
+                    if not item:
+                        continue
+                    pid, value = item
+                    if name == "conditions":
+                        conditions.setdefault(pid, value)
+                    else:
+                        value.pop("_id")
+                        pools[name].append(value)
+                        counts[pid][name] += 1
+
+        templates, first_names, last_names = [], [], []
+        with open(os.path.join(csv_dir, "patients.csv"), newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                pid = row.get("Id") or row.get("ID")
+                first = seeder.title_case_name(row.get("FIRST"), None)
+                last = seeder.title_case_name(None, row.get("LAST"))
+                age = seeder.years_between(row.get("BIRTHDATE"))
+                if not (first and last and age):
+                    continue
+                first_names.append(first)
+                last_names.append(last)
+                templates.append({
+                    "age": age,
+                    "gender": row.get("GENDER") or "Unknown",
+                    "condition": seeder.clean_condition(conditions.get(pid) or "Check-up"),
+                    "counts": {kind: min(n, MAX_SUBS) for kind, n in counts[pid].items()}
+                })
+        if not templates:
+            raise ValueError(f"No usable patients in {csv_dir}")
+        return cls(templates, first_names, last_names, pools)
+
+    # patient i of the given seed, in the seeder's document shape
+    def patient(self, seed, i):
+        rng = random.Random(seed * 10**12 + i)
+        prefix = id_prefix(seed, i)
+        template = rng.choice(self.templates)
+        town = rng.choice(list(seeder.town_boxes))
+        box = seeder.town_boxes[town]
+        patient = {
+            "_id": make_id(prefix),
+            "name": f"{rng.choice(self.first_names)} {rng.choice(self.last_names)}",
+            "age": template["age"],
+            "age_group": age_group(template["age"]),
+            "gender": template["gender"],
+            "condition": template["condition"],
+            "town": town,
+            "location": {"type": "Point", "coordinates": [
+                box[1] + (box[3] - box[1]) * rng.random(), box[0] + (box[2] - box[0]) * rng.random()
+            ]},
+            "image_url": None,
+        }
+        for kind in subresources.KINDS:
+            pool = self.pools[kind]
+            n = template["counts"][kind] if pool else 0
+            code = KIND_CODES[kind]
+            patient[kind] = [{"_id": make_id(prefix, code, j), **rng.choice(pool)} for j in range(n)]
+            patient[subresources.counter(kind)] = n
+        patient["last_updated"] = datetime.utcfromtimestamp(ID_BASE + seed).isoformat()
+        patient["search_terms"] = terms_for(patient, patient)
+        return patient
+
+    def patients(self, seed, count, start=0):
+        for i in range(start, start + count):
+            yield self.patient(seed, i)
+
+# helper: unordered bulk insert of one batch in the configured storage mode
+def write_batch(db, batch):
+    if subresources.split_mode():
+        for kind in subresources.KINDS:
+            subs = [{**sub, "patient_id": p["_id"]} for p in batch for sub in p[kind]]
+            if subs:
+                db[kind].insert_many(subs, ordered=False)
+        batch = [{k: v for k, v in p.items() if k not in subresources.KINDS} for p in batch]
+    db["patients"].insert_many(batch, ordered=False)
+
+# stream patients into Mongo in batches, returns the number written
+def to_mongo(db, patients, batch_size=1000, drop=False):
+    if drop:
+        for name in ("patients", *subresources.KINDS, *(f"rollup_{k}" for k in subresources.KINDS), "rollup_meta"):
+            db[name].drop()
+    written, batch = 0, []
+    for patient in patients:
+        batch.append(patient)
+        if len(batch) >= batch_size:
+            write_batch(db, batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        write_batch(db, batch)
+        written += len(batch)
+    indexes.apply(db=db)
+    db["search_meta"].update_one({"_id": "search"}, {"$set": {"built_at": datetime.utcnow()}}, upsert=True)
+    return written
+
+# helper: ObjectIds as extended JSON, the only non-JSON type in the documents
+def oid(value):
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+# stream patients as MongoDB extended JSON, one document per line (mongoimport-compatible)
+def to_ndjson(out, patients):
+    written = 0
+    for patient in patients:
+        out.write(json.dumps(patient, default=oid) + "\n")
+        written += 1
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic patient dataset from the Synthea csv export")
+    parser.add_argument("--patients", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--start", type=int, default=0, help="index of the first patient, to generate in shards")
+    parser.add_argument("--csv-dir", default=seeder.CSV_DIR)
+    parser.add_argument("--ndjson", help="write to this file ('-' for stdout) instead of MONGO_URI/MONGO_DB")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--drop", action="store_true", help="drop the patient collections first")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    profile = Profile.learn(args.csv_dir)
+    patients = profile.patients(args.seed, args.patients, args.start)
+    if args.ndjson == "-":
+        written = to_ndjson(sys.stdout, patients)
+    elif args.ndjson:
+        with open(args.ndjson, "w", encoding="utf-8") as f:
+            written = to_ndjson(f, patients)
+    else:
+        written = to_mongo(globals.db, patients, args.batch_size, args.drop)
+        print("Run 'python rollups.py rebuild' and 'python geo_grid.py rebuild' to build the analytics rollups "
+              "and map grid.", file=sys.stderr)
+    seconds = time.perf_counter() - started
+    print(f"Generated {written} patients in {seconds:.1f}s ({written / seconds:.0f} patients/s)", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
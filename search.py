@@ -0,0 +1,94 @@
+import argparse, datetime, math, re, time
+from pymongo import UpdateOne
+import globals
+import indexes
+import subresources
+
+# patient search index: every patient carries a "search_terms" array of padded
+# word trigrams built from name and condition (and, with
+# SEARCH_INCLUDE_SUBRESOURCES, medication and careplan names), backed by a
+# multikey index. A query matches patients sharing enough of its trigrams and
+# is ranked by how many it shares, which gives prefix-as-you-type matching
+# (a prefix's trigrams are a subset of the word's) and typo tolerance.
+patients = globals.db["patients"]
+meta = globals.db["search_meta"]
+WORDS = re.compile(r"[a-z0-9]+")
+_ready = {"value": False, "checked": 0.0}
+
+# helper: trigrams of every word in text, padded at the word start (and end unless prefix)
+def grams(text, prefix=False):
+    result = set()
+    for word in WORDS.findall(str(text or "").lower()):
+        padded = "  " + word + ("" if prefix else " ")
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+# helper: search terms for a patient document, subs is {kind: [sub-documents]}
+def terms_for(doc, subs=None):
+    terms = grams(doc.get("name")) | grams(doc.get("condition"))
+    if globals.search_include_subresources and subs:
+        for p in subs.get("prescriptions", []):
+            terms |= grams(p.get("name"))
+        for c in subs.get("careplans", []):
+            terms |= grams(c.get("description"))
+    return sorted(terms)
+
+def projection_for_terms():
+    fields = {"name": 1, "condition": 1}
+    if globals.search_include_subresources and not subresources.split_mode():
+        fields.update({"prescriptions.name": 1, "careplans.description": 1})
+    return fields
+
+# recompute the search terms of one patient after a write
+def reindex(pid):
+    doc = patients.find_one({"_id": pid}, projection_for_terms())
+    if doc:
+        subs = subresources.subs_of(doc) if globals.search_include_subresources else None
+        patients.update_one({"_id": pid}, {"$set": {"search_terms": terms_for(doc, subs)}})
+
+# recompute the search terms of every patient
+def rebuild(batch_size=500):
+    ops = []
+    for doc in patients.find({}, projection_for_terms()):
+        subs = subresources.subs_of(doc) if globals.search_include_subresources else None
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"search_terms": terms_for(doc, subs)}}))
+        if len(ops) >= batch_size:
+            patients.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        patients.bulk_write(ops, ordered=False)
+    meta.update_one({"_id": "search"}, {"$set": {"built_at": datetime.datetime.utcnow()}}, upsert=True)
+    _ready.update(value=True, checked=time.monotonic())
+
+# true once the terms have been built, re-checked at most once a minute
+def ready():
+    if time.monotonic() - _ready["checked"] > 60:
+        _ready.update(value=meta.find_one({"_id": "search"}) is not None, checked=time.monotonic())
+    return _ready["value"]
+
+# aggregation stages matching and scoring patients for q; after is (score, _id) of the last row seen
+def pipeline(q, filters=None, after=None):
+    query_grams = sorted(grams(q, prefix=True))
+    min_score = max(1, math.ceil(len(query_grams) * globals.search_min_similarity))
+    stages = [
+        {"$match": {"search_terms": {"$in": query_grams}, **(filters or {})}},
+        {"$addFields": {"score": {"$size": {"$filter": {
+            "input": query_grams, "cond": {"$in": ["$$this", "$search_terms"]}
+        }}}}},
+        {"$match": {"score": {"$gte": min_score}}},
+    ]
+    if after:
+        score, last_id = after
+        stages.append({"$match": {"$or": [{"score": {"$lt": score}}, {"score": score, "_id": {"$gt": last_id}}]}})
+    return stages
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the patient search index")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+    indexes.apply(["patients"])
+    rebuild()
+    print("Search terms rebuilt.")
+
+if __name__ == "__main__":
+    main()
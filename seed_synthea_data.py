@@ -1,16 +1,44 @@
+import argparse
 import csv
-from datetime import datetime, date
-from pymongo import MongoClient
-from bson import ObjectId
-from collections import defaultdict
+import hashlib
+import heapq
+import itertools
+import json
 import os
-import re
+import pickle
 import random
+import re
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date
+from functools import lru_cache
+from pymongo import UpdateOne, ReplaceOne, DeleteOne
+from bson import ObjectId
+from search import terms_for
+from utils import age_group
+import globals
+import geo_grid
+import rollups
+import subresources
 
 # paths and setup
 CSV_DIR = os.path.join("data", "synthea_csv")
+# "collections" writes appointments/prescriptions/careplans to their own collections
+STORAGE_MODE = os.environ.get("STORAGE_MODE", "embedded")
+SUB_KINDS = ("appointments", "prescriptions", "careplans")
+# patient fields owned by the import, compared by the delta mode
+PATIENT_FIELDS = ("name", "age", "age_group", "condition", "town", "location", "image_url")
+DIGITS = re.compile(r"\d+")
+PARENTHESES = re.compile(r"\(.*?\)")
+DOCTOR_PREFIX = re.compile(r"^(Dr\.|Clinic)", re.IGNORECASE)
+
+# the normalisers below are memoised: dates, provider names and descriptions
+# repeat across millions of rows
 
 # helper: calculate age
+@lru_cache(maxsize=65536)
 def years_between(dob_str):
     try:
         dob = datetime.strptime(dob_str[:10], "%Y-%m-%d").date()
@@ -22,122 +50,44 @@ def years_between(dob_str):
 # helper: clean patient name
 def title_case_name(given, family):
     name = f"{(given or '').strip()} {(family or '').strip()}".strip()
-    name = re.sub(r"\d+", "", name).strip()
+    name = DIGITS.sub("", name).strip()
     return name.title() if name else None
 
 # helper: clean doctor name
+@lru_cache(maxsize=65536)
 def clean_doctor_name(name):
     if not name:
         return "Clinic GP"
-    name = re.sub(r"\d+", "", name).strip()
-    if not re.match(r"^(Dr\.|Clinic)", name, re.IGNORECASE):
+    name = DIGITS.sub("", name).strip()
+    if not DOCTOR_PREFIX.match(name):
         name = "Dr. " + name
     return name.title()
 
 # helper: clean date
+@lru_cache(maxsize=65536)
 def clean_date(d):
     try:
         return datetime.strptime(d[:10], "%Y-%m-%d").strftime("%Y-%m-%d")
     except:
         return "Unknown"
 
-# helper: assign age group
-def age_group(age):
-    if age is None:
-        return "Unknown"
-    if age < 18:
-        return "Child"
-    elif age < 40:
-        return "Adult"
-    elif age < 65:
-        return "Middle-aged"
-    else:
-        return "Senior"
-
-# load providers
-providers = {}
-prov_path = os.path.join(CSV_DIR, "providers.csv")
-if os.path.exists(prov_path):
-    with open(prov_path, newline="", encoding="utf-8") as f:
-        for row in csv.DictReader(f):
-            raw_name = row.get("NAME") or "Clinic GP"
-            providers[row.get("Id") or row.get("ID")] = clean_doctor_name(raw_name)
-
-# load conditions
-conditions_by_patient = defaultdict(list)
-cond_path = os.path.join(CSV_DIR, "conditions.csv")
-if os.path.exists(cond_path):
-    with open(cond_path, newline="", encoding="utf-8") as f:
-        for row in csv.DictReader(f):
-            pid = row.get("PATIENT") or row.get("Id")
-            desc = row.get("DESCRIPTION") or "General Checkup"
-            if pid:
-                desc = re.sub(r"\(.*?\)", "", desc).strip().title()
-                conditions_by_patient[pid].append(desc)
-
-# load encounters
-encounters_by_patient = defaultdict(list)
-enc_path = os.path.join(CSV_DIR, "encounters.csv")
-if os.path.exists(enc_path):
-    with open(enc_path, newline="", encoding="utf-8") as f:
-        for row in csv.DictReader(f):
-            pid = row.get("PATIENT")
-            date_str = clean_date(row.get("START") or "2024-01-01")
-            doctor = clean_doctor_name(providers.get(row.get("PROVIDER"), "Dr. Smith"))
-            reason = row.get("REASONDESCRIPTION") or row.get("CLASS") or "Consultation"
-            if pid:
-                encounters_by_patient[pid].append({
-                    "_id": ObjectId(),
-                    "doctor": doctor,
-                    "date": date_str,
-                    "notes": reason,
-                    "status": "completed"
-                })
-
-# load medications
-meds_by_patient = defaultdict(list)
-med_path = os.path.join(CSV_DIR, "medications.csv")
-if os.path.exists(med_path):
-    with open(med_path, newline="", encoding="utf-8") as f:
-        for row in csv.DictReader(f):
-            pid = row.get("PATIENT")
-            name = row.get("DESCRIPTION") or row.get("CODE") or "Medication"
-            start = clean_date(row.get("START") or "")
-            stop = clean_date(row.get("STOP") or "")
-            if pid:
-                meds_by_patient[pid].append({
-                    "_id": ObjectId(),
-                    "name": name.strip().title(),
-                    "start": start,
-                    "stop": stop,
-                    "status": "active" if stop == "Unknown" else "completed"
-                })
-
-# load careplans
-careplans_by_patient = defaultdict(list)
-cp_path = os.path.join(CSV_DIR, "careplans.csv")
-if os.path.exists(cp_path):
-    with open(cp_path, newline="", encoding="utf-8") as f:
-        for row in csv.DictReader(f):
-            pid = row.get("PATIENT")
-            desc = row.get("DESCRIPTION") or row.get("CATEGORY") or "Care plan"
-            start = clean_date(row.get("START") or "")
-            stop = clean_date(row.get("STOP") or "")
-            if pid:
-                careplans_by_patient[pid].append({
-                    "_id": ObjectId(),
-                    "description": desc.strip().title(),
-                    "start": start,
-                    "stop": stop
-                })
-
-# connect to MongoDB
-client = MongoClient("mongodb://127.0.0.1:27017")
-db = client["syntheaDB"]
-patients_col = db["patients"]
-
-print("Dropping existing patients collection in syntheaDB...")
-patients_col.drop()
+# helper: title-cased description
+@lru_cache(maxsize=65536)
+def clean_title(text):
+    return text.strip().title()
+
+# helper: condition description without the bracketed qualifier
+@lru_cache(maxsize=65536)
+def clean_condition(text):
+    return PARENTHESES.sub("", text).strip().title()
+
+# helper: ObjectId derived from a Synthea key, so re-imports keep the same ids
+def stable_id(*parts):
+    return ObjectId(hashlib.sha1("|".join(parts).encode()).digest()[:12])
+
+# helper: hash of a record's content
+def content_hash(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
 
 # sample towns and coordinates
 town_boxes = {
@@ -147,52 +97,500 @@ town_boxes = {
     "Donegal": [54.6400, -8.1500, 54.6700, -8.1000]
 }
 
-# read patients and insert
-pat_path = os.path.join(CSV_DIR, "patients.csv")
-to_insert = []
+# per-stage row counts and timings, printed as rows/sec at the end
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
 
-with open(pat_path, newline="", encoding="utf-8") as f:
-    for row in csv.DictReader(f):
-        pid = row.get("Id") or row.get("ID")
-        name = title_case_name(row.get("FIRST"), row.get("LAST"))
-        age = years_between(row.get("BIRTHDATE"))
+    def add(self, stage, rows, seconds):
+        total_rows, total_seconds = self.stages.get(stage, (0, 0.0))
+        self.stages[stage] = (total_rows + rows, total_seconds + seconds)
 
-        if not name or not age:
-            continue
+    def report(self):
+        for stage, (rows, seconds) in self.stages.items():
+            rate = rows / seconds if seconds else float("inf")
+            print(f"  {stage:<22} {rows:>10} rows {seconds:>8.2f}s {rate:>12.0f} rows/s")
 
-        condition = conditions_by_patient.get(pid, ["Check-up"])[0]
-        condition = re.sub(r"\(.*?\)", "", condition).strip().title()
-        town = random.choice(list(town_boxes.keys()))
-        box = town_boxes[town]
-        rand_lat = box[0] + (box[2] - box[0]) * random.random()
-        rand_long = box[1] + (box[3] - box[1]) * random.random()
-
-        patient = {
-            "name": name,
-            "age": age,
-            "age_group": age_group(age),
-            "condition": condition,
-            "town": town,
-            "location": {"type": "Point", "coordinates": [rand_long, rand_lat]},
-            "image_url": None,
-            "appointments": encounters_by_patient.get(pid, []),
-            "prescriptions": meds_by_patient.get(pid, []),
-            "careplans": careplans_by_patient.get(pid, []),
-            "last_updated": datetime.utcnow().isoformat()
+# row converters: csv row -> (patient key, value), None to skip the row
+def condition_row(row, providers):
+    pid = row.get("PATIENT") or row.get("Id")
+    desc = row.get("DESCRIPTION") or "General Checkup"
+    if pid:
+        return pid, clean_condition(desc)
+
+def encounter_row(row, providers):
+    pid = row.get("PATIENT")
+    date_str = clean_date(row.get("START") or "2024-01-01")
+    doctor = clean_doctor_name(providers.get(row.get("PROVIDER"), "Dr. Smith"))
+    reason = row.get("REASONDESCRIPTION") or row.get("CLASS") or "Consultation"
+    if pid:
+        return pid, {
+            "_id": stable_id("encounter", row.get("Id") or f"{pid}|{row.get('START')}"),
+            "doctor": doctor,
+            "date": date_str,
+            "notes": reason,
+            "status": "completed"
+        }
+
+def medication_row(row, providers):
+    pid = row.get("PATIENT")
+    name = row.get("DESCRIPTION") or row.get("CODE") or "Medication"
+    start = clean_date(row.get("START") or "")
+    stop = clean_date(row.get("STOP") or "")
+    if pid:
+        return pid, {
+            "_id": stable_id("medication", pid, row.get("ENCOUNTER") or "", row.get("CODE") or "", row.get("START") or ""),
+            "name": clean_title(name),
+            "start": start,
+            "stop": stop,
+            "status": "active" if stop == "Unknown" else "completed"
         }
-        to_insert.append(patient)
-
-# insert into MongoDB
-if to_insert:
-    patients_col.insert_many(to_insert)
-    print(f"Inserted {len(to_insert)} cleaned patients with location data into syntheaDB.patients")
-    sample = to_insert[0]
-    print("\nSample patient preview:")
-    print(f"Name: {sample['name']}, Age: {sample['age']} ({sample['age_group']})")
-    print(f"Condition: {sample['condition']}, Town: {sample['town']}")
-    print(f"Coordinates: {sample['location']['coordinates']}")
-    print(f"Appointments: {len(sample['appointments'])}, "
-          f"Prescriptions: {len(sample['prescriptions'])}, "
-          f"Careplans: {len(sample['careplans'])}")
-else:
-    print("No patients found — check CSV folder paths or data quality.")
+
+def careplan_row(row, providers):
+    pid = row.get("PATIENT")
+    desc = row.get("DESCRIPTION") or row.get("CATEGORY") or "Care plan"
+    start = clean_date(row.get("START") or "")
+    stop = clean_date(row.get("STOP") or "")
+    if pid:
+        return pid, {
+            "_id": stable_id("careplan", row.get("Id") or f"{pid}|{row.get('CODE')}|{row.get('START')}"),
+            "description": clean_title(desc),
+            "start": start,
+            "stop": stop
+        }
+
+def patient_row(row, providers):
+    pid = row.get("Id") or row.get("ID")
+    if pid:
+        return pid, row
+
+# file name, converter and stage name for every per-patient csv
+SOURCES = {
+    "conditions": ("conditions.csv", condition_row),
+    "appointments": ("encounters.csv", encounter_row),
+    "prescriptions": ("medications.csv", medication_row),
+    "careplans": ("careplans.csv", careplan_row),
+    "patients": ("patients.csv", patient_row),
+}
+
+# helper: load the provider names, small enough to keep in memory
+def load_providers(csv_dir):
+    providers = {}
+    prov_path = os.path.join(csv_dir, "providers.csv")
+    if os.path.exists(prov_path):
+        with open(prov_path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                raw_name = row.get("NAME") or "Clinic GP"
+                providers[row.get("Id") or row.get("ID")] = clean_doctor_name(raw_name)
+    return providers
+
+# helper: write one sorted run of (key, value) pairs to a spill file
+def spill(run, tmp_dir):
+    fd, path = tempfile.mkstemp(dir=tmp_dir, suffix=".run")
+    with os.fdopen(fd, "wb") as f:
+        for item in run:
+            pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+    return path
+
+# helper: stream the pairs back out of a spill file
+def read_run(path):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+# external sort of one csv by patient: converts rows, sorts runs of chunk_rows
+# and spills them to disk; returns the run files and the number of rows read
+def sort_runs(path, convert, providers, chunk_rows, tmp_dir):
+    runs, run, rows = [], [], 0
+    if os.path.exists(path):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                rows += 1
+                item = convert(row, providers)
+                if item:
+                    run.append(item)
+                if len(run) >= chunk_rows:
+                    run.sort(key=lambda kv: kv[0])
+                    runs.append(spill(run, tmp_dir))
+                    run = []
+    if run:
+        run.sort(key=lambda kv: kv[0])
+        runs.append(spill(run, tmp_dir))
+    return runs, rows
+
+# helper: sort_runs for one SOURCES entry, timed inside the worker
+def sort_source(name, csv_dir, providers, chunk_rows, tmp_dir):
+    filename, convert = SOURCES[name]
+    started = time.perf_counter()
+    runs, rows = sort_runs(os.path.join(csv_dir, filename), convert, providers, chunk_rows, tmp_dir)
+    return name, runs, rows, time.perf_counter() - started
+
+# sort every per-patient file, one file per worker process (inline with a single worker);
+# returns {name: (runs, rows, seconds)}
+def sort_sources(csv_dir, providers, chunk_rows, tmp_dir, workers):
+    args = [(name, csv_dir, providers, chunk_rows, tmp_dir) for name in SOURCES]
+    if workers <= 1:
+        results = [sort_source(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(args))) as pool:
+            results = list(pool.map(sort_source, *zip(*args)))
+    return {name: (runs, rows, seconds) for name, runs, rows, seconds in results}
+
+# helper: merge the sorted runs of one file into a (patient key, [values]) stream;
+# heapq.merge is stable, so values keep their file order within a patient
+def grouped(runs):
+    merged = heapq.merge(*(read_run(r) for r in runs), key=lambda kv: kv[0])
+    for pid, items in itertools.groupby(merged, key=lambda kv: kv[0]):
+        yield pid, [v for _, v in items]
+
+# helper: sort-merge join of the patient stream with the per-patient child streams
+def join(patient_stream, child_streams):
+    heads = {name: next(stream, None) for name, stream in child_streams.items()}
+    for pid, rows in patient_stream:
+        children = {}
+        for name, stream in child_streams.items():
+            while heads[name] and heads[name][0] < pid:
+                heads[name] = next(stream, None)
+            if heads[name] and heads[name][0] == pid:
+                children[name] = heads[name][1]
+                heads[name] = next(stream, None)
+            else:
+                children[name] = []
+        yield rows[0], children
+
+# helper: re-derive the ids of repeated rows (e.g. a medication listed twice
+# for the same encounter), numbering them in file order
+def unique_ids(subs):
+    seen = {}
+    for sub in subs:
+        n = seen[sub["_id"]] = seen.get(sub["_id"], 0) + 1
+        if n > 1:
+            sub["_id"] = stable_id(str(sub["_id"]), str(n))
+    return subs
+
+# helper: build the patient document, None if the row is not usable
+def build_patient(row, children):
+    name = title_case_name(row.get("FIRST"), row.get("LAST"))
+    age = years_between(row.get("BIRTHDATE"))
+
+    if not name or not age:
+        return None
+
+    synthea_id = row.get("Id") or row.get("ID")
+    condition = (children["conditions"] or ["Check-up"])[0]
+    condition = clean_condition(condition)
+    # seeded by the Synthea id so a patient keeps its town and location across imports
+    rng = random.Random(synthea_id)
+    town = rng.choice(list(town_boxes.keys()))
+    box = town_boxes[town]
+    rand_lat = box[0] + (box[2] - box[0]) * rng.random()
+    rand_long = box[1] + (box[3] - box[1]) * rng.random()
+
+    patient = {
+        "_id": stable_id("patient", synthea_id),
+        "name": name,
+        "age": age,
+        "age_group": age_group(age),
+        "condition": condition,
+        "town": town,
+        "location": {"type": "Point", "coordinates": [rand_long, rand_lat]},
+        "image_url": None,
+        "appointments": unique_ids(children["appointments"]),
+        "prescriptions": unique_ids(children["prescriptions"]),
+        "careplans": unique_ids(children["careplans"]),
+        "appointment_count": len(children["appointments"]),
+        "prescription_count": len(children["prescriptions"]),
+        "careplan_count": len(children["careplans"]),
+        "last_updated": datetime.utcnow().isoformat()
+    }
+    patient["search_terms"] = terms_for(patient, patient)
+    return patient
+
+# helper: import bookkeeping for one patient, stored in the synthea_import collection
+def import_record(row, patient):
+    subs = {kind: {str(sub["_id"]): content_hash(sub) for sub in patient[kind]} for kind in SUB_KINDS}
+    return {
+        "_id": row.get("Id") or row.get("ID"),
+        "patient_id": patient["_id"],
+        "hash": content_hash({f: patient[f] for f in PATIENT_FIELDS}),
+        "subs_hash": content_hash(subs),
+        "subs": subs
+    }
+
+# helper: move the rollup counters for (old, new, gender) sub-document pairs, old or
+# new None for a sub-document added or removed; pairs whose key is unchanged are skipped
+def record_changes(kind, pairs):
+    removed, added = {}, {}
+    for old, new, gender in pairs:
+        if old and new and rollups.key(kind, old, gender) == rollups.key(kind, new, gender):
+            continue
+        if old:
+            removed.setdefault(gender, []).append(old)
+        if new:
+            added.setdefault(gender, []).append(new)
+    for gender, subs in removed.items():
+        rollups.record(kind, subs, gender, -1)
+    for gender, subs in added.items():
+        rollups.record(kind, subs, gender, 1)
+
+# helper: unordered bulk insert of one batch of (patient, import record) pairs in the configured layout;
+# track counts the new patients into the rollups and map grid (delta mode, a full import rebuilds them)
+def write_batch(db, batch, track=False):
+    if STORAGE_MODE == "collections":
+        for kind in SUB_KINDS:
+            subs = [{**sub, "patient_id": p["_id"]} for p, _ in batch for sub in p[kind]]
+            if subs:
+                db[kind].insert_many(subs, ordered=False)
+        db["patients"].insert_many([{k: v for k, v in p.items() if k not in SUB_KINDS} for p, _ in batch], ordered=False)
+    else:
+        db["patients"].insert_many([p for p, _ in batch], ordered=False)
+    db["synthea_import"].insert_many([r for _, r in batch], ordered=False)
+    if track:
+        geo_grid.record([p for p, _ in batch], 1)
+        for kind in SUB_KINDS:
+            record_changes(kind, [(None, sub, p.get("gender")) for p, _ in batch for sub in p[kind]])
+
+# helper: an imported row replacing a stored one continues its version, so the
+# sub-resource ETag changes and If-Match against the old content fails
+def replaced(sub, stored):
+    return {**sub, "version": subresources.version_of(stored) + 1} if stored else sub
+
+# helper: merge the imported sub-documents of a changed patient with what is stored;
+# unchanged imported rows keep their stored version, rows added through the API are kept
+def merge_subs(kind, patient, record, old_record, stored):
+    old_hashes = old_record["subs"][kind]
+    new_hashes = record["subs"][kind]
+    existing = {str(s["_id"]): s for s in stored}
+    merged = []
+    for sub in patient[kind]:
+        sid = str(sub["_id"])
+        unchanged = old_hashes.get(sid) == new_hashes[sid] and sid in existing
+        merged.append(existing[sid] if unchanged else replaced(sub, existing.get(sid)))
+    merged += [s for sid, s in existing.items() if sid not in old_hashes]
+    return merged
+
+# helper: upserts/deletes for one batch of changed patients, only touching the rows that changed,
+# then moves the rollup and map grid counters of the writes that landed. Patients deleted
+# through the API since the last import stay deleted
+def update_batch(db, changed, counts):
+    old_records = {r["_id"]: r for r in db["synthea_import"].find({"_id": {"$in": [r["_id"] for _, r in changed]}})}
+    pids = [old_records[r["_id"]]["patient_id"] for _, r in changed]
+    before = {d["_id"]: d for d in db["patients"].find({"_id": {"$in": pids}}, {"gender": 1, **{f: 1 for f in geo_grid.FIELDS}})}
+    live = [(p, r) for p, r in changed if old_records[r["_id"]]["patient_id"] in before]
+    counts["patients skipped"] += len(changed) - len(live)
+    stored = {}
+    if STORAGE_MODE != "collections":
+        ids = [old_records[r["_id"]]["patient_id"] for _, r in live if r["subs_hash"] != old_records[r["_id"]]["subs_hash"]]
+        stored = {d["_id"]: d for d in db["patients"].find({"_id": {"$in": ids}}, {kind: 1 for kind in SUB_KINDS})}
+
+    patient_ops, import_ops = [], []
+    # collections mode: (patient id, sub-document id, imported row or None to delete) per kind
+    rows = {kind: [] for kind in SUB_KINDS}
+    # rollup pairs: (patient id, old, new) per kind
+    pairs = {kind: [] for kind in SUB_KINDS}
+    grid_moves = {}
+    for patient, record in live:
+        old = old_records[record["_id"]]
+        pid = old["patient_id"]
+        update = {"$set": {}, "$inc": {}}
+        if record["hash"] != old["hash"]:
+            update["$set"].update({f: patient[f] for f in PATIENT_FIELDS})
+            grid_moves[pid] = (before[pid], {**before[pid], **{f: patient[f] for f in geo_grid.FIELDS}})
+        if record["subs_hash"] != old["subs_hash"]:
+            for kind in SUB_KINDS:
+                old_hashes, new_hashes = old["subs"][kind], record["subs"][kind]
+                if old_hashes == new_hashes:
+                    continue
+                if STORAGE_MODE == "collections":
+                    for sub in patient[kind]:
+                        if old_hashes.get(str(sub["_id"])) != new_hashes[str(sub["_id"])]:
+                            rows[kind].append((pid, sub["_id"], sub))
+                    for sid in set(old_hashes) - set(new_hashes):
+                        rows[kind].append((pid, ObjectId(sid), None))
+                    update["$inc"][f"{kind[:-1]}_count"] = len(new_hashes) - len(old_hashes)
+                else:
+                    current = stored.get(pid, {}).get(kind, [])
+                    merged = merge_subs(kind, patient, record, old, current)
+                    olds = {s["_id"]: s for s in current}
+                    news = {s["_id"]: s for s in merged}
+                    pairs[kind] += [(pid, olds.get(sid), news.get(sid)) for sid in olds.keys() | news.keys()]
+                    update["$set"][kind] = merged
+                    update["$set"][f"{kind[:-1]}_count"] = len(merged)
+                counts[f"{kind} changed"] += sum(1 for sid, h in new_hashes.items() if old_hashes.get(sid) != h)
+                counts[f"{kind} removed"] += len(set(old_hashes) - set(new_hashes))
+        counts["patients updated"] += 1
+        update["$set"]["search_terms"] = patient["search_terms"]
+        update["$set"]["last_updated"] = patient["last_updated"]
+        patient_ops.append(UpdateOne({"_id": pid}, {k: v for k, v in update.items() if v}))
+        import_ops.append(ReplaceOne({"_id": record["_id"]}, {**record, "patient_id": pid}))
+
+    if not patient_ops:
+        return
+    db["patients"].bulk_write(patient_ops, ordered=False)
+    db["synthea_import"].bulk_write(import_ops, ordered=False)
+    # patients deleted through the API while the batch was written get no rows or counters
+    landed = {d["_id"] for d in db["patients"].find({"_id": {"$in": list(before)}}, {"_id": 1})}
+
+    if STORAGE_MODE == "collections":
+        for kind in SUB_KINDS:
+            todo = [row for row in rows[kind] if row[0] in landed]
+            ids = [sid for _, sid, _ in todo]
+            olds = {s["_id"]: s for s in db[kind].find({"_id": {"$in": ids}}, {"patient_id": 0})} if ids else {}
+            ops = []
+            for pid, sid, sub in todo:
+                if sub is None:
+                    ops.append(DeleteOne({"_id": sid}))
+                else:
+                    sub = replaced(sub, olds.get(sid))
+                    ops.append(ReplaceOne({"_id": sid}, {**sub, "patient_id": pid}, upsert=True))
+                pairs[kind].append((pid, olds.get(sid), sub))
+            if ops:
+                db[kind].bulk_write(ops, ordered=False)
+    for kind in SUB_KINDS:
+        record_changes(kind, [(old, new, before[pid].get("gender")) for pid, old, new in pairs[kind] if pid in landed])
+    for pid, (old_doc, new_doc) in grid_moves.items():
+        if pid in landed:
+            geo_grid.replace(old_doc, new_doc)
+
+# helper: remove patients that are no longer in the export, with their sub-documents and counters
+def delete_missing(db, records):
+    if not records:
+        return
+    for r in records:
+        subresources.delete_patient(r["patient_id"])
+    db["synthea_import"].delete_many({"_id": {"$in": [r["_id"] for r in records]}})
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the Synthea CSV export into MongoDB")
+    parser.add_argument("--csv-dir", default=CSV_DIR)
+    parser.add_argument("--batch-size", type=int, default=1000, help="patients per bulk insert")
+    parser.add_argument("--chunk-rows", type=int, default=100000, help="rows per sorted run held in memory")
+    parser.add_argument("--workers", type=int, default=min(len(SOURCES), os.cpu_count() or 1),
+                        help="processes parsing the csv files concurrently, 1 parses inline")
+    parser.add_argument("--mode", choices=["full", "delta"], default="full",
+                        help="full drops and reloads; delta only writes patients and records that changed")
+    args = parser.parse_args()
+
+    timer = StageTimer()
+
+    # the application database (MONGO_URI, MONGO_DB), which the rollups and map grid are kept in
+    db = globals.db
+    patients_col = db["patients"]
+
+    known = {}
+    if args.mode == "full":
+        print(f"Dropping existing patients collection in {globals.db_name}...")
+        patients_col.drop()
+        db["synthea_import"].drop()
+        for kind in SUB_KINDS:
+            db[kind].drop()
+        # the stats read the live data until the rollups are rebuilt after the load
+        db["rollup_meta"].drop()
+    else:
+        # hashes from the previous import, the sub-record hashes are only read for changed patients
+        started = time.perf_counter()
+        known = {r["_id"]: r for r in db["synthea_import"].find({}, {"patient_id": 1, "hash": 1, "subs_hash": 1})}
+        timer.add("load import state", len(known), time.perf_counter() - started)
+
+    counts = {"patients inserted": 0, "patients updated": 0, "patients unchanged": 0, "patients deleted": 0,
+              "patients skipped": 0}
+    for kind in SUB_KINDS:
+        counts[f"{kind} changed"] = counts[f"{kind} removed"] = 0
+
+    with tempfile.TemporaryDirectory(prefix="synthea-seed-") as tmp_dir:
+        started = time.perf_counter()
+        providers = load_providers(args.csv_dir)
+        timer.add("providers", len(providers), time.perf_counter() - started)
+
+        # sort every per-patient file by patient into spill runs
+        started = time.perf_counter()
+        runs, total_rows = {}, 0
+        for name, (file_runs, rows, seconds) in sort_sources(args.csv_dir, providers, args.chunk_rows, tmp_dir, args.workers).items():
+            runs[name] = file_runs
+            total_rows += rows
+            timer.add(f"sort {SOURCES[name][0]}", rows, seconds)
+        timer.add(f"sort wall ({args.workers} workers)", total_rows, time.perf_counter() - started)
+
+        # merge-join the sorted streams; new patients are bulk inserted, changed ones updated
+        children = {name: grouped(r) for name, r in runs.items() if name != "patients"}
+        new, changed, seen, sample = [], [], set(), None
+        write_seconds = 0.0
+        started = time.perf_counter()
+
+        def flush(force=False):
+            nonlocal new, changed, write_seconds
+            write_started = time.perf_counter()
+            if new and (force or len(new) >= args.batch_size):
+                write_batch(db, new, track=args.mode == "delta")
+                counts["patients inserted"] += len(new)
+                new = []
+            if changed and (force or len(changed) >= args.batch_size):
+                update_batch(db, changed, counts)
+                changed = []
+            write_seconds += time.perf_counter() - write_started
+
+        for row, subs in join(grouped(runs["patients"]), children):
+            patient = build_patient(row, subs)
+            if not patient:
+                continue
+            record = import_record(row, patient)
+            sample = sample or patient
+            seen.add(record["_id"])
+            old = known.get(record["_id"])
+            if not old:
+                new.append((patient, record))
+            elif (old["hash"], old["subs_hash"]) == (record["hash"], record["subs_hash"]):
+                counts["patients unchanged"] += 1
+            else:
+                changed.append((patient, record))
+            flush()
+        flush(force=True)
+
+        # patients missing from this export
+        missing = [r for sid, r in known.items() if sid not in seen]
+        write_started = time.perf_counter()
+        for i in range(0, len(missing), args.batch_size):
+            delete_missing(db, missing[i:i + args.batch_size])
+        counts["patients deleted"] = len(missing)
+        write_seconds += time.perf_counter() - write_started
+
+        processed = len(seen)
+        timer.add("merge + build", processed, time.perf_counter() - started - write_seconds)
+        timer.add("bulk write", processed, write_seconds)
+
+    inserted = counts["patients inserted"]
+    if sample:
+        if STORAGE_MODE == "collections":
+            for kind in SUB_KINDS:
+                db[kind].create_index([("patient_id", 1), ("_id", 1)])
+        patients_col.create_index("search_terms")
+        db["search_meta"].update_one({"_id": "search"}, {"$set": {"built_at": datetime.utcnow()}}, upsert=True)
+        if args.mode == "full":
+            started = time.perf_counter()
+            rollups.rebuild()
+            cells = geo_grid.rebuild()
+            timer.add("rebuild rollups + grid", cells, time.perf_counter() - started)
+            print(f"Inserted {inserted} cleaned patients with location data into {globals.db_name}.patients")
+        else:
+            print(f"Delta import into {globals.db_name}.patients:")
+            for name, n in counts.items():
+                print(f"  {name:<22} {n:>10}")
+        print("\nSample patient preview:")
+        print(f"Name: {sample['name']}, Age: {sample['age']} ({sample['age_group']})")
+        print(f"Condition: {sample['condition']}, Town: {sample['town']}")
+        print(f"Coordinates: {sample['location']['coordinates']}")
+        print(f"Appointments: {len(sample['appointments'])}, "
+              f"Prescriptions: {len(sample['prescriptions'])}, "
+              f"Careplans: {len(sample['careplans'])}")
+    else:
+        print("No patients found — check CSV folder paths or data quality.")
+
+    print("\nStage timings:")
+    timer.report()
+    print(f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+from flask import has_request_context, request
+from pymongo import monitoring
+import json, os, queue, random, threading, time
+
+# slow query log: read commands slower than SLOW_QUERY_MS are grouped by shape
+# (the command with its literal values replaced by their types) and a sample of
+# them is re-run through explain("executionStats") on a background thread, to
+# record the plan stages, whether it was a COLLSCAN and keys/docs examined
+# versus returned. Kept per process; listed by total time at
+# GET /api/v1.0/stats/slow-queries.
+
+# read here rather than in globals.py, which registers the listener on the client
+slow_query_ms = float(os.environ.get('SLOW_QUERY_MS', 100))
+# share of repeat occurrences of a shape that are explained again (the first always is)
+explain_sample = float(os.environ.get('SLOW_QUERY_EXPLAIN_SAMPLE', 0.05))
+
+EXPLAINABLE = {"find", "aggregate", "count", "distinct"}
+# driver-added fields that explain does not accept
+SESSION_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"}
+MAX_SHAPES = 500
+
+shapes = {}
+lock = threading.Lock()
+pending = {}
+explain_queue = queue.Queue(maxsize=100)
+worker = {"thread": None}
+
+# helper: literal values replaced by their type, operators and field names kept
+def shape_of(value):
+    if isinstance(value, dict):
+        return {k: shape_of(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [shape_of(v) for v in value]
+        if items and all(i == items[0] for i in items):
+            return [items[0]]
+        return items
+    return f"<{type(value).__name__}>"
+
+# helper: the parts of a command that identify the query
+def command_shape(name, command):
+    shape = {"command": name, "collection": command.get(name)}
+    for field in ("filter", "query", "pipeline", "key"):
+        if field in command:
+            shape[field] = shape_of(command[field]) if field != "key" else command[field]
+    if "sort" in command:
+        shape["sort"] = dict(command["sort"])
+    return shape
+
+# helper: plan stages and examined/returned counts from an explain result
+def plan_summary(explain):
+    stages, stats = [], {}
+
+    def walk(node):
+        if isinstance(node, dict):
+            if isinstance(node.get("stage"), str):
+                stages.append(node["stage"])
+            if "totalDocsExamined" in node and not stats:
+                stats.update(node)
+            for v in node.values():
+                walk(v)
+        elif isinstance(node, list):
+            for v in node:
+                walk(v)
+
+    walk(explain)
+    return {
+        "stages": sorted(set(stages)),
+        "collscan": "COLLSCAN" in stages,
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "returned": stats.get("nReturned"),
+        "execution_ms": stats.get("executionTimeMillis"),
+        "explained_at": time.time()
+    }
+
+# records one slow command and queues a sampled explain
+def record(name, command, database, seconds):
+    shape = command_shape(name, command)
+    key = json.dumps(shape, sort_keys=True, default=str)
+    with lock:
+        entry = shapes.get(key)
+        if entry is None:
+            if len(shapes) >= MAX_SHAPES:
+                return
+            entry = shapes[key] = {"shape": shape, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                   "endpoints": [], "plan": None}
+        entry["count"] += 1
+        entry["total_ms"] += seconds * 1000
+        entry["max_ms"] = max(entry["max_ms"], seconds * 1000)
+        if has_request_context() and request.endpoint not in entry["endpoints"] and len(entry["endpoints"]) < 5:
+            entry["endpoints"].append(request.endpoint or "unmatched")
+        explain = entry["plan"] is None or random.random() < explain_sample
+    if explain and not ("pipeline" in command and any("$out" in s or "$merge" in s for s in command["pipeline"])):
+        cmd = {k: v for k, v in command.items() if not k.startswith("$") and k not in SESSION_FIELDS}
+        start_worker()
+        try:
+            explain_queue.put_nowait((key, database, cmd))
+        except queue.Full:
+            pass
+
+# background worker running the queued explains
+def explain_worker():
+    import globals
+    while True:
+        key, database, cmd = explain_queue.get()
+        try:
+            result = globals.client[database].command("explain", cmd, verbosity="executionStats")
+            summary = plan_summary(result)
+        except Exception as e:
+            summary = {"error": str(e), "explained_at": time.time()}
+        with lock:
+            if key in shapes:
+                shapes[key]["plan"] = summary
+
+# started on first use, so a forked worker process gets its own thread
+def start_worker():
+    with lock:
+        thread = worker["thread"]
+        if thread is None or not thread.is_alive():
+            thread = worker["thread"] = threading.Thread(target=explain_worker, name="slow-query-explain", daemon=True)
+            thread.start()
+
+class SlowQueryListener(monitoring.CommandListener):
+    def started(self, event):
+        if event.command_name in EXPLAINABLE:
+            pending[event.request_id] = (event.command, event.database_name)
+
+    def succeeded(self, event):
+        started = pending.pop(event.request_id, None)
+        if started and event.duration_micros >= slow_query_ms * 1000:
+            record(event.command_name, started[0], started[1], event.duration_micros / 1e6)
+
+    def failed(self, event):
+        pending.pop(event.request_id, None)
+
+listener = SlowQueryListener()
+
+# the slowest query shapes by total time
+def top(limit=20):
+    with lock:
+        entries = sorted(shapes.values(), key=lambda e: e["total_ms"], reverse=True)[:limit]
+        return [{**e, "total_ms": round(e["total_ms"], 2), "max_ms": round(e["max_ms"], 2),
+                 "avg_ms": round(e["total_ms"] / e["count"], 2)} for e in entries]
+
+def reset():
+    with lock:
+        shapes.clear()
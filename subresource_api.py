@@ -0,0 +1,172 @@
+from flask import request
+from bson import ObjectId
+import re
+import subresources
+from decorators import jwt_required, admin_required
+from utils import response, bulk_items, bulk_response, conditional
+
+# the routes shared by appointments, prescriptions and careplans: each blueprint
+# declares its fields in a SubResource and registers it. Every write is a single
+# conditional operation on the document holding the sub-document (see
+# subresources.py); the sub-document's version is sent as its ETag, and a PUT or
+# DELETE with If-Match only applies while that version is current (412 otherwise).
+
+# helper: validate objectid
+def is_valid_objectid(id):
+    return bool(re.fullmatch(r"[0-9a-fA-F]{24}", id))
+
+# helper: versions listed in If-Match, None when absent or "*"; raises ValueError if malformed
+def if_match_versions():
+    header = request.headers.get("If-Match", "").strip()
+    if not header or header == "*":
+        return None
+    versions = []
+    for tag in header.split(","):
+        tag = tag.strip()
+        tag = tag[2:] if tag.startswith("W/") else tag
+        if not re.fullmatch(r'"\d+"', tag):
+            raise ValueError("Invalid If-Match header")
+        versions.append(int(tag.strip('"')))
+    return versions
+
+# helper: response with the sub-document's version as its ETag, 304 for a GET
+# whose If-None-Match already names it
+def tagged(result, sub):
+    resp, status = result
+    resp.status_code = status
+    resp.set_etag(str(subresources.version_of(sub)))
+    return resp.make_conditional(request) if status == 200 else resp
+
+class SubResource:
+    # required: fields a new item must have; optional: other fields with their defaults
+    def __init__(self, kind, label, required, optional=None, id_key="id", admin_create=False):
+        self.kind = kind
+        self.label = label
+        self.name = label.lower()
+        self.required = required
+        self.optional = optional or {}
+        self.fields = tuple(required) + tuple(self.optional)
+        self.id_key = id_key
+        self.admin_create = admin_create
+
+    # sub-document from a request body, returns (sub-document, error)
+    def build(self, body):
+        missing = [k for k in self.required if k not in body]
+        if missing:
+            return None, f"Missing required fields: {', '.join(missing)}"
+        sub = {"_id": ObjectId()}
+        for k in self.required:
+            sub[k] = body[k]
+        for k, default in self.optional.items():
+            sub[k] = body.get(k, default)
+        sub["version"] = 1
+        return sub, None
+
+    def not_found(self):
+        return response(False, message=f"{self.label} not found for this patient", status=404)
+
+    def conflict(self, current):
+        return tagged(response(False, message=f"{self.label} was changed by another request",
+                               data={self.name: current}, status=412), current)
+
+    # get sub-documents of a patient
+    def list(self, pid):
+        if not is_valid_objectid(pid):
+            return response(False, message="Invalid patient ID", status=400)
+        items, last_updated = subresources.list_for(self.kind, ObjectId(pid))
+        if items is None:
+            return response(False, message="Patient not found", status=404)
+        resp, status = response(True, data={self.kind: items})
+        return conditional(resp, last_updated)
+
+    # post add sub-document
+    def create(self, pid):
+        if not is_valid_objectid(pid):
+            return response(False, message="Invalid patient ID", status=400)
+        body = request.get_json(silent=True) or request.form
+        sub, error = self.build(body)
+        if error:
+            return response(False, message=error, status=400)
+        if not subresources.add(self.kind, ObjectId(pid), sub):
+            return response(False, message="Patient not found", status=404)
+        return tagged(response(True, message=f"{self.label} added successfully",
+                               data={self.id_key: str(sub["_id"]), self.name: sub}, status=201), sub)
+
+    # post add sub-documents in bulk, each with its patient_id
+    def bulk_create(self):
+        try:
+            items = bulk_items(self.kind)
+        except ValueError as e:
+            return response(False, message=str(e), status=400)
+        return bulk_response(subresources.bulk_add(self.kind, items, self.build))
+
+    # get sub-document
+    def get(self, pid, sid):
+        if not (is_valid_objectid(pid) and is_valid_objectid(sid)):
+            return response(False, message="Invalid ID format", status=400)
+        sub = subresources.get(self.kind, ObjectId(pid), ObjectId(sid))
+        if not sub:
+            return self.not_found()
+        return tagged(response(True, data=sub, message=f"{self.label} retrieved successfully"), sub)
+
+    # put update sub-document
+    def update(self, pid, sid):
+        if not (is_valid_objectid(pid) and is_valid_objectid(sid)):
+            return response(False, message="Invalid ID format", status=400)
+        body = request.get_json(silent=True) or {}
+        fields = {k: v for k, v in body.items() if k in self.fields}
+        if not fields:
+            return response(False, message="No valid fields to update", status=400)
+        try:
+            versions = if_match_versions()
+        except ValueError as e:
+            return response(False, message=str(e), status=400)
+
+        outcome, sub = subresources.update(self.kind, ObjectId(pid), ObjectId(sid), fields, versions)
+        if outcome == "not_found":
+            return self.not_found()
+        if outcome == "conflict":
+            return self.conflict(sub)
+        if outcome == "unchanged":
+            return tagged(response(False, message=f"{self.label} not updated (no changes detected)",
+                                   data={self.name: sub}, status=400), sub)
+        return tagged(response(True, message=f"{self.label} updated successfully",
+                               data={"updated_fields": list(fields), self.name: sub}), sub)
+
+    # delete sub-document
+    def delete(self, pid, sid):
+        if not (is_valid_objectid(pid) and is_valid_objectid(sid)):
+            return response(False, message="Invalid ID format", status=400)
+        try:
+            versions = if_match_versions()
+        except ValueError as e:
+            return response(False, message=str(e), status=400)
+
+        outcome, sub = subresources.delete(self.kind, ObjectId(pid), ObjectId(sid), versions)
+        if outcome == "not_found":
+            return self.not_found()
+        if outcome == "conflict":
+            return self.conflict(sub)
+        return response(True, message=f"{self.label} deleted successfully")
+
+    # add the routes to a blueprint under /<pid>/<kind>, plus any older urls for create and the item routes
+    def register(self, bp, create_urls=(), item_urls=()):
+        create, bulk_create = self.create, self.bulk_create
+        if self.admin_create:
+            create, bulk_create = admin_required(create), admin_required(bulk_create)
+        views = {
+            "list": jwt_required(self.list),
+            "add": jwt_required(create),
+            "bulk_add": jwt_required(bulk_create),
+            "get": jwt_required(self.get),
+            "update": jwt_required(admin_required(self.update)),
+            "delete": jwt_required(admin_required(self.delete)),
+        }
+        base = f"/<string:pid>/{self.kind}"
+        bp.add_url_rule(base, f"list_{self.kind}", views["list"], methods=["GET"])
+        bp.add_url_rule(f"/bulk/{self.kind}", f"bulk_add_{self.kind}", views["bulk_add"], methods=["POST"])
+        for url in (base, *create_urls):
+            bp.add_url_rule(url, f"add_{self.name}", views["add"], methods=["POST"])
+        for url in (f"{base}/<string:sid>", *item_urls):
+            for method, action in (("GET", "get"), ("PUT", "update"), ("DELETE", "delete")):
+                bp.add_url_rule(url, f"{action}_{self.name}", views[action], methods=[method])
@@ -0,0 +1,287 @@
+from bson import ObjectId
+import datetime
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+import globals
+import geo_grid
+import indexes
+import rollups
+import search
+
+# appointments, prescriptions and careplans are stored either embedded in the
+# patient document (STORAGE_MODE=embedded) or in their own collections keyed
+# by patient_id (STORAGE_MODE=collections); the blueprints go through here.
+# Each sub-document carries a version (missing = 0 for older data), bumped by
+# every update, that callers can make writes conditional on.
+KINDS = ("appointments", "prescriptions", "careplans")
+
+patients = globals.db["patients"]
+
+def split_mode():
+    return globals.storage_mode == "collections"
+
+def counter(kind):
+    return f"{kind[:-1]}_count"
+
+# helper: update pipeline moving a patient's counter by delta and stamping it; the count
+# starts from the array's size on documents written before the counters existed
+def counted(kind, delta):
+    start = {"$ifNull": [f"${counter(kind)}", {"$size": {"$ifNull": [f"${kind}", []]}}]}
+    return [{"$set": {counter(kind): {"$add": [start, delta]}, **stamp()}}]
+
+# helper: expression for the array with subs appended, taken literally so strings
+# in the sub-documents are never read as field paths
+def appended(kind, subs):
+    return {"$concatArrays": [{"$ifNull": [f"${kind}", []]}, {"$literal": subs}]}
+
+# helper: the last_updated stamp every write to a patient or its sub-documents sets,
+# the source of the patient's ETag and Last-Modified
+def stamp():
+    return {"last_updated": datetime.datetime.utcnow().isoformat()}
+
+# helper: indexes for the separate collections, also before STORAGE_MODE is switched
+def ensure_indexes():
+    indexes.apply(KINDS, split=True)
+
+# get all sub-documents of a patient with the patient's last_updated, (None, None) if it does not exist
+def list_for(kind, pid):
+    if split_mode():
+        doc = patients.find_one({"_id": pid}, {"last_updated": 1})
+        if not doc:
+            return None, None
+        return list(globals.db[kind].find({"patient_id": pid}, {"patient_id": 0}).sort("_id", 1)), doc.get("last_updated")
+    doc = patients.find_one({"_id": pid}, {kind: 1, "last_updated": 1, "_id": 0})
+    return (None, None) if doc is None else (doc.get(kind, []), doc.get("last_updated"))
+
+# get one sub-document, None if it does not belong to the patient
+def get(kind, pid, sid):
+    if split_mode():
+        return globals.db[kind].find_one({"_id": sid, "patient_id": pid}, {"patient_id": 0})
+    doc = patients.find_one({"_id": pid, f"{kind}._id": sid}, {kind: {"$elemMatch": {"_id": sid}}, "_id": 0})
+    return doc[kind][0] if doc else None
+
+def version_of(sub):
+    return sub.get("version", 0)
+
+# helper: condition on a sub-document's version being one of versions
+def version_match(versions):
+    return {"version": {"$in": list(versions) + ([None] if 0 in versions else [])}}
+
+# add a sub-document, False if the patient does not exist
+def add(kind, pid, sub):
+    update = counted(kind, 1)
+    if not split_mode():
+        update[0]["$set"][kind] = appended(kind, [sub])
+    patient = patients.find_one_and_update({"_id": pid}, update, projection={"gender": 1})
+    if not patient:
+        return False
+    if split_mode():
+        globals.db[kind].insert_one({**sub, "patient_id": pid})
+    rollups.record(kind, [sub], patient.get("gender"), 1)
+    reindex_search(kind, pid)
+    return True
+
+# add many (pid, sub) pairs with unordered bulk writes, one update per patient
+# in embedded mode; returns an error message or None for each pair
+def add_many(kind, items):
+    pids = list({pid for pid, _ in items})
+    genders = {p["_id"]: p.get("gender") for p in patients.find({"_id": {"$in": pids}}, {"gender": 1})}
+    errors = [None if pid in genders else "Patient not found" for pid, _ in items]
+    ok = [i for i, error in enumerate(errors) if error is None]
+    if split_mode() and ok:
+        try:
+            globals.db[kind].bulk_write([InsertOne({**items[i][1], "patient_id": items[i][0]}) for i in ok], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details["writeErrors"]:
+                errors[ok[error["index"]]] = error["errmsg"]
+        ok = [i for i in ok if errors[i] is None]
+
+    by_patient = {}
+    for i in ok:
+        by_patient.setdefault(items[i][0], []).append(items[i][1])
+    if not by_patient:
+        return errors
+    ops = []
+    for pid, subs in by_patient.items():
+        update = counted(kind, len(subs))
+        if not split_mode():
+            update[0]["$set"][kind] = appended(kind, subs)
+        ops.append(UpdateOne({"_id": pid}, update))
+    if patients.bulk_write(ops, ordered=False).matched_count < len(ops):
+        # patients deleted since they were looked up
+        remaining = {p["_id"] for p in patients.find({"_id": {"$in": list(by_patient)}}, {"_id": 1})}
+        for i in ok:
+            if items[i][0] not in remaining:
+                errors[i] = "Patient not found"
+        for pid in set(by_patient) - remaining:
+            del by_patient[pid]
+
+    by_gender = {}
+    for pid, subs in by_patient.items():
+        by_gender.setdefault(genders[pid], []).extend(subs)
+    for gender, subs in by_gender.items():
+        rollups.record(kind, subs, gender, 1)
+    for pid in by_patient:
+        reindex_search(kind, pid)
+    return errors
+
+# validate and add a batch of request bodies, each naming its patient_id;
+# build(body) returns (sub-document, error). Returns the per-item results
+def bulk_add(kind, bodies, build):
+    results, items = [], []
+    for i, body in enumerate(bodies):
+        if not isinstance(body, dict):
+            results.append({"index": i, "success": False, "message": "Expected an object"})
+            continue
+        pid = body.get("patient_id")
+        sub, error = build(body)
+        if not error and not (isinstance(pid, str) and len(pid) == 24 and ObjectId.is_valid(pid)):
+            error = "Invalid patient ID"
+        if error:
+            results.append({"index": i, "success": False, "message": error})
+            continue
+        results.append({"index": i, "success": True, "id": str(sub["_id"])})
+        items.append((i, ObjectId(pid), sub))
+    errors = add_many(kind, [(pid, sub) for _, pid, sub in items]) if items else []
+    for (i, _, _), error in zip(items, errors):
+        if error:
+            results[i] = {"index": i, "success": False, "message": error}
+    return results
+
+# update fields of a sub-document in one conditional write, optionally only while
+# its version is one of versions. Returns (outcome, sub-document): "updated" with
+# the new sub-document, or "not_found", "conflict" or "unchanged" with the current one
+def update(kind, pid, sid, fields, versions=None):
+    match = {"_id": sid, "$or": [{k: {"$ne": v}} for k, v in fields.items()]}
+    if versions is not None:
+        match.update(version_match(versions))
+    gender = None
+    if split_mode():
+        old = globals.db[kind].find_one_and_update(
+            {**match, "patient_id": pid}, {"$set": fields, "$inc": {"version": 1}}, projection={"patient_id": 0}
+        )
+    else:
+        before = patients.find_one_and_update(
+            {"_id": pid, kind: {"$elemMatch": match}},
+            {"$set": {**{f"{kind}.$.{k}": v for k, v in fields.items()}, **stamp()}, "$inc": {f"{kind}.$.version": 1}},
+            projection={kind: {"$elemMatch": {"_id": sid}}, "gender": 1}
+        )
+        old = before[kind][0] if before else None
+        gender = before.get("gender") if before else None
+    if not old:
+        current = get(kind, pid, sid)
+        if not current:
+            return "not_found", None
+        if versions is not None and version_of(current) not in versions:
+            return "conflict", current
+        return "unchanged", current
+    new = {**old, **fields, "version": version_of(old) + 1}
+    if split_mode():
+        patients.update_one({"_id": pid}, {"$set": stamp()})
+    # the patient's gender is only read when the rollup counters have to move
+    if split_mode() and rollups.key(kind, old, None) != rollups.key(kind, new, None):
+        gender = patient_gender(pid)
+    rollups.replace(kind, old, new, gender)
+    reindex_search(kind, pid)
+    return "updated", new
+
+# delete a sub-document in one conditional write, optionally only while its
+# version is one of versions. Returns (outcome, sub-document) as update() does
+def delete(kind, pid, sid, versions=None):
+    match = {"_id": sid, **(version_match(versions) if versions is not None else {})}
+    if split_mode():
+        old = globals.db[kind].find_one_and_delete({**match, "patient_id": pid})
+        patient = patients.find_one_and_update(
+            {"_id": pid}, counted(kind, -1), projection={"gender": 1}
+        ) if old else None
+    else:
+        update = counted(kind, -1)
+        update[0]["$set"][kind] = {"$filter": {"input": f"${kind}", "cond": {"$ne": ["$$this._id", sid]}}}
+        patient = patients.find_one_and_update(
+            {"_id": pid, kind: {"$elemMatch": match}},
+            update,
+            projection={kind: {"$elemMatch": {"_id": sid}}, "gender": 1}
+        )
+        old = patient[kind][0] if patient else None
+    if not old:
+        current = get(kind, pid, sid)
+        return ("conflict", current) if current else ("not_found", None)
+    rollups.record(kind, [old], (patient or {}).get("gender"), -1)
+    reindex_search(kind, pid)
+    return "deleted", old
+
+# helper: medication and careplan names are searchable when SEARCH_INCLUDE_SUBRESOURCES is set
+def reindex_search(kind, pid):
+    if globals.search_include_subresources and kind != "appointments":
+        search.reindex(pid)
+
+# helper: gender of a patient, used to key the rollup counters
+def patient_gender(pid):
+    return (patients.find_one({"_id": pid}, {"gender": 1}) or {}).get("gender")
+
+# all sub-documents of a patient document, by kind
+def subs_of(doc):
+    if not split_mode():
+        return {kind: doc.get(kind, []) for kind in KINDS}
+    return {kind: list(globals.db[kind].find({"patient_id": doc["_id"]})) for kind in KINDS}
+
+# delete a patient with its sub-documents, False if it did not exist
+def delete_patient(pid):
+    doc = patients.find_one_and_delete(
+        {"_id": pid}, projection={"gender": 1, **{f: 1 for f in geo_grid.FIELDS}, **{kind: 1 for kind in KINDS}}
+    )
+    if not doc:
+        return False
+    geo_grid.record([doc], -1)
+    for kind, subs in subs_of(doc).items():
+        rollups.record(kind, subs, doc.get("gender"), -1)
+    if split_mode():
+        for kind in KINDS:
+            globals.db[kind].delete_many({"patient_id": pid})
+    return True
+
+# set patient fields, moving the rollup and map grid counters when the gender,
+# location, condition or age group change; False if not found
+def update_patient(pid, fields):
+    grid_fields = set(geo_grid.FIELDS) & set(fields)
+    if "gender" not in fields and not grid_fields:
+        return patients.update_one({"_id": pid}, {"$set": {**fields, **stamp()}}).matched_count > 0
+    projection = {f: 1 for f in geo_grid.FIELDS} if grid_fields else {}
+    if "gender" in fields:
+        projection.update({"gender": 1, **({} if split_mode() else {kind: 1 for kind in KINDS})})
+    before = patients.find_one_and_update({"_id": pid}, {"$set": {**fields, **stamp()}}, projection=projection)
+    if not before:
+        return False
+    if "gender" in fields and before.get("gender") != fields["gender"]:
+        rollups.regender(subs_of(before), before.get("gender"), fields["gender"])
+    if grid_fields:
+        geo_grid.replace(before, {**before, **fields})
+    return True
+
+# fill in the embedded arrays on patient documents read in split mode, so
+# responses keep the same shape in both storage modes
+def attach(docs, fields=None):
+    if not split_mode() or not docs:
+        return docs
+    by_id = {d["_id"]: d for d in docs}
+    for kind in KINDS:
+        if fields and kind not in fields:
+            continue
+        for d in docs:
+            d[kind] = []
+        for sub in globals.db[kind].find({"patient_id": {"$in": list(by_id)}}).sort("_id", 1):
+            by_id[sub.pop("patient_id")][kind].append(sub)
+    return docs
+
+# helper: source collection and stages yielding one {"<kind>": sub-document, "gender": ...}
+# row per sub-document, so aggregations read the same in both storage modes
+def unwound(kind, need_gender=False):
+    if not split_mode():
+        return patients, [{"$unwind": f"${kind}"}]
+    stages = [{"$project": {kind: "$$ROOT", "_id": 0}}]
+    if need_gender:
+        stages += [
+            {"$lookup": {"from": "patients", "localField": f"{kind}.patient_id", "foreignField": "_id", "as": "patient"}},
+            {"$set": {"gender": {"$ifNull": [{"$arrayElemAt": ["$patient.gender", 0]}, None]}}},
+        ]
+    return globals.db[kind], stages
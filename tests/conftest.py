@@ -0,0 +1,80 @@
+import os, sys
+import mongomock, pymongo
+import pytest
+
+# the suite runs against mongomock (pip install pytest mongomock), so the
+# client has to be swapped before globals.py opens it at import time
+pymongo.MongoClient = mongomock.MongoClient
+os.environ.setdefault("MONGO_DB", "testDB")
+os.environ.setdefault("SECRET_KEY", "test-secret-key-of-at-least-32-bytes")
+os.environ.setdefault("RATELIMIT_LOGIN", "1000/minute")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import globals
+import app as app_module
+import cache
+import decorators
+import ratelimits
+import rollups
+import search
+from blueprints.auth import auth
+
+KEPT = {"users", "system.indexes"}
+
+@pytest.fixture(scope="session")
+def app():
+    app_module.init_db()
+    return app_module.app
+
+# every test starts from empty data collections and fresh in-process state
+@pytest.fixture(autouse=True)
+def clean(app):
+    for name in globals.db.list_collection_names():
+        if name not in KEPT:
+            globals.db.drop_collection(name)
+    decorators.revoked.tokens.clear()
+    decorators.revoked.since = None
+    decorators.revoked.last_sync = 0.0
+    cache.analytics_cache.backend.clear()
+    cache.analytics_cache.hits = cache.analytics_cache.misses = cache.analytics_cache.invalidations = 0
+    rollups._ready.update(value=False, checked=0.0)
+    search._ready.update(value=False, checked=0.0)
+    ratelimits.limiter.reset()
+    yield
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+# admin access token, issued directly to skip the bcrypt check of a login
+@pytest.fixture
+def token():
+    return auth.token_pair("admin", True)["token"]
+
+@pytest.fixture
+def headers(token):
+    return {"x-access-token": token}
+
+@pytest.fixture(params=["embedded", "collections"])
+def storage_mode(request, monkeypatch):
+    monkeypatch.setattr(globals, "storage_mode", request.param)
+    return request.param
+
+# mongomock has no $substrCP or $type; the rebuilt rollups are keyed with equivalents
+@pytest.fixture
+def mongomock_rollups(monkeypatch):
+    original = rollups.group_key
+
+    def group_key(kind):
+        key = original(kind)
+        field = "date" if kind == "appointments" else "start"
+        if "year" in key:
+            key["year"] = {"$substr": [{"$ifNull": [f"${kind}.{field}", ""]}, 0, 4]}
+        if "active" in key:
+            key["active"] = {"$or": [
+                {"$eq": ["$careplans.stop", "Unknown"]},
+                {"$eq": [{"$ifNull": ["$careplans.stop", "missing"]}, "missing"]},
+            ]}
+        return key
+
+    monkeypatch.setattr(rollups, "group_key", group_key)
@@ -0,0 +1,56 @@
+import csv, sys
+import seed_synthea_data
+
+API = "/api/v1.0"
+
+# helper: create a patient through the API, returns its id
+def add_patient(client, headers, **fields):
+    body = {"name": "Test Patient", "age": 40, "gender": "Female", "condition": "Asthma", **fields}
+    resp = client.post(f"{API}/patients/", json=body, headers=headers)
+    assert resp.status_code == 201, resp.get_json()
+    return resp.get_json()["data"]["id"]
+
+# helper: add a sub-resource through the API, returns the created sub-document
+def add_sub(client, headers, pid, kind, body):
+    resp = client.post(f"{API}/patients/{pid}/{kind}", json=body, headers=headers)
+    assert resp.status_code == 201, resp.get_json()
+    return resp.get_json()["data"][kind[:-1]]
+
+APPOINTMENT = {"doctor": "Dr Smith", "date": "2024-03-01", "notes": "check-up", "status": "scheduled"}
+PRESCRIPTION = {"name": "Amoxicillin", "start": "2024-02-01", "status": "active"}
+CAREPLAN = {"description": "Asthma self management", "start": "2024-01-01"}
+
+# columns of the Synthea csv files the seeder reads
+COLUMNS = {
+    "patients": ["Id", "BIRTHDATE", "FIRST", "LAST", "GENDER"],
+    "encounters": ["Id", "START", "PATIENT", "PROVIDER", "REASONDESCRIPTION"],
+    "medications": ["START", "STOP", "PATIENT", "ENCOUNTER", "CODE", "DESCRIPTION"],
+    "careplans": ["Id", "START", "STOP", "PATIENT", "CODE", "DESCRIPTION"],
+    "conditions": ["START", "PATIENT", "DESCRIPTION"],
+}
+
+# helper: rows of a tiny Synthea export by csv name, count patients with a visit, two drugs and a careplan each
+def export(count=3):
+    patients = [{"Id": f"p{i}", "BIRTHDATE": "1970-01-01", "FIRST": f"First{i}", "LAST": f"Last{i}"} for i in range(count)]
+    return {
+        "patients": patients,
+        "encounters": [{"Id": f"e{p['Id']}", "START": "2023-05-01", "PATIENT": p["Id"]} for p in patients],
+        "medications": [{"START": "2023-05-01", "STOP": "", "PATIENT": p["Id"], "ENCOUNTER": f"e{p['Id']}",
+                         "CODE": code, "DESCRIPTION": f"Drug {code}"} for p in patients for code in ("1", "2")],
+        "careplans": [{"Id": f"c{p['Id']}", "START": "2023-05-01", "STOP": "", "PATIENT": p["Id"], "CODE": "9",
+                       "DESCRIPTION": "Diabetes plan"} for p in patients],
+        "conditions": [{"START": "2020-01-01", "PATIENT": p["Id"], "DESCRIPTION": "Diabetes (disorder)"} for p in patients],
+    }
+
+# helper: write the export rows as csv files into csv_dir
+def write(csv_dir, rows):
+    for name, items in rows.items():
+        with open(csv_dir / f"{name}.csv", "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS[name])
+            writer.writeheader()
+            writer.writerows(items)
+
+# helper: run seed_synthea_data.py on csv_dir, extra command line options appended
+def seed(monkeypatch, csv_dir, mode, *options):
+    monkeypatch.setattr(sys, "argv", ["seed", "--csv-dir", str(csv_dir), "--workers", "1", "--mode", mode, *options])
+    seed_synthea_data.main()
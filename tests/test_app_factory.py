@@ -0,0 +1,28 @@
+import app as app_module
+import globals
+
+def test_factory_builds_independent_apps():
+    first, second = app_module.create_app(), app_module.create_app()
+    assert first is not second
+    assert set(first.blueprints) == set(second.blueprints) >= {"auth_bp", "patients_bp", "analytics_bp"}
+    assert first.test_client().get("/health").status_code == 200
+
+def test_init_command_creates_indexes_and_admin(app):
+    globals.db["patients"].drop_indexes()
+    globals.db["users"].delete_many({})
+    result = app.test_cli_runner().invoke(args=["init"])
+    assert result.exit_code == 0, result.output
+    assert "patients.search_terms_1" in result.output
+    assert globals.db["users"].find_one({"username": "admin"}) is not None
+    assert "search_terms_1" in globals.db["patients"].index_information()
+
+def test_init_is_idempotent(app):
+    app.test_cli_runner().invoke(args=["init"])
+    result = app.test_cli_runner().invoke(args=["init"])
+    assert result.exit_code == 0
+    assert "Created 0 indexes" in result.output
+    assert globals.db["users"].count_documents({"username": "admin"}) == 1
+
+def test_ready_reports_the_pool(client):
+    body = client.get("/ready").get_json()
+    assert body["data"]["pool"] == {"max_size": globals.mongo_max_pool_size, "min_size": globals.mongo_min_pool_size}
@@ -0,0 +1,46 @@
+import asyncio, json
+import asgi
+from tests.helpers import API
+
+# helper: one request through the ASGI app, body sent in the given chunks
+def call(method, path, chunks=(b"",), headers=(), query=b""):
+    messages = [{"type": "http.request", "body": c, "more_body": i < len(chunks) - 1} for i, c in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "query_string": query,
+             "headers": [(k.encode(), v.encode()) for k, v in headers]}
+    asyncio.run(asgi.app(scope, receive, send))
+    start, body = sent
+    return start["status"], dict(start["headers"]), body["body"]
+
+def test_health_is_served(app):
+    status, headers, body = call("GET", "/health")
+    assert status == 200
+    assert headers[b"content-type"] == b"application/json"
+    assert json.loads(body)["success"] is True
+
+def test_chunked_bodies_reach_the_app(app, token):
+    payload = json.dumps({"name": "Chunked Body", "age": 40, "gender": "female", "condition": "Asthma"}).encode()
+    status, _, body = call("POST", f"{API}/patients/", chunks=(payload[:10], payload[10:]),
+                           headers=[("content-type", "application/json"), ("x-access-token", token)])
+    assert status == 201, body
+
+def test_query_strings_are_passed_through(app, token):
+    status, _, body = call("GET", f"{API}/patients/", query=b"fields=name&limit=abc",
+                           headers=[("x-access-token", token)])
+    assert status == 400, body
+
+def test_analytics_routes_get_their_own_pool():
+    assert asgi.pool_for(f"{API}/stats/overview") is asgi.pools["analytics"]
+    assert asgi.pool_for(f"{API}/geo/tiles/8/1/1") is asgi.pools["analytics"]
+    assert asgi.pool_for(f"{API}/patients/") is asgi.pools["default"]
+
+def test_repeated_headers_are_joined():
+    scope = {"method": "GET", "path": "/", "headers": [(b"accept", b"a"), (b"accept", b"b")]}
+    assert asgi.build_environ(scope, b"")["HTTP_ACCEPT"] == "a,b"
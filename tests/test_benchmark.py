@@ -0,0 +1,45 @@
+import pytest
+from bson import ObjectId
+import benchmark
+
+# helper: one summarised result row
+def row(route, p95, concurrency=1):
+    return {"route": route, "concurrency": concurrency, "p95_ms": p95}
+
+def test_summarise_reports_percentiles_and_throughput():
+    summary = benchmark.summarise("r", 4, [i / 1000 for i in range(1, 101)], 2, 2.0)
+    assert summary["requests"] == 100 and summary["errors"] == 2
+    assert summary["p50_ms"] == 50.5 and summary["p95_ms"] == 95.05 and summary["max_ms"] == 100
+    assert summary["throughput_rps"] == 50
+
+def test_summarise_without_samples():
+    summary = benchmark.summarise("r", 1, [], 0, 0)
+    assert summary["p95_ms"] is None and summary["throughput_rps"] is None
+
+def test_regressions_flag_slower_routes_only():
+    baseline = {"results": [row("a", 10), row("b", 10), row("c", 10), row("a", 10, concurrency=8)]}
+    flagged = benchmark.regressions([row("a", 13), row("b", 10.5), row("d", 99), row("a", 9, concurrency=8)], baseline, 0.1)
+    assert flagged == [{"route": "a", "concurrency": 1, "p95_ms_before": 10, "p95_ms_after": 13, "change": 0.3}]
+
+# every scenario is run once against a stand-in for the server, recording the endpoint it reaches
+def test_scenarios_cover_every_route(app, monkeypatch):
+    adapter = app.url_map.bind("localhost")
+    reached = set()
+
+    def call(base, method, path, token=None, body=None, headers=None):
+        endpoint, _ = adapter.match(path.split("?")[0], method=method)
+        reached.add(endpoint)
+        ids = {"id": str(ObjectId()), "appointment_id": str(ObjectId()), "token": "t", "refresh_token": "r"}
+        return 201 if method == "POST" else 200, {"data": ids}, 0.001
+
+    monkeypatch.setattr(benchmark, "call", call)
+    pid, sid = str(ObjectId()), str(ObjectId())
+    ctx = benchmark.Context("", "t", [pid], {kind: [(pid, sid)] for kind in ("appointments", "prescriptions", "careplans")})
+    ctx.refresh_tokens.append("r")
+    names = [name for name, _ in benchmark.SCENARIOS]
+    assert len(names) == len(set(names))
+    for _, scenario in benchmark.SCENARIOS:
+        scenario(ctx)
+    routes = {rule.endpoint for rule in app.url_map.iter_rules()
+              if not rule.endpoint.startswith("flasgger") and rule.endpoint not in ("static", "index")}
+    assert routes - reached == set()
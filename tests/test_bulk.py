@@ -0,0 +1,39 @@
+import globals
+from bson import ObjectId
+from tests.helpers import API, APPOINTMENT, add_patient
+
+PATIENT = {"name": "Bulk Patient", "age": 30, "gender": "Male", "condition": "Asthma"}
+
+def test_bulk_patients_all_created(client, headers):
+    resp = client.post(f"{API}/patients/bulk", json={"patients": [PATIENT, PATIENT]}, headers=headers)
+    assert resp.status_code == 201
+    assert resp.get_json()["data"]["created"] == 2
+    assert globals.db["patients"].count_documents({}) == 2
+
+def test_bulk_patients_partial_success_is_207(client, headers):
+    resp = client.post(f"{API}/patients/bulk", json=[PATIENT, {**PATIENT, "age": 500}, "nope"], headers=headers)
+    assert resp.status_code == 207
+    data = resp.get_json()["data"]
+    assert (data["created"], data["failed"]) == (1, 2)
+    assert [r["success"] for r in data["results"]] == [True, False, False]
+    assert globals.db["patients"].count_documents({}) == 1
+
+def test_bulk_patients_all_failed_is_400(client, headers):
+    resp = client.post(f"{API}/patients/bulk", json={"patients": [{"name": "x"}]}, headers=headers)
+    assert resp.status_code == 400
+
+def test_bulk_rejects_an_empty_or_oversized_batch(client, headers, monkeypatch):
+    assert client.post(f"{API}/patients/bulk", json={"patients": []}, headers=headers).status_code == 400
+    monkeypatch.setattr(globals, "bulk_max_items", 1)
+    assert client.post(f"{API}/patients/bulk", json=[PATIENT, PATIENT], headers=headers).status_code == 400
+
+def test_bulk_sub_resources_report_unknown_patients(client, headers, storage_mode):
+    pid = add_patient(client, headers)
+    items = [{"patient_id": pid, **APPOINTMENT}, {"patient_id": str(ObjectId()), **APPOINTMENT},
+             {"patient_id": "bad", **APPOINTMENT}, {"patient_id": pid}]
+    resp = client.post(f"{API}/patients/bulk/appointments", json={"appointments": items}, headers=headers)
+    assert resp.status_code == 207
+    assert [r["success"] for r in resp.get_json()["data"]["results"]] == [True, False, False, False]
+    patient = client.get(f"{API}/patients/{pid}", headers=headers).get_json()["data"]
+    assert len(patient["appointments"]) == 1 and patient["appointment_count"] == 1
+    assert globals.db["appointments"].count_documents({}) == (1 if storage_mode == "collections" else 0)
@@ -0,0 +1,32 @@
+import threading
+from cache import analytics_cache
+from tests.helpers import API, APPOINTMENT, add_patient, add_sub
+
+def test_repeat_request_is_a_hit_until_a_write(client, headers):
+    pid = add_patient(client, headers)
+    add_sub(client, headers, pid, "appointments", APPOINTMENT)
+    first = client.get(f"{API}/stats/appointments", headers=headers).get_json()
+    assert client.get(f"{API}/stats/appointments", headers=headers).get_json() == first
+    assert (analytics_cache.hits, analytics_cache.misses) == (1, 1)
+
+    invalidations = analytics_cache.invalidations
+    add_sub(client, headers, pid, "appointments", {**APPOINTMENT, "doctor": "Dr New"})
+    after = client.get(f"{API}/stats/appointments", headers=headers).get_json()
+    assert analytics_cache.invalidations == invalidations + 1
+    assert {r["doctor"] for r in after["results"]} == {"Dr Smith", "Dr New"}
+
+def test_query_args_are_normalised_into_the_key(client, headers):
+    client.get(f"{API}/stats/appointments?gender=Female&limit=05", headers=headers)
+    client.get(f"{API}/stats/appointments?gender=female&limit=5", headers=headers)
+    assert analytics_cache.hits == 1
+
+def test_counters_are_not_lost_across_threads():
+    def count():
+        for _ in range(2000):
+            analytics_cache.count("hits")
+    threads = [threading.Thread(target=count) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert analytics_cache.stats()["hits"] == 16000
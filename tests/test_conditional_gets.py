@@ -0,0 +1,31 @@
+import gzip, json
+from tests.helpers import API, APPOINTMENT, add_patient, add_sub
+
+def test_unchanged_patient_is_answered_with_304(client, headers, storage_mode):
+    pid = add_patient(client, headers)
+    url = f"{API}/patients/{pid}"
+    first = client.get(url, headers=headers)
+    etag = first.headers["ETag"]
+    assert client.get(url, headers={**headers, "If-None-Match": etag}).status_code == 304
+    # a sub-resource write stamps the patient, so the old ETag no longer matches
+    add_sub(client, headers, pid, "appointments", APPOINTMENT)
+    changed = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+
+def test_etag_depends_on_the_requested_fields(client, headers):
+    pid = add_patient(client, headers)
+    full = client.get(f"{API}/patients/{pid}", headers=headers).headers["ETag"]
+    narrowed = client.get(f"{API}/patients/{pid}?fields=name", headers=headers).headers["ETag"]
+    assert full != narrowed
+
+def test_large_bodies_are_compressed(client, headers):
+    pid = add_patient(client, headers)
+    for _ in range(20):
+        add_sub(client, headers, pid, "appointments", APPOINTMENT)
+    url = f"{API}/patients/{pid}/appointments"
+    plain = client.get(url, headers=headers)
+    packed = client.get(url, headers={**headers, "Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in plain.headers
+    assert packed.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(packed.get_data())) == plain.get_json()
+    assert packed.headers["ETag"].startswith("W/")
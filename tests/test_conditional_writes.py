@@ -0,0 +1,40 @@
+import pytest
+from tests.helpers import API, CAREPLAN, add_patient, add_sub
+
+# mongomock returns the after-image from find_one_and_update with a projection, which
+# the embedded update path reads as the previous version; only the split layout is exercised
+collections_only = pytest.mark.parametrize("storage_mode", ["collections"], indirect=True)
+
+@collections_only
+def test_if_match_guards_updates_and_deletes(client, headers, storage_mode):
+    pid = add_patient(client, headers)
+    sub = add_sub(client, headers, pid, "careplans", CAREPLAN)
+    url = f"{API}/patients/{pid}/careplans/{sub['_id']}"
+    assert client.get(url, headers=headers).headers["ETag"] == '"1"'
+
+    updated = client.put(url, json={"stop": "2024-05-01"}, headers={**headers, "If-Match": '"1"'})
+    assert updated.status_code == 200 and updated.headers["ETag"] == '"2"'
+
+    # a writer still holding version 1 is refused and sent the current copy
+    stale = client.put(url, json={"stop": "2024-06-01"}, headers={**headers, "If-Match": '"1"'})
+    assert stale.status_code == 412
+    assert stale.get_json()["data"]["careplan"]["stop"] == "2024-05-01"
+    assert client.delete(url, headers={**headers, "If-Match": '"1"'}).status_code == 412
+
+    assert client.delete(url, headers={**headers, "If-Match": '"2"'}).status_code == 200
+    assert client.get(url, headers=headers).status_code == 404
+
+@collections_only
+def test_get_revalidates_against_the_version(client, headers, storage_mode):
+    pid = add_patient(client, headers)
+    sub = add_sub(client, headers, pid, "careplans", CAREPLAN)
+    url = f"{API}/patients/{pid}/careplans/{sub['_id']}"
+    assert client.get(url, headers={**headers, "If-None-Match": '"1"'}).status_code == 304
+    client.put(url, json={"stop": "2024-05-01"}, headers=headers)
+    assert client.get(url, headers={**headers, "If-None-Match": '"1"'}).status_code == 200
+
+def test_malformed_if_match_is_rejected(client, headers):
+    pid = add_patient(client, headers)
+    sub = add_sub(client, headers, pid, "careplans", CAREPLAN)
+    url = f"{API}/patients/{pid}/careplans/{sub['_id']}"
+    assert client.put(url, json={"stop": "x"}, headers={**headers, "If-Match": "v1"}).status_code == 400
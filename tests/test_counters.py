@@ -0,0 +1,32 @@
+import globals
+from bson import ObjectId
+from tests.helpers import API, APPOINTMENT, CAREPLAN, add_patient, add_sub
+
+def counters(pid):
+    doc = globals.db["patients"].find_one({"_id": ObjectId(pid)})
+    return doc["appointment_count"], doc["prescription_count"], doc["careplan_count"]
+
+def test_counters_follow_adds_bulk_adds_and_deletes(client, headers, storage_mode):
+    pid = add_patient(client, headers)
+    first = add_sub(client, headers, pid, "appointments", APPOINTMENT)
+    add_sub(client, headers, pid, "careplans", CAREPLAN)
+    bulk = {"appointments": [{"patient_id": pid, **APPOINTMENT}, {"patient_id": pid, **APPOINTMENT}]}
+    assert client.post(f"{API}/patients/bulk/appointments", json=bulk, headers=headers).status_code == 201
+    assert counters(pid) == (3, 0, 1)
+    assert client.delete(f"{API}/patients/{pid}/appointments/{first['_id']}", headers=headers).status_code == 200
+    assert counters(pid) == (2, 0, 1)
+
+def test_a_missing_counter_starts_from_the_stored_array(client, headers):
+    pid = add_patient(client, headers)
+    add_sub(client, headers, pid, "appointments", APPOINTMENT)
+    globals.db["patients"].update_one({"_id": ObjectId(pid)}, {"$unset": {"appointment_count": ""}})
+    add_sub(client, headers, pid, "appointments", APPOINTMENT)
+    assert counters(pid)[0] == 2
+
+def test_detail_fields_are_limited_to_public_ones(client, headers):
+    pid = add_patient(client, headers)
+    narrowed = client.get(f"{API}/patients/{pid}?fields=name,appointment_count", headers=headers)
+    assert narrowed.status_code == 200
+    assert set(narrowed.get_json()["data"]) == {"_id", "name", "appointment_count"}
+    assert client.get(f"{API}/patients/{pid}?fields=search_terms", headers=headers).status_code == 400
+    assert "search_terms" not in client.get(f"{API}/patients/{pid}", headers=headers).get_json()["data"]
@@ -0,0 +1,66 @@
+import json
+import pytest
+import globals
+import geo_grid
+import rollups
+import seed_synthea_data
+import subresources
+from tests.helpers import export, write, seed
+
+pytestmark = pytest.mark.usefixtures("mongomock_rollups")
+
+def patient_of(synthea_id):
+    return globals.db["synthea_import"].find_one({"_id": synthea_id})["patient_id"]
+
+def prescriptions_of(pid):
+    return {s["name"]: s for s in subresources.subs_of(globals.db["patients"].find_one({"_id": pid}))["prescriptions"]}
+
+def grid():
+    return {json.dumps(d["_id"], sort_keys=True): d["count"] for d in geo_grid.grid.find({"count": {"$ne": 0}})}
+
+@pytest.fixture
+def imported(monkeypatch, tmp_path, storage_mode):
+    monkeypatch.setattr(seed_synthea_data, "STORAGE_MODE", storage_mode)
+    rows = export()
+    write(tmp_path, rows)
+    seed(monkeypatch, tmp_path, "full")
+    return rows
+
+def test_delta_import_continues_versions_and_keeps_counters(monkeypatch, tmp_path, imported):
+    pid = patient_of("p0")
+    # the API edits a prescription, then the export changes it too
+    drug = prescriptions_of(pid)["Drug 1"]
+    assert subresources.update("prescriptions", pid, drug["_id"], {"status": "paused"})[0] == "updated"
+    # mongomock hands back the after-image of an embedded find_one_and_update with a
+    # projection, so the counters are recomputed to what the server would have left
+    rollups.rebuild()
+    imported["medications"][0]["DESCRIPTION"] = "Drug renamed"
+    imported["careplans"][0]["STOP"] = "2024-01-01"
+    write(tmp_path, imported)
+    seed(monkeypatch, tmp_path, "delta")
+
+    renamed = prescriptions_of(pid)["Drug Renamed"]
+    assert renamed["_id"] == drug["_id"]
+    assert subresources.version_of(renamed) == subresources.version_of(drug) + 2
+    assert globals.db["patients"].find_one({"_id": pid})["last_updated"] > drug.get("last_updated", "")
+    assert rollups.check() == {kind: [] for kind in rollups.LABELS}
+    before = grid()
+    geo_grid.rebuild()
+    assert grid() == before
+
+def test_patient_deleted_through_the_api_stays_deleted(monkeypatch, tmp_path, imported):
+    gone = patient_of("p1")
+    subresources.delete_patient(gone)
+    imported["medications"][2]["DESCRIPTION"] = "Drug changed"
+    del imported["patients"][2]
+    write(tmp_path, imported)
+    seed(monkeypatch, tmp_path, "delta")
+
+    assert globals.db["patients"].count_documents({}) == 1
+    assert globals.db["patients"].count_documents({"_id": gone}) == 0
+    for kind in subresources.KINDS:
+        assert globals.db[kind].count_documents({"patient_id": gone}) == 0
+    assert rollups.check() == {kind: [] for kind in rollups.LABELS}
+    before = grid()
+    geo_grid.rebuild()
+    assert grid() == before
@@ -0,0 +1,49 @@
+import json, threading
+import globals
+import geo_grid
+from tests.helpers import API, add_patient
+
+BELFAST = {"type": "Point", "coordinates": [-5.93, 54.6]}
+DERRY = {"type": "Point", "coordinates": [-7.31, 55.0]}
+
+def grid():
+    return {json.dumps(d["_id"], sort_keys=True): d["count"] for d in geo_grid.grid.find({"count": {"$ne": 0}})}
+
+def tile_url(point, z=8):
+    x, y = geo_grid.tile_of(*point["coordinates"], z)
+    return f"{API}/geo/tiles/{z}/{x}/{y}"
+
+def test_incremental_grid_matches_a_rebuild(client, headers):
+    moved = add_patient(client, headers, location=BELFAST, condition="Asthma")
+    gone = add_patient(client, headers, location=BELFAST, condition="Diabetes")
+    bulk = [{"name": "Bulk", "age": 70, "gender": "Male", "condition": "Asthma", "location": DERRY}]
+    assert client.post(f"{API}/patients/bulk", json=bulk, headers=headers).status_code == 201
+    assert client.put(f"{API}/patients/{moved}", json={"location": DERRY, "age": 12}, headers=headers).status_code == 200
+    assert client.delete(f"{API}/patients/{gone}", headers=headers).status_code == 200
+    incremental = grid()
+    geo_grid.rebuild()
+    assert grid() == incremental
+
+def test_tile_counts_and_splits(client, headers):
+    add_patient(client, headers, location=BELFAST, condition="Asthma")
+    add_patient(client, headers, location=BELFAST, condition="Diabetes")
+    add_patient(client, headers, location=DERRY, condition="Asthma")
+    body = client.get(tile_url(BELFAST), headers=headers).get_json()
+    assert body["total"] == 2
+    split = client.get(f"{tile_url(BELFAST)}?split=condition", headers=headers).get_json()
+    assert [c["by"] for c in split["cells"]] == [{"Asthma": 1, "Diabetes": 1}]
+    assert client.get(f"{tile_url(BELFAST)}?split=gender", headers=headers).status_code == 400
+    assert client.get(f"{API}/geo/tiles/2/9/0", headers=headers).status_code == 400
+
+def test_concurrent_rebuilds_leave_one_complete_grid(client, headers):
+    for point in (BELFAST, DERRY):
+        add_patient(client, headers, location=point)
+    expected = grid()
+    threads = [threading.Thread(target=geo_grid.rebuild) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert grid() == expected
+    assert geo_grid.grid.index_information().keys() > {"_id_"}
+    assert not [n for n in globals.db.list_collection_names() if "_rebuild_" in n]
@@ -0,0 +1,43 @@
+import mongomock
+import pytest
+from pymongo import ASCENDING
+import indexes
+
+# mongomock's create_indexes drops the options of an IndexModel, create_index keeps them
+@pytest.fixture
+def db(monkeypatch):
+    def create_indexes(self, models, *args, **kwargs):
+        names = []
+        for model in models:
+            doc = dict(model.document)
+            names.append(self.create_index(list(doc.pop("key").items()), **doc))
+        return names
+
+    monkeypatch.setattr(mongomock.collection.Collection, "create_indexes", create_indexes)
+    return mongomock.MongoClient()["indexTest"]
+
+@pytest.mark.parametrize("split", [False, True])
+def test_apply_then_check_is_clean(db, split):
+    created = indexes.apply(db=db, split=split)
+    assert "patients.search_terms_1" in created
+    assert indexes.check(db=db, split=split) == {"missing": [], "extra": [], "changed": []}
+    assert indexes.apply(db=db, split=split) == []
+
+def test_check_reports_missing_extra_and_changed(db):
+    indexes.apply(db=db, split=False)
+    db["patients"].drop_index("gender_1")
+    db["patients"].create_index([("name", ASCENDING)])
+    db["users"].drop_index("username_1")
+    db["users"].create_index([("username", ASCENDING)])
+    report = indexes.check(db=db, split=False)
+    assert report == {"missing": ["patients.gender_1"], "extra": ["patients.name_1"], "changed": ["users.username_1"]}
+
+def test_split_mode_declares_the_active_careplans_index():
+    assert "careplans" not in indexes.declared(split=False)
+    partial = [m.document for m in indexes.declared(split=True)["careplans"] if "partialFilterExpression" in m.document]
+    assert partial == [{"key": {"stop": 1, "description": 1}, "name": "stop_1_description_1",
+                        "partialFilterExpression": {"stop": "Unknown"}}]
+
+def test_apply_can_be_limited_to_collections(db):
+    created = indexes.apply(collections=["users"], db=db, split=False)
+    assert created == ["users.username_1"]
@@ -0,0 +1,40 @@
+import datetime
+import pytest
+from bson import ObjectId, Decimal128
+import utils
+from tests.helpers import API, add_patient
+
+DOC = {"_id": ObjectId("64b7f0c2a1b2c3d4e5f60718"), "at": datetime.datetime(2024, 5, 1, 9, 30),
+       "day": datetime.date(2024, 5, 1), "cost": Decimal128("12.50"), "raw": b"\x00\x01", "name": "Zoë"}
+EXPECTED = {"_id": "64b7f0c2a1b2c3d4e5f60718", "at": "2024-05-01T09:30:00", "day": "2024-05-01",
+            "cost": "12.50", "raw": "AAE=", "name": "Zoë"}
+
+# both encoders: orjson when installed, the standard library otherwise
+@pytest.fixture(params=["stdlib", "orjson"])
+def encoder(request, monkeypatch):
+    if request.param == "stdlib":
+        monkeypatch.setattr(utils, "orjson", None)
+    elif utils.orjson is None:
+        pytest.skip("orjson is not installed")
+    return request.param
+
+def test_bson_types_are_encoded(app, encoder):
+    assert app.json.loads(app.json.dumps(DOC)) == EXPECTED
+
+def test_key_order_is_kept(app, encoder):
+    assert list(app.json.loads(app.json.dumps({"b": 1, "a": 2}))) == ["b", "a"]
+
+def test_responses_carry_the_encoded_document(app, encoder):
+    with app.test_request_context():
+        resp = app.json.response(DOC)
+    assert resp.mimetype == "application/json"
+    assert resp.get_json() == EXPECTED
+
+def test_unknown_types_still_fail(app, encoder):
+    with pytest.raises(TypeError):
+        app.json.dumps({"value": object()})
+
+def test_patient_ids_are_strings(client, headers, encoder):
+    pid = add_patient(client, headers)
+    body = client.get(f"{API}/patients/{pid}", headers=headers).get_json()
+    assert body["data"]["_id"] == pid
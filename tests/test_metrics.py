@@ -0,0 +1,40 @@
+import metrics
+from tests.helpers import API, add_patient
+
+# helper: value of one sample in the exposition, 0 when absent
+def sample(body, series):
+    for line in body.splitlines():
+        if line.startswith(series + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0
+
+# values are per process, so each test compares before and after
+def test_requests_are_counted_per_endpoint(client, headers):
+    add_patient(client, headers)
+    labels = '{blueprint="patients_bp",endpoint="patients_bp.get_patients",method="GET"'
+    before = client.get("/metrics").get_data(as_text=True)
+    client.get(f"{API}/patients/?fields=name", headers=headers)
+    after = client.get("/metrics").get_data(as_text=True)
+    total = "http_requests_total" + labels + ',status="200"}'
+    count = "http_request_duration_seconds_count" + labels + "}"
+    assert sample(after, total) - sample(before, total) == 1
+    assert sample(after, count) - sample(before, count) == 1
+    assert "# TYPE http_request_duration_seconds histogram" in after
+
+def test_responses_carry_server_timing(client, headers):
+    resp = client.get(f"{API}/patients/?fields=name", headers=headers)
+    assert resp.headers["Server-Timing"].startswith("app;dur=")
+    assert 'commands"' in resp.headers["Server-Timing"]
+
+def test_histogram_buckets_are_cumulative():
+    h = metrics.Histogram("test_seconds", "Test.", ("op",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        h.observe(("read",), value)
+    lines = h.render()
+    assert 'test_seconds_bucket{op="read",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{op="read",le="1"} 2' in lines
+    assert 'test_seconds_bucket{op="read",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{op="read"} 3' in lines
+
+def test_label_values_are_escaped():
+    assert metrics.render_labels(("path",), ('a"b\\c',)) == '{path="a\\"b\\\\c"}'
@@ -0,0 +1,53 @@
+import globals
+import migrate_subresources
+from bson import ObjectId
+from tests.helpers import API, APPOINTMENT, CAREPLAN, add_patient, add_sub
+
+def test_migrated_patient_reads_the_same_in_collections_mode(client, headers, monkeypatch):
+    pid = add_patient(client, headers)
+    add_sub(client, headers, pid, "appointments", APPOINTMENT)
+    add_sub(client, headers, pid, "careplans", CAREPLAN)
+    before = client.get(f"{API}/patients/{pid}", headers=headers).get_json()["data"]
+    migrate_subresources.migrate_patient(globals.db["patients"].find_one({"_id": ObjectId(pid)}))
+    monkeypatch.setattr(globals, "storage_mode", "collections")
+    after = client.get(f"{API}/patients/{pid}", headers=headers).get_json()["data"]
+    assert after["appointments"] == before["appointments"]
+    assert after["careplans"] == before["careplans"]
+    stored = globals.db["patients"].find_one({"_id": ObjectId(pid)})
+    assert "appointments" not in stored and stored["appointment_count"] == 1
+
+# helper: run fn once, right after the first bulk write into kind during a migration
+def race_after_first_write(monkeypatch, kind, fn):
+    collection = globals.db[kind]
+    original = collection.bulk_write
+    calls = []
+
+    def bulk_write(ops, **kwargs):
+        result = original(ops, **kwargs)
+        calls.append(1)
+        if len(calls) == 1:
+            fn()
+        return result
+
+    monkeypatch.setattr(collection, "bulk_write", bulk_write)
+
+def test_push_between_read_and_unset_is_not_lost(monkeypatch):
+    pid = ObjectId()
+    patients = globals.db["patients"]
+    patients.insert_one({"_id": pid, "appointments": [{"_id": ObjectId(), "doctor": "first"}],
+                         "careplans": [{"description": "no id yet"}]})
+    race_after_first_write(monkeypatch, "appointments", lambda: patients.update_one(
+        {"_id": pid}, {"$push": {"appointments": {"_id": ObjectId(), "doctor": "pushed"}}}))
+    migrate_subresources.migrate_patient(patients.find_one({"_id": pid}))
+    assert sorted(d["doctor"] for d in globals.db["appointments"].find({"patient_id": pid})) == ["first", "pushed"]
+    # the careplan got a new _id on the retry, the copy from the first attempt is gone
+    assert globals.db["careplans"].count_documents({"patient_id": pid}) == 1
+    assert patients.find_one({"_id": pid})["appointment_count"] == 2
+
+def test_patient_deleted_during_migration_leaves_no_copies(monkeypatch):
+    pid = ObjectId()
+    patients = globals.db["patients"]
+    patients.insert_one({"_id": pid, "appointments": [{"_id": ObjectId(), "doctor": "first"}]})
+    race_after_first_write(monkeypatch, "appointments", lambda: patients.delete_one({"_id": pid}))
+    migrate_subresources.migrate_patient(patients.find_one({"_id": pid}))
+    assert globals.db["appointments"].count_documents({"patient_id": pid}) == 0
@@ -0,0 +1,64 @@
+import pytest
+from bson import ObjectId
+from blueprints.analytics import analytics
+from blueprints.analytics.analytics import nearby_cell
+from cache import analytics_cache
+from tests.helpers import API
+
+NEARBY = f"{API}/geo/nearby?lon=-5.93&lat=54.6&max_distance=5000"
+
+# mongomock has no $geoNear: the view's aggregate gets these rows, already in
+# (distance, _id) order, and keeps the pipelines it was sent
+class GeoNearStub:
+    def __init__(self, rows):
+        self.rows = rows
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        near = pipeline[0]["$geoNear"]
+        rows = [r for r in self.rows if r["distance"] >= near.get("minDistance", 0)]
+        if len(pipeline) > 1 and "$match" in pipeline[1]:
+            last = pipeline[1]["$match"]["$or"][1]
+            rows = [r for r in rows if r["distance"] > last["distance"] or
+                    (r["distance"] == last["distance"] and r["_id"] > last["_id"]["$gt"])]
+        return iter(rows[:pipeline[-2]["$limit"]])
+
+@pytest.fixture
+def stub(monkeypatch):
+    rows = [{"_id": ObjectId(), "name": f"P{i}", "distance": float(d)} for i, d in enumerate([10, 20, 20, 20, 30])]
+    stub = GeoNearStub(rows)
+    monkeypatch.setattr(analytics, "patients", stub)
+    return stub
+
+def test_after_pages_through_equal_distances(client, headers, stub):
+    seen, url = [], f"{NEARBY}&limit=2"
+    for _ in range(3):
+        body = client.get(url, headers=headers).get_json()
+        seen += [r["name"] for r in body["nearby_patients"]]
+        url = f"{NEARBY}&limit=2&after={body['next_cursor']}"
+    assert body["next_cursor"] is None
+    assert seen == ["P0", "P1", "P2", "P3", "P4"]
+    assert stub.pipelines[1][0]["$geoNear"]["minDistance"] == 20
+
+def test_each_page_is_cached_separately(client, headers, stub):
+    first = client.get(f"{NEARBY}&limit=2", headers=headers).get_json()
+    second = client.get(f"{NEARBY}&limit=2&after={first['next_cursor']}", headers=headers).get_json()
+    assert second["nearby_patients"] != first["nearby_patients"]
+    client.get(f"{NEARBY}&limit=2&after={first['next_cursor']}", headers=headers)
+    assert (analytics_cache.hits, analytics_cache.misses) == (1, 2)
+
+@pytest.mark.parametrize("query", ["lon=500&lat=54.6", "lon=-5.93", "lon=-5.93&lat=54.6&max_distance=0"])
+def test_invalid_coordinates_are_rejected(client, headers, query):
+    assert client.get(f"{API}/geo/nearby?{query}", headers=headers).status_code == 400
+
+def test_malformed_after_cursor_is_rejected(client, headers):
+    assert client.get(f"{NEARBY}&after=nonsense", headers=headers).status_code == 400
+
+def test_close_points_share_a_cell(app):
+    def cell(url):
+        with app.test_request_context(url):
+            return nearby_cell()
+    here = cell(NEARBY)
+    assert cell(f"{API}/geo/nearby?lon=-5.9301&lat=54.6001&max_distance=5000") == here
+    assert cell(f"{API}/geo/nearby?lon=-6.5&lat=54.6&max_distance=5000") != here
@@ -0,0 +1,49 @@
+import pytest
+import search
+from tests.helpers import API, add_patient
+
+# helper: follow next_cursor from the first page, returns every page's rows
+def walk(client, headers, url, rows_key):
+    pages, resp = [], client.get(url, headers=headers).get_json()
+    while True:
+        body = resp.get("data", resp)
+        pages.append(body[rows_key])
+        if not body["next_cursor"]:
+            return pages
+        resp = client.get(f"{url}&after={body['next_cursor']}", headers=headers).get_json()
+
+# the default list projection computes counters mongomock cannot, so these ask for plain fields
+LIST = f"{API}/patients/?fields=name,gender"
+
+def test_patients_cursor_pages_cover_every_patient_once(client, headers):
+    ids = [add_patient(client, headers, name=f"Patient {i}") for i in range(7)]
+    pages = walk(client, headers, f"{LIST}&limit=3", "patients")
+    assert [len(p) for p in pages] == [3, 3, 1]
+    assert [row["id"] for page in pages for row in page] == sorted(ids)
+
+def test_patients_cursor_mode_skips_the_total_unless_asked(client, headers):
+    for i in range(3):
+        add_patient(client, headers)
+    first = client.get(f"{LIST}&limit=2", headers=headers).get_json()["data"]
+    assert first["total"] == 3 and first["page"] == 1
+    after = first["next_cursor"]
+    second = client.get(f"{LIST}&limit=2&after={after}", headers=headers).get_json()["data"]
+    assert "total" not in second and "page" not in second
+    counted = client.get(f"{LIST}&limit=2&after={after}&include_total=1", headers=headers).get_json()["data"]
+    assert counted["total"] == 3
+
+@pytest.mark.parametrize("url", [f"{API}/patients/?after=nonsense", f"{API}/search?q=anna&after=nonsense"])
+def test_malformed_cursor_is_rejected(client, headers, url):
+    assert client.get(url, headers=headers).status_code == 400
+
+@pytest.mark.parametrize("ranked", [False, True])
+def test_search_cursor_pages_match_one_page(client, headers, ranked):
+    for i in range(5):
+        add_patient(client, headers, name=f"Anna Number{i}")
+    add_patient(client, headers, name="Bob Other")
+    if ranked:
+        search.rebuild()
+    everything = client.get(f"{API}/search?q=anna&limit=50", headers=headers).get_json()["results"]
+    pages = walk(client, headers, f"{API}/search?q=anna&limit=2", "results")
+    assert [len(p) for p in pages] == [2, 2, 1]
+    assert [r["_id"] for page in pages for r in page] == [r["_id"] for r in everything]
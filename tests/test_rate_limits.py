@@ -0,0 +1,30 @@
+import geo_grid
+import globals
+from tests.helpers import API
+
+TILE = f"{API}/geo/tiles/8/%d/%d" % geo_grid.tile_of(-5.93, 54.6, 8)
+
+def limit_of(resp):
+    return int(resp.headers["X-RateLimit-Limit"]), int(resp.headers["X-RateLimit-Remaining"])
+
+def budget(setting):
+    return int(setting.split(";")[0].split("/")[0])
+
+def test_routes_count_against_their_class(client, headers):
+    assert limit_of(client.get(f"{API}/patients/?fields=name", headers=headers))[0] == budget(globals.ratelimit_crud)
+    assert limit_of(client.get(f"{API}/search?q=anna", headers=headers))[0] == budget(globals.ratelimit_search)
+    assert limit_of(client.get(TILE, headers=headers))[0] == budget(globals.ratelimit_tiles)
+    assert limit_of(client.get(f"{API}/stats/appointments", headers=headers))[0] == budget(globals.ratelimit_analytics)
+
+def test_overview_costs_several_analytics_requests(client, headers):
+    _, before = limit_of(client.get(f"{API}/stats/appointments", headers=headers))
+    client.get(f"{API}/stats/overview", headers=headers)
+    _, after = limit_of(client.get(f"{API}/stats/appointments", headers=headers))
+    assert before - after == globals.ratelimit_overview_cost + 1
+
+def test_spent_search_budget_leaves_tiles_and_crud_alone(client, headers):
+    for _ in range(budget(globals.ratelimit_search)):
+        client.get(f"{API}/search?q=anna", headers=headers)
+    assert client.get(f"{API}/search?q=anna", headers=headers).status_code == 429
+    assert client.get(TILE, headers=headers).status_code == 200
+    assert client.get(f"{API}/patients/?fields=name", headers=headers).status_code == 200
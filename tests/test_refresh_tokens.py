@@ -0,0 +1,48 @@
+import base64
+import globals
+from blueprints.auth import auth
+from tests.helpers import API
+
+def refresh(client, token):
+    return client.post(f"{API}/auth/refresh", headers={"x-refresh-token": token})
+
+def test_login_returns_a_token_pair(client):
+    basic = "Basic " + base64.b64encode(b"admin:admin123").decode()
+    first = client.get(f"{API}/auth/login", headers={"Authorization": basic}).get_json()["data"]
+    second = client.get(f"{API}/auth/login", headers={"Authorization": basic}).get_json()["data"]
+    assert first["refresh_token"] and first["expires_in"] > 0
+    # logins in the same second still get distinct access tokens
+    assert first["token"] != second["token"]
+
+def test_refresh_rotates_the_token(client):
+    pair = auth.token_pair("admin", True)
+    resp = refresh(client, pair["refresh_token"])
+    assert resp.status_code == 200
+    rotated = resp.get_json()["data"]
+    assert rotated["refresh_token"] != pair["refresh_token"]
+    assert client.get(f"{API}/auth/verify", headers={"x-access-token": rotated["token"]}).status_code == 200
+
+def test_reusing_a_refresh_token_revokes_its_family(client):
+    pair = auth.token_pair("admin", True)
+    rotated = refresh(client, pair["refresh_token"]).get_json()["data"]
+    # the old token comes back, e.g. stolen: it and every descendant stop working
+    assert refresh(client, pair["refresh_token"]).status_code == 401
+    assert refresh(client, rotated["refresh_token"]).status_code == 401
+
+def test_other_sessions_survive_a_reuse(client):
+    mine, other = auth.token_pair("admin", True), auth.token_pair("admin", True)
+    refresh(client, mine["refresh_token"])
+    refresh(client, mine["refresh_token"])
+    assert refresh(client, other["refresh_token"]).status_code == 200
+
+def test_logout_with_the_access_token_alone_ends_its_family(client):
+    pair, other = auth.token_pair("admin", True), auth.token_pair("admin", True)
+    assert client.get(f"{API}/auth/logout", headers={"x-access-token": pair["token"]}).status_code == 200
+    assert refresh(client, pair["refresh_token"]).status_code == 401
+    assert refresh(client, other["refresh_token"]).status_code == 200
+
+def test_a_deleted_user_cannot_refresh(client):
+    globals.db["users"].insert_one({"username": "temp", "password": b"", "admin": False})
+    pair = auth.token_pair("temp", False)
+    globals.db["users"].delete_one({"username": "temp"})
+    assert refresh(client, pair["refresh_token"]).status_code == 401
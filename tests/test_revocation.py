@@ -0,0 +1,29 @@
+import time
+import globals
+from decorators import RevocationSet
+from tests.helpers import API
+
+def test_logout_revokes_the_token(client, headers):
+    assert client.get(f"{API}/auth/verify", headers=headers).status_code == 200
+    assert client.get(f"{API}/auth/logout", headers=headers).status_code == 200
+    resp = client.get(f"{API}/auth/verify", headers=headers)
+    assert resp.status_code == 401
+    assert resp.get_json()["message"] == "Token blacklisted"
+
+def test_revocations_of_another_worker_arrive_on_sync():
+    collection = globals.db["blacklist"]
+    mine, other = RevocationSet(collection, interval=3600), RevocationSet(collection, interval=3600)
+    mine.sync(force=True)
+    other.revoke("abc", time.time() + 300)
+    # within the interval the local copy is used as is
+    assert "abc" not in mine
+    mine.sync(force=True)
+    assert "abc" in mine
+
+def test_sync_prunes_expired_tokens():
+    revocations = RevocationSet(globals.db["blacklist"], interval=3600)
+    revocations.revoke("old", time.time() - 300)
+    revocations.revoke("forever", None)
+    revocations.sync(force=True)
+    assert "old" not in revocations.tokens
+    assert "forever" in revocations.tokens
@@ -0,0 +1,51 @@
+import pytest
+import globals
+import rollups
+from tests.helpers import API, APPOINTMENT, CAREPLAN, PRESCRIPTION, add_patient, add_sub
+
+pytestmark = pytest.mark.usefixtures("mongomock_rollups")
+
+# helper: every rollup as {key: count}, zero counters left out
+def snapshot():
+    return {kind: {tuple(d["_id"].items()): d["count"] for d in rollups.collection(kind).find({"count": {"$ne": 0}})}
+            for kind in rollups.LABELS}
+
+def test_incremental_counters_match_a_rebuild(client, headers, storage_mode):
+    kept, gone = add_patient(client, headers, gender="Female"), add_patient(client, headers, gender="Male")
+    for pid in (kept, gone):
+        add_sub(client, headers, pid, "appointments", APPOINTMENT)
+        add_sub(client, headers, pid, "prescriptions", PRESCRIPTION)
+    careplan = add_sub(client, headers, kept, "careplans", CAREPLAN)
+    removed = add_sub(client, headers, kept, "appointments", {**APPOINTMENT, "doctor": "Dr Jones"})
+    # a key change, a delete, a gender change and a patient delete all move counters
+    assert client.put(f"{API}/patients/{kept}/careplans/{careplan['_id']}", json={"stop": "2024-06-01"},
+                      headers=headers).status_code == 200
+    assert client.delete(f"{API}/patients/{kept}/appointments/{removed['_id']}", headers=headers).status_code == 200
+    assert client.put(f"{API}/patients/{kept}", json={"gender": "Male"}, headers=headers).status_code == 200
+    assert client.delete(f"{API}/patients/{gone}", headers=headers).status_code == 200
+
+    assert rollups.check() == {kind: [] for kind in rollups.LABELS}
+    incremental = snapshot()
+    rollups.rebuild()
+    assert snapshot() == incremental
+    assert incremental["careplans"] == {(("careplan", CAREPLAN["description"]), ("year", "2024"),
+                                         ("active", False), ("gender", "Male")): 1}
+
+def test_rebuild_replaces_the_live_rollups(client, headers):
+    pid = add_patient(client, headers)
+    add_sub(client, headers, pid, "appointments", APPOINTMENT)
+    rollups.collection("appointments").insert_one({"_id": {"doctor": "stale"}, "count": 5})
+    rollups.rebuild()
+    assert list(rollups.collection("appointments").find({}, {"_id": 0, "count": 1})) == [{"count": 1}]
+    assert not [n for n in globals.db.list_collection_names() if "_rebuild_" in n]
+    assert rollups.ready()
+
+def test_stats_read_the_rollups_once_built(client, headers):
+    pid = add_patient(client, headers)
+    add_sub(client, headers, pid, "appointments", APPOINTMENT)
+    rollups.rebuild()
+    # a counter only the rollup knows about shows the rollup path is used
+    rollups.collection("appointments").insert_one({"_id": {"doctor": "Dr Rollup", "year": "2024", "gender": "Female"},
+                                                   "count": 7})
+    stats = client.get(f"{API}/stats/appointments", headers=headers).get_json()
+    assert stats["results"][0] == {"doctor": "Dr Rollup", "count": 7}
@@ -0,0 +1,46 @@
+import io, json
+import pytest
+from bson import ObjectId
+import globals
+import scale_dataset
+import subresources
+from tests.helpers import export, write
+
+@pytest.fixture
+def profile(tmp_path):
+    write(tmp_path, export(4))
+    return scale_dataset.Profile.learn(str(tmp_path))
+
+def test_a_patient_is_the_same_on_every_run(tmp_path, profile):
+    again = scale_dataset.Profile.learn(str(tmp_path))
+    assert profile.patient(7, 123) == again.patient(7, 123)
+    assert profile.patient(7, 123) != profile.patient(8, 123)
+    assert list(profile.patients(7, 3, start=5)) == [profile.patient(7, i) for i in range(5, 8)]
+
+def test_patients_copy_the_export_shape(profile):
+    patient = profile.patient(1, 0)
+    assert patient["condition"] == "Diabetes"
+    assert [len(patient[kind]) for kind in subresources.KINDS] == [1, 2, 1]
+    assert patient["prescription_count"] == 2
+    assert patient["prescriptions"][0]["name"] in {"Drug 1", "Drug 2"}
+
+def test_ids_are_unique_and_encode_seed_and_index(profile):
+    patient = profile.patient(3, 70000)
+    ids = [patient["_id"], *(s["_id"] for kind in subresources.KINDS for s in patient[kind])]
+    assert len(set(ids)) == len(ids)
+    assert patient["_id"] == scale_dataset.make_id(scale_dataset.id_prefix(3, 70000))
+
+def test_to_mongo_writes_every_patient(profile, storage_mode):
+    written = scale_dataset.to_mongo(globals.db, profile.patients(2, 25), batch_size=10, drop=True)
+    assert written == globals.db["patients"].count_documents({}) == 25
+    first = globals.db["patients"].find_one({"_id": scale_dataset.make_id(scale_dataset.id_prefix(2, 0))})
+    assert subresources.subs_of(first)["prescriptions"]
+    if storage_mode == "collections":
+        assert "prescriptions" not in first
+        assert globals.db["prescriptions"].count_documents({}) == 50
+
+def test_ndjson_is_extended_json(profile):
+    out = io.StringIO()
+    assert scale_dataset.to_ndjson(out, profile.patients(2, 2)) == 2
+    line = json.loads(out.getvalue().splitlines()[0])
+    assert ObjectId(line["_id"]["$oid"]) == scale_dataset.make_id(scale_dataset.id_prefix(2, 0))
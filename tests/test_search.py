@@ -0,0 +1,33 @@
+import search
+from tests.helpers import API, add_patient
+
+def names(client, headers, q):
+    return [r["name"] for r in client.get(f"{API}/search?q={q}&limit=50", headers=headers).get_json()["results"]]
+
+def test_ranked_search_tolerates_prefixes_and_typos(client, headers):
+    add_patient(client, headers, name="Margaret Thompson", condition="Asthma")
+    add_patient(client, headers, name="Martin Lewis", condition="Diabetes")
+    add_patient(client, headers, name="Peter Jones", condition="Asthma")
+    search.rebuild()
+    assert names(client, headers, "Marg")[0] == "Margaret Thompson"
+    assert names(client, headers, "Thomspon")[0] == "Margaret Thompson"
+    assert set(names(client, headers, "asthma")) == {"Margaret Thompson", "Peter Jones"}
+
+def test_best_match_ranks_first(client, headers):
+    add_patient(client, headers, name="Anne Marie", condition="Asthma")
+    add_patient(client, headers, name="Annabel Smith", condition="Asthma")
+    search.rebuild()
+    assert names(client, headers, "annabel")[0] == "Annabel Smith"
+
+def test_writes_keep_the_terms_current(client, headers):
+    pid = add_patient(client, headers, name="Old Name")
+    search.rebuild()
+    client.put(f"{API}/patients/{pid}", json={"name": "Brand New"}, headers=headers)
+    assert names(client, headers, "brand") == ["Brand New"]
+    assert names(client, headers, "old") == []
+
+def test_search_terms_are_not_returned(client, headers):
+    add_patient(client, headers, name="Hidden Terms")
+    search.rebuild()
+    result = client.get(f"{API}/search?q=hidden", headers=headers).get_json()["results"][0]
+    assert "search_terms" not in result
@@ -0,0 +1,60 @@
+import pytest
+import globals
+import seed_synthea_data
+from tests.helpers import export, write, seed
+
+pytestmark = pytest.mark.usefixtures("mongomock_rollups")
+
+# helper: everything an import wrote, minus the write time
+def snapshot():
+    patients = {d["_id"]: d for d in globals.db["patients"].find({}, {"last_updated": 0})}
+    records = {d["_id"]: d for d in globals.db["synthea_import"].find()}
+    return patients, records
+
+@pytest.fixture
+def csv_dir(tmp_path):
+    rows = export(5)
+    # a patient's medications are spread over the file rather than adjacent
+    rows["medications"].sort(key=lambda r: r["CODE"])
+    write(tmp_path, rows)
+    return tmp_path
+
+def test_spilled_runs_give_the_same_import(monkeypatch, csv_dir):
+    seed(monkeypatch, csv_dir, "full")
+    in_memory = snapshot()
+    seed(monkeypatch, csv_dir, "full", "--chunk-rows", "1")
+    assert snapshot() == in_memory
+    assert len(in_memory[0]) == 5
+
+def test_rows_keep_their_file_order_within_a_patient(monkeypatch, csv_dir):
+    seed(monkeypatch, csv_dir, "full", "--chunk-rows", "2")
+    for patient in globals.db["patients"].find():
+        assert [p["name"] for p in patient["prescriptions"]] == ["Drug 1", "Drug 2"]
+
+def test_sort_runs_spills_sorted_chunks(tmp_path):
+    path = tmp_path / "rows.csv"
+    path.write_text("KEY,VALUE\nb,1\na,2\nc,3\na,4\nb,5\n")
+    convert = lambda row, providers: (row["KEY"], row["VALUE"])
+    runs, rows = seed_synthea_data.sort_runs(str(path), convert, {}, 2, str(tmp_path))
+    assert rows == 5 and len(runs) == 3
+    assert list(seed_synthea_data.grouped(runs)) == [("a", ["2", "4"]), ("b", ["1", "5"]), ("c", ["3"])]
+
+def test_join_hands_every_patient_its_children():
+    patients = iter([("a", [{"Id": "a"}]), ("b", [{"Id": "b"}]), ("d", [{"Id": "d"}])])
+    visits = iter([("a", [1]), ("c", [2]), ("d", [3, 4])])
+    joined = [(row["Id"], children["visits"]) for row, children in seed_synthea_data.join(patients, {"visits": visits})]
+    assert joined == [("a", [1]), ("b", []), ("d", [3, 4])]
+
+def test_worker_processes_give_the_same_import(monkeypatch, csv_dir):
+    seed(monkeypatch, csv_dir, "full")
+    inline = snapshot()
+    seed(monkeypatch, csv_dir, "full", "--workers", "3", "--chunk-rows", "2")
+    assert snapshot() == inline
+
+def test_memoised_normalisers():
+    assert seed_synthea_data.clean_date("2023-05-01T10:00:00Z") == "2023-05-01"
+    assert seed_synthea_data.clean_date("") == "Unknown"
+    assert seed_synthea_data.clean_doctor_name("Jane123 Doe") == "Dr. Jane Doe"
+    assert seed_synthea_data.clean_condition("Diabetes (disorder)") == "Diabetes"
+    seed_synthea_data.clean_condition("Diabetes (disorder)")
+    assert seed_synthea_data.clean_condition.cache_info().hits >= 1
@@ -0,0 +1,56 @@
+import pytest
+import slow_queries
+from tests.helpers import API
+
+@pytest.fixture(autouse=True)
+def empty_log(monkeypatch):
+    # keep the explain worker off mongomock, which has no explain command
+    monkeypatch.setattr(slow_queries, "start_worker", lambda: None)
+    monkeypatch.setattr(slow_queries, "explain_queue", slow_queries.queue.Queue(maxsize=100))
+    slow_queries.reset()
+    yield
+    slow_queries.reset()
+
+def find(name):
+    return {"find": "patients", "filter": {"name": name, "age": {"$gte": 40}}, "sort": {"_id": 1}}
+
+def test_literals_are_grouped_by_shape():
+    slow_queries.record("find", find("Anna"), "testDB", 0.2)
+    slow_queries.record("find", find("Bob"), "testDB", 0.4)
+    (entry,) = slow_queries.top()
+    assert entry["count"] == 2
+    assert entry["total_ms"] == 600.0 and entry["max_ms"] == 400.0 and entry["avg_ms"] == 300.0
+    assert entry["shape"]["filter"] == {"name": "<str>", "age": {"$gte": "<int>"}}
+
+def test_shapes_are_listed_by_total_time():
+    slow_queries.record("find", find("Anna"), "testDB", 0.2)
+    slow_queries.record("aggregate", {"aggregate": "patients", "pipeline": [{"$match": {"age": 1}}]}, "testDB", 0.5)
+    assert [e["shape"]["command"] for e in slow_queries.top()] == ["aggregate", "find"]
+
+def test_first_occurrence_is_queued_for_explain(monkeypatch):
+    monkeypatch.setattr(slow_queries, "explain_sample", 0)
+    command = {**find("Anna"), "lsid": {"id": 1}, "$db": "testDB"}
+    slow_queries.record("find", command, "testDB", 0.2)
+    key, database, cmd = slow_queries.explain_queue.get_nowait()
+    assert database == "testDB" and "lsid" not in cmd and "$db" not in cmd
+    slow_queries.shapes[key]["plan"] = {"stages": ["IXSCAN"]}
+    slow_queries.record("find", command, "testDB", 0.2)
+    assert slow_queries.explain_queue.empty()
+
+def test_writing_pipelines_are_never_explained():
+    slow_queries.record("aggregate", {"aggregate": "patients", "pipeline": [{"$out": "copy"}]}, "testDB", 0.2)
+    assert slow_queries.explain_queue.empty()
+
+def test_plan_summary_flags_collection_scans():
+    explain = {"queryPlanner": {"winningPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}},
+               "executionStats": {"totalDocsExamined": 50, "totalKeysExamined": 0, "nReturned": 2, "executionTimeMillis": 3}}
+    summary = slow_queries.plan_summary(explain)
+    assert summary["collscan"] and summary["stages"] == ["COLLSCAN", "SORT"]
+    assert (summary["docs_examined"], summary["returned"]) == (50, 2)
+
+def test_endpoint_lists_and_resets(client, headers):
+    slow_queries.record("find", find("Anna"), "testDB", 0.2)
+    body = client.get(f"{API}/stats/slow-queries", headers=headers).get_json()
+    assert body["count"] == 1
+    assert client.delete(f"{API}/stats/slow-queries", headers=headers).status_code == 200
+    assert slow_queries.top() == []
@@ -1,4 +1,55 @@
-from flask import jsonify
+from flask import current_app, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+from bson import ObjectId, Decimal128
+from datetime import date, datetime
+import base64, hashlib, json
+import globals
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# helper: JSON value for the BSON and datetime types found in documents
+def bson_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+# app.json provider: documents straight from Mongo are encoded as they are, so
+# endpoints no longer walk them converting ObjectIds. Uses orjson when it is
+# installed (not in requirements.txt) and the standard library otherwise.
+class MongoJSONProvider(DefaultJSONProvider):
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            kwargs.setdefault("default", bson_default)
+            kwargs.setdefault("ensure_ascii", False)
+            return json.dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if kwargs.get("indent") else 0)
+        return orjson.dumps(obj, default=bson_default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return json.loads(s, **kwargs)
+        return orjson.loads(s)
+
+    # skips the str round trip of the default provider: orjson writes bytes
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        option = orjson.OPT_NON_STR_KEYS
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        return self._app.response_class(orjson.dumps(obj, default=bson_default, option=option), mimetype=self.mimetype)
 
 def response(success=True, data=None, message=None, status=200):
     
@@ -7,4 +58,90 @@ def response(success=True, data=None, message=None, status=200):
         payload["message"] = message
     if data is not None:
         payload["data"] = data
-    return jsonify(payload), status
\ No newline at end of file
+    return jsonify(payload), status
+
+# helper: opaque keyset cursor, encodes the _id of the last row returned plus any other sort keys
+def encode_cursor(last_id, **keys):
+    raw = json.dumps({"id": str(last_id), **keys}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+# helper: decode a cursor back to an ObjectId, None if malformed
+def decode_cursor(token):
+    try:
+        return ObjectId(cursor_keys(token)["id"])
+    except Exception:
+        return None
+
+# helper: all keys stored in a cursor, None if malformed
+def cursor_keys(token):
+    try:
+        return json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except Exception:
+        return None
+
+# helper: read a true/false query parameter
+def arg_flag(name, default=False):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes")
+
+# helper: read ?fields=a,b into a list, None when absent, raises ValueError on unknown names
+def parse_fields(allowed=None):
+    raw = request.args.get("fields")
+    if not raw:
+        return None
+    fields = [f.strip() for f in raw.split(",") if f.strip()]
+    unknown = [f for f in fields if f.startswith("$") or (allowed is not None and f not in allowed)]
+    if unknown or not fields:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}" if unknown else "No fields requested")
+    return fields
+
+# helper: the items of a batch request, sent as an array or under the given key; raises ValueError
+def bulk_items(key):
+    body = request.get_json(silent=True)
+    items = body.get(key) if isinstance(body, dict) else body
+    if not isinstance(items, list) or not items:
+        raise ValueError(f"Expected a non-empty array of {key}")
+    if len(items) > globals.bulk_max_items:
+        raise ValueError(f"At most {globals.bulk_max_items} {key} per request")
+    return items
+
+# helper: batch response from per-item results, 207 when only some items succeeded
+def bulk_response(results):
+    created = sum(1 for r in results if r["success"])
+    status = 201 if created == len(results) else 207 if created else 400
+    return response(created > 0, data={"created": created, "failed": len(results) - created, "results": results}, status=status)
+
+# helper: weak ETag and Last-Modified from a patient's last_updated stamp; the
+# query string is part of the tag since ?fields= changes the representation.
+# Returns the response, turned into a 304 when the client's copy is current
+def conditional(resp, last_updated):
+    if not last_updated:
+        return resp
+    tag = hashlib.sha1(f"{last_updated}|{request.query_string.decode()}".encode()).hexdigest()[:20]
+    resp.set_etag(tag, weak=True)
+    try:
+        resp.last_modified = datetime.fromisoformat(last_updated)
+    except (TypeError, ValueError):
+        pass
+    return resp.make_conditional(request)
+
+# helper: 304 response if the client's copy of a resource stamped last_updated
+# is current, None otherwise; lets an endpoint skip reading the whole document
+def not_modified(last_updated):
+    resp = conditional(current_app.response_class(), last_updated)
+    return resp if resp.status_code == 304 else None
+
+# helper: assign age group
+def age_group(age):
+    if age is None:
+        return "Unknown"
+    if age < 18:
+        return "Child"
+    elif age < 40:
+        return "Adult"
+    elif age < 65:
+        return "Middle-aged"
+    else:
+        return "Senior"